@@ -0,0 +1,125 @@
+# bench/bench_entity.py
+# Mide la resolución de entidades de src/entity.py sin base de datos: genera bloques
+# (departamento, municipio, servicio) sintéticos con nombres de prestadores y variantes
+# sucias del mismo nombre (espacios, puntos, tildes, E.S.P., typos), compara
+#   - todos contra todos dentro del bloque (referencia)
+#   - filtrado de prefijo de entity.similares (lo que corre el pipeline)
+# y falla si los pares difieren. Informa tiempos, pares/s y precisión/recall contra la
+# verdad del generador.
+#
+# Uso:
+#   python -m bench.bench_entity --rows 200000 --workers 4
+import argparse
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from src import entity
+
+PREFIJOS = ["ACUEDUCTO", "JUNTA ADMINISTRADORA DEL ACUEDUCTO", "ASOCIACIÓN DE USUARIOS DEL ACUEDUCTO",
+            "ACUEDUCTO VEREDAL", "EMPRESAS PÚBLICAS DE"]
+LUGARES = ["EL MACAL", "LA PALMA", "SAN JOSÉ", "LOS NARANJOS", "SANTA BÁRBARA", "LA ESPERANZA",
+           "EL PORVENIR", "BUENAVISTA", "LA CUCHILLA", "PEÑAS BLANCAS", "EL CARMEN", "ALTO BONITO"]
+
+
+def _sucio(rnd: random.Random, nombre: str) -> str:
+    """Variante del mismo prestador tal como llega de otra fuente."""
+    r = rnd.random()
+    if r < 0.25:
+        return nombre.replace(" ", "  ") + " ."
+    if r < 0.5:
+        return nombre + " E.S.P."
+    if r < 0.7:
+        return nombre.lower().replace("a", "á", 1)
+    i = rnd.randrange(len(nombre))
+    return nombre[:i] + nombre[i] + nombre[i:]  # letra duplicada
+
+
+def _fixture(rows: int, block: int, seed: int = 7):
+    """Lista de bloques [(provider_id, nombre)] y la verdad {provider_id: entidad}."""
+    rnd = random.Random(seed)
+    bloques, verdad, pid = [], {}, 0
+    while pid < rows:
+        filas = []
+        for e in range(rnd.randint(1, block)):
+            base = f"{rnd.choice(PREFIJOS)} {rnd.choice(LUGARES)} {rnd.choice(LUGARES)} {e}"
+            ent = f"{len(bloques)}:{e}"
+            for k in range(1 + (rnd.random() < 0.3) + (rnd.random() < 0.1)):
+                nombre = base if k == 0 else _sucio(rnd, base)
+                filas.append((f"{pid:032x}", nombre))
+                verdad[f"{pid:032x}"] = ent
+                pid += 1
+        bloques.append(filas)
+    return bloques, verdad
+
+
+def _todos_contra_todos(bloques, umbral):
+    """Referencia: Jaccard de trigramas para cada par de canónicos del bloque."""
+    pares = set()
+    for filas in bloques:
+        canon = {}
+        for p, nombre in filas:
+            canon.setdefault(entity.canonical(nombre), []).append(p)
+        claves = list(canon)
+        grams = [entity._trigramas(c) for c, _ in claves]
+        for i in range(len(claves)):
+            for j in range(i + 1, len(claves)):
+                inter = len(grams[i] & grams[j])
+                if (inter / (len(grams[i]) + len(grams[j]) - inter) >= umbral
+                        and claves[i][1] == claves[j][1]):
+                    pares.add((canon[claves[i]][0], canon[claves[j]][0]))
+    return pares
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=100000)
+    ap.add_argument("--block", type=int, default=60, help="entidades máximas por bloque")
+    ap.add_argument("--threshold", type=float, default=entity.ER_THRESHOLD)
+    ap.add_argument("--workers", type=int, default=entity.ER_WORKERS)
+    args = ap.parse_args()
+
+    bloques, verdad = _fixture(args.rows, args.block)
+    n = sum(len(b) for b in bloques)
+
+    t0 = time.perf_counter()
+    ref = _todos_contra_todos(bloques, args.threshold)
+    t_ref = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    pares = entity._pares_lote(bloques, args.threshold)
+    t_pref = time.perf_counter() - t0
+
+    lotes = [bloques[i:i + 500] for i in range(0, len(bloques), 500)]
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        par_mp = [p for r in pool.map(entity._pares_lote, lotes, [args.threshold] * len(lotes)) for p in r]
+    t_mp = time.perf_counter() - t0
+
+    similares = {(a, b) for a, b, s in pares if s < 1.0}
+    diff = len(similares ^ ref)
+
+    mapa = entity.clusters(pares)
+    cid = {p: mapa.get(p, (p, 1.0))[0] for p in verdad}
+    mismos_pred = mismos_real = acierto = 0
+    for filas in bloques:
+        ps = [p for p, _ in filas]
+        for i in range(len(ps)):
+            for j in range(i + 1, len(ps)):
+                pred, real = cid[ps[i]] == cid[ps[j]], verdad[ps[i]] == verdad[ps[j]]
+                mismos_pred += pred
+                mismos_real += real
+                acierto += pred and real
+
+    print(f"[bench_entity] filas={n} bloques={len(bloques)} umbral={args.threshold}")
+    print(f"  todos contra todos : {t_ref:8.2f}s")
+    print(f"  filtrado de prefijo: {t_pref:8.2f}s  ({t_ref / t_pref:.2f}x, {n / t_pref:,.0f} filas/s)")
+    print(f"  {args.workers} procesos        : {t_mp:8.2f}s  ({n / t_mp:,.0f} filas/s)")
+    print(f"  pares={len(pares)} clusters={len({c for c, _ in mapa.values()})} "
+          f"precisión={acierto / max(mismos_pred, 1):.3f} recall={acierto / max(mismos_real, 1):.3f}")
+    if diff or len(par_mp) != len(pares):
+        raise SystemExit(f"[bench_entity] {diff} pares difieren de la referencia")
+
+
+if __name__ == "__main__":
+    main()
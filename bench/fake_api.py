@@ -0,0 +1,73 @@
+# bench/fake_api.py
+# Servidor HTTP local que imita la API Socrata de prestadores ($limit/$offset,
+# $select=count(*)) con latencia artificial, fallos 429 opcionales y ETag/304.
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SERVICIOS = ["ACUEDUCTO", "ALCANTARILLADO", "ASEO"]
+
+
+def make_rows(n: int):
+    return [
+        {
+            "nombre": f"PRESTADOR {i}",
+            "departamento_prestacion": "ANTIOQUIA",
+            "municipio_prestacion": f"MUNICIPIO {i % 125}",
+            "servicio": SERVICIOS[i % 3],
+            "estado": "OPERATIVA",
+            "clasificacion": "ORGANIZACION AUTORIZADA",
+        }
+        for i in range(n)
+    ]
+
+
+def start(rows: int = 20000, latency: float = 0.2, fail_rate: float = 0.0, port: int = 0, data=None):
+    """Arranca el servidor en un hilo; devuelve (server, url). `data` reemplaza las filas generadas."""
+    data = make_rows(rows) if data is None else data
+    stats = {"requests": 0, "429": 0, "304": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code: int, body: bytes = b"", headers=None):
+            self.send_response(code)
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            time.sleep(latency)
+            with lock:
+                stats["requests"] += 1
+            if fail_rate and random.random() < fail_rate:
+                with lock:
+                    stats["429"] += 1
+                return self._send(429)
+            q = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+            if q.get("$select") == "count(*)":
+                payload = [{"count": str(len(data))}]
+            else:
+                off = int(q.get("$offset", 0))
+                lim = int(q.get("$limit", 1000))
+                payload = data[off:off + lim]
+            body = json.dumps(payload).encode()
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+            if self.headers.get("If-None-Match") == etag:
+                with lock:
+                    stats["304"] += 1
+                return self._send(304, headers={"ETag": etag})
+            self._send(200, body, {"Content-Type": "application/json", "ETag": etag})
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.stats = stats
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/resource.json"
@@ -0,0 +1,291 @@
+# bench/synth.py
+# Generador de datos sintéticos para benchmarks end-to-end:
+#   - prestadores.csv : estilo RUPS (mismas columnas que OLD_FILE.csv)
+#   - calidad.csv     : histórico de calidad de agua (fecha 'YYYY Mon DD HH:MI:SS AM')
+#   - api/page-*.json : páginas de la API de prestadores ($limit/$offset)
+# con valores sucios (tildes, mayúsculas/espacios, vacíos, departamentos fuera de
+# catálogo), duplicados y pH/cloro/coordenadas fuera de rango.
+#
+# Escala 1× ≈ tamaño de las fuentes reales; 10×/100×/1000× multiplican las filas.
+# Se genera por bloques con numpy (memoria acotada, reproducible por semilla).
+#
+# Uso:
+#   python -m bench.synth --scale 10 --out data/synth/x10
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Filas a escala 1×
+BASE_ROWS = {"prestadores": 13_000, "calidad": 100_000, "api": 10_000}
+SCALES = (1, 10, 100, 1000)
+BLOCK = 200_000
+API_PAGE = 5000
+
+DEPTOS = [
+    "AMAZONAS", "ANTIOQUIA", "ARAUCA", "ATLANTICO", "BOLIVAR", "BOYACA", "CALDAS", "CAQUETA",
+    "CASANARE", "CAUCA", "CESAR", "CHOCO", "CORDOBA", "CUNDINAMARCA", "GUAINIA", "GUAJIRA",
+    "GUAVIARE", "HUILA", "MAGDALENA", "META", "NARINO", "NORTE DE SANTANDER", "PUTUMAYO",
+    "QUINDIO", "RISARALDA", "SAN ANDRES Y PROVIDENCIA", "SANTANDER", "SUCRE", "TOLIMA",
+    "VALLE DEL CAUCA", "VAUPES", "VICHADA", "BOGOTA D.C.",
+]
+# Variantes sucias que deben normalizar al mismo valor
+_TILDES = {
+    "ATLANTICO": "Atlántico", "BOLIVAR": "Bolívar", "BOYACA": "Boyacá", "CAQUETA": "Caquetá",
+    "CHOCO": "Chocó", "CORDOBA": "Córdoba", "GUAINIA": "Guainía", "NARINO": "Nariño",
+    "QUINDIO": "Quindío", "VAUPES": "Vaupés", "BOGOTA D.C.": "Bogotá D.C.",
+}
+FUERA_CATALOGO = ["ATLANTIS", "SIN INFORMACION", "N/A"]
+
+SERVICIOS = ["ASEO", "ACUEDUCTO", "Inscripción Oficio Delegada AAA", "ALCANTARILLADO",
+             "ENERGIA ELECTRICA", "GAS NATURAL"]
+P_SERVICIOS = [0.35, 0.25, 0.24, 0.11, 0.03, 0.02]
+ESTADOS = ["OPERATIVA", "CANCELACION", "EN PROCESO DE LIQUIDACION", "INACTIVA", ""]
+P_ESTADOS = [0.71, 0.04, 0.005, 0.005, 0.24]
+CLASIFICACIONES = ["MENOR O IGUAL A 2500 USUARIOS", "MAYOR O IGUAL A 5001 USUARIOS",
+                   "HASTA 2500 SUSCRIPTORES", "DESDE 2501 HASTA 5000 USUARIOS", "SIN CLASIFICACION", ""]
+P_CLASIF = [0.28, 0.23, 0.10, 0.06, 0.04, 0.29]
+TIPOS = ["SOCIEDADES (EMPRESA DE SERVICIOS PUBLICOS)", "ORGANIZACION AUTORIZADA",
+         "MUNICIPIO (PRESTACIÓN DIRECTA)", "EMPRESA INDUSTRIAL Y COMERCIAL DEL ESTADO", ""]
+P_TIPOS = [0.30, 0.28, 0.08, 0.05, 0.29]
+NOMBRES = ["ACUEDUCTO", "JUNTA ADMINISTRADORA", "ASOCIACIÓN DE USUARIOS", "EMPRESAS PÚBLICAS",
+           "ACUASALUD", "JUNTA DE ACCIÓN COMUNAL"]
+
+RUPS_COLS = ["DEPARTAMENTO_PRESTACION", "MUNICIPIO_PRESTACION", "SERVICIO", "ESTADO", "NOMBRE", "NIT",
+             "DEPARTAMENTO_DOMICILIO", "MUNICIPIO_DOMICILIO", "DIRECCION", "TELEFONO", "EMAIL",
+             "TIPO_INSCRIPCION", "REPRESENTANTE_LEGAL", "TIPO_PRESTADOR", "CLASIFICACION"]
+
+# (nombre en la fuente, unidad, rango normal, rango "sucio" fuera de regla)
+PARAMETROS = [
+    ("pH", "Unidades de pH", (6.0, 9.0), (-1.0, 15.0)),
+    ("Cloro Residual Libre", "mg/L", (0.2, 2.0), (6.0, 9.0)),
+    ("Turbidez", "UNT", (0.1, 5.0), (-3.0, -0.1)),
+    ("Conductividad", "uS/cm", (50.0, 1000.0), (-50.0, -1.0)),
+    ("Dureza", "mg/L CaCO3", (20.0, 300.0), (-10.0, -1.0)),
+    ("Alcalinidad", "mg/L CaCO3", (10.0, 200.0), (-5.0, -1.0)),
+    ("Color Aparente", "UPC", (0.0, 25.0), (0.0, 25.0)),
+]
+CALIDAD_COLS = ["Departamento", "Municipio", "Fecha", "Propiedad Observada", "Resultado",
+                "Unidad del Resultado", "Nombre del Punto de Monitoreo", "Latitud", "Longitud"]
+MESES = np.array(["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"])
+
+
+def rows_for(scale: int) -> dict:
+    return {k: v * scale for k, v in BASE_ROWS.items()}
+
+
+def _ensuciar(rng, valores: np.ndarray) -> np.ndarray:
+    """Tildes, minúsculas/título y espacios sobrantes sobre ~30% de los valores."""
+    out = valores.astype(object)
+    r = rng.random(len(out))
+    tild = r < 0.10
+    out[tild] = [_TILDES.get(v, v) for v in out[tild]]
+    low = (r >= 0.10) & (r < 0.17)
+    out[low] = [v.lower() for v in out[low]]
+    tit = (r >= 0.17) & (r < 0.24)
+    out[tit] = [v.title() for v in out[tit]]
+    esp = (r >= 0.24) & (r < 0.30)
+    out[esp] = [f"  {v} " for v in out[esp]]
+    return out
+
+
+def _deptos(rng, n: int, p_fuera: float = 0.01, p_vacio: float = 0.0) -> np.ndarray:
+    d = np.array(DEPTOS, dtype=object)[rng.integers(0, len(DEPTOS), n)]
+    d = _ensuciar(rng, d)
+    r = rng.random(n)
+    fuera = r < p_fuera
+    d[fuera] = np.array(FUERA_CATALOGO, dtype=object)[rng.integers(0, len(FUERA_CATALOGO), fuera.sum())]
+    d[(r >= p_fuera) & (r < p_fuera + p_vacio)] = ""
+    return d
+
+
+def _duplicar(rng, df: pd.DataFrame, frac: float) -> pd.DataFrame:
+    """Reemplaza ~frac de las filas por copias de otras filas del bloque (duplicados exactos)."""
+    n = len(df)
+    k = int(n * frac)
+    if k == 0:
+        return df
+    dst = rng.choice(n, k, replace=False)
+    src = rng.integers(0, n, k)
+    df.iloc[dst] = df.iloc[src].to_numpy()
+    return df
+
+
+def prestadores_block(n: int, seed: int, start: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    ids = np.arange(start, start + n)
+    dep = _deptos(rng, n, p_fuera=0.01, p_vacio=0.28)
+    muni = np.char.add("MUNICIPIO ", (ids % 1100).astype(str)).astype(object)
+    muni = _ensuciar(rng, muni)
+    muni[dep == ""] = ""
+    nombre = np.char.add(
+        np.char.add(np.array(NOMBRES)[(ids // 3) % len(NOMBRES)], " "),
+        (ids // 3).astype(str),  # ~3 servicios por prestador
+    ).astype(object)
+    nit = np.char.add(np.char.add((900_000_000 + ids // 3).astype(str), "-"), (ids // 3 % 10).astype(str)).astype(object)
+    nit[rng.random(n) < 0.15] = "-"
+    tel = rng.integers(1_000_000, 9_999_999, n).astype(str).astype(object)
+    tel[rng.random(n) < 0.25] = ""
+    df = pd.DataFrame({
+        "DEPARTAMENTO_PRESTACION": dep,
+        "MUNICIPIO_PRESTACION": muni,
+        "SERVICIO": rng.choice(SERVICIOS, n, p=P_SERVICIOS),
+        "ESTADO": rng.choice(ESTADOS, n, p=P_ESTADOS),
+        "NOMBRE": nombre,
+        "NIT": nit,
+        "DEPARTAMENTO_DOMICILIO": _deptos(rng, n),
+        "MUNICIPIO_DOMICILIO": muni,
+        "DIRECCION": np.char.add("CALLE ", rng.integers(1, 200, n).astype(str)),
+        "TELEFONO": tel,
+        "EMAIL": np.where(tel == "", "", np.char.add(np.char.add("contacto", (ids // 3).astype(str)), "@prestador.co")),
+        "TIPO_INSCRIPCION": np.where(rng.random(n) < 0.75, "Registro por la ESP", "Registro por oficio"),
+        "REPRESENTANTE_LEGAL": np.where(rng.random(n) < 0.5, "REPRESENTANTE LEGAL", ""),
+        "TIPO_PRESTADOR": rng.choice(TIPOS, n, p=P_TIPOS),
+        "CLASIFICACION": rng.choice(CLASIFICACIONES, n, p=P_CLASIF),
+    })
+    return _duplicar(rng, df, 0.03)
+
+
+def _fechas(rng, n: int) -> np.ndarray:
+    year = rng.integers(2005, 2026, n)
+    mes = rng.integers(0, 12, n)
+    dia = rng.integers(1, 29, n)
+    hora = rng.integers(1, 13, n)
+    r = rng.random(n)
+    year = np.where(r < 0.02, 1995, year)                       # fuera de rango (antes de 2000)
+    year = np.where((r >= 0.02) & (r < 0.03), 2031, year)       # futuro
+    socrata = pd.Series(year.astype(str)) + " " + MESES[mes] + " " + pd.Series(dia).map("{:02d}".format) \
+        + " " + pd.Series(hora).map("{:02d}".format) + ":00:00 " + np.where(rng.random(n) < 0.5, "AM", "PM")
+    iso = pd.Series(year.astype(str)) + "-" + pd.Series(mes + 1).map("{:02d}".format) + "-" \
+        + pd.Series(dia).map("{:02d}".format)
+    out = np.where(r < 0.88, socrata, iso).astype(object)
+    out[r > 0.99] = "N/A"
+    return out
+
+
+def calidad_block(n: int, seed: int, start: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    dep = _deptos(rng, n, p_fuera=0.01, p_vacio=0.005)
+    muni = _ensuciar(rng, np.char.add("MUNICIPIO ", rng.integers(0, 40, n).astype(str)).astype(object))
+
+    pi = rng.integers(0, len(PARAMETROS), n)
+    sucio = rng.random(n) < 0.04
+    lo = np.array([p[2][0] for p in PARAMETROS])[pi]
+    hi = np.array([p[2][1] for p in PARAMETROS])[pi]
+    lo_s = np.array([p[3][0] for p in PARAMETROS])[pi]
+    hi_s = np.array([p[3][1] for p in PARAMETROS])[pi]
+    u = rng.random(n)
+    valor = np.where(sucio, lo_s + u * (hi_s - lo_s), lo + u * (hi - lo))
+    res = pd.Series(np.round(valor, 2)).astype(str).to_numpy(dtype=object)
+    r = rng.random(n)
+    res[r < 0.03] = ""
+    res[(r >= 0.03) & (r < 0.05)] = "N.D."
+    menor = (r >= 0.05) & (r < 0.06)
+    res[menor] = ["<" + v for v in res[menor]]
+    coma = (r >= 0.06) & (r < 0.08)
+    res[coma] = [v.replace(".", ",") for v in res[coma]]
+
+    unidad = np.array([p[1] for p in PARAMETROS], dtype=object)[pi]
+    unidad[rng.random(n) < 0.10] = ""
+    param = np.array([p[0] for p in PARAMETROS], dtype=object)[pi]
+    param = np.where(rng.random(n) < 0.1, np.char.upper(param.astype(str)), param)
+
+    lat = np.round(rng.uniform(-4.2, 12.5, n), 5).astype(str).astype(object)
+    lon = np.round(rng.uniform(-79.0, -67.0, n), 5).astype(str).astype(object)
+    r = rng.random(n)
+    lat[r < 0.02] = ""
+    lon[r < 0.02] = ""
+    lon[(r >= 0.02) & (r < 0.05)] = ""                               # sin pareja
+    lat[(r >= 0.05) & (r < 0.08)] = "45.0"                           # fuera de Colombia
+
+    punto = np.char.add(np.where(rng.random(n) < 0.5, "PLANTA ", "RED "), rng.integers(0, 30, n).astype(str)).astype(object)
+    punto[rng.random(n) < 0.15] = ""
+
+    df = pd.DataFrame({
+        "Departamento": dep,
+        "Municipio": muni,
+        "Fecha": _fechas(rng, n),
+        "Propiedad Observada": param,
+        "Resultado": res,
+        "Unidad del Resultado": unidad,
+        "Nombre del Punto de Monitoreo": punto,
+        "Latitud": lat,
+        "Longitud": lon,
+    })
+    return _duplicar(rng, df, 0.05)
+
+
+def api_block(n: int, seed: int, start: int = 0) -> pd.DataFrame:
+    df = prestadores_block(n, seed, start)
+    return pd.DataFrame({
+        "nombre": df["NOMBRE"],
+        "departamento_prestacion": df["DEPARTAMENTO_PRESTACION"],
+        "municipio_prestacion": df["MUNICIPIO_PRESTACION"],
+        "departamento_domicilio": df["DEPARTAMENTO_DOMICILIO"],
+        "municipio_domicilio": df["MUNICIPIO_DOMICILIO"],
+        "servicio": df["SERVICIO"],
+        "estado": df["ESTADO"],
+        "clasificacion": df["CLASIFICACION"],
+    })
+
+
+def _blocks(fn, total: int, seed: int):
+    for i, start in enumerate(range(0, total, BLOCK)):
+        yield fn(min(BLOCK, total - start), seed * 1000 + i, start)
+
+
+def write_csv(fn, total: int, path: Path, seed: int) -> int:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    n = 0
+    with open(path, "w", encoding="utf-8", newline="") as fh:
+        for i, df in enumerate(_blocks(fn, total, seed)):
+            df.to_csv(fh, index=False, header=(i == 0))
+            n += len(df)
+    return n
+
+
+def write_api_pages(total: int, out: Path, seed: int, page: int = API_PAGE) -> int:
+    out.mkdir(parents=True, exist_ok=True)
+    n = 0
+    for df in _blocks(api_block, total, seed):
+        for off in range(0, len(df), page):
+            recs = df.iloc[off:off + page].to_dict(orient="records")
+            (out / f"page-{(n + off) // page:05d}.json").write_text(json.dumps(recs, ensure_ascii=False), encoding="utf-8")
+        n += len(df)
+    return n
+
+
+def api_rows(total: int, seed: int):
+    """Filas de la API en memoria (para bench.fake_api)."""
+    return [r for df in _blocks(api_block, total, seed) for r in df.to_dict(orient="records")]
+
+
+def generate(scale: int, out: Path, seed: int = 7, api_pages: bool = True) -> dict:
+    n = rows_for(scale)
+    t0 = time.perf_counter()
+    res = {
+        "prestadores": write_csv(prestadores_block, n["prestadores"], out / "prestadores.csv", seed),
+        "calidad": write_csv(calidad_block, n["calidad"], out / "calidad.csv", seed + 1),
+    }
+    if api_pages:
+        res["api"] = write_api_pages(n["api"], out / "api", seed + 2)
+    print(f"[synth] x{scale} → {out} {res} en {time.perf_counter() - t0:.1f}s")
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--scale", type=int, default=1, choices=SCALES)
+    ap.add_argument("--out", default=None, help="carpeta de salida (default: data/synth/x<scale>)")
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--no-api", action="store_true", help="no escribir las páginas JSON de la API")
+    args = ap.parse_args()
+    out = Path(args.out or f"data/synth/x{args.scale}")
+    generate(args.scale, out, args.seed, api_pages=not args.no_api)
+
+
+if __name__ == "__main__":
+    main()
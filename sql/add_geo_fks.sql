@@ -1,29 +1,54 @@
 -- sql/add_geo_fks.sql
--- Asegura que dim_geo cubre TODAS las geos de las dimensiones, agrega FKs y valida.
+-- Asegura que dim_geo cubre TODAS las geos de las dimensiones, completa geo_id y agrega
+-- FKs enteras (geo_id → dim_geo.geo_id) en vez de sobre el par TEXT (departamento, municipio).
 
 BEGIN;
 
+SELECT pg_advisory_xact_lock(74201);
+
 -- 1) Asegurar que dim_geo contiene TODAS las combinaciones (dep,mun) de las dims
-INSERT INTO dim_geo (departamento, municipio)
-SELECT DISTINCT departamento, municipio FROM dim_prestadores
-ON CONFLICT (departamento, municipio) DO NOTHING;
+WITH geos AS (
+  SELECT departamento, municipio FROM dim_prestadores
+  UNION
+  SELECT departamento, municipio FROM dim_prestacion_geo
+  UNION
+  SELECT departamento, municipio FROM dim_calidad_geo
+),
+faltan AS (
+  SELECT g.departamento, g.municipio
+  FROM geos g
+  LEFT JOIN dim_geo d USING (departamento, municipio)
+  WHERE d.geo_id IS NULL
+)
+INSERT INTO dim_geo (geo_id, departamento, municipio)
+SELECT (SELECT COALESCE(MAX(geo_id), 0) FROM dim_geo)
+         + ROW_NUMBER() OVER (ORDER BY f.departamento, f.municipio),
+       f.departamento, f.municipio
+FROM faltan f
+ON CONFLICT (departamento, municipio) DO UPDATE SET geo_id = EXCLUDED.geo_id
+WHERE dim_geo.geo_id IS NULL;
+
+-- 2) geo_id en las filas de las dims que aún no lo tienen (p. ej. anteriores a geo_id)
+UPDATE dim_prestadores d SET geo_id = g.geo_id
+FROM dim_geo g
+WHERE d.geo_id IS NULL AND g.departamento = d.departamento AND g.municipio = d.municipio;
 
-INSERT INTO dim_geo (departamento, municipio)
-SELECT DISTINCT departamento, municipio FROM dim_prestacion_geo
-ON CONFLICT (departamento, municipio) DO NOTHING;
+UPDATE dim_prestacion_geo d SET geo_id = g.geo_id
+FROM dim_geo g
+WHERE d.geo_id IS NULL AND g.departamento = d.departamento AND g.municipio = d.municipio;
 
-INSERT INTO dim_geo (departamento, municipio)
-SELECT DISTINCT departamento, municipio FROM dim_calidad_geo
-ON CONFLICT (departamento, municipio) DO NOTHING;
+UPDATE dim_calidad_geo d SET geo_id = g.geo_id
+FROM dim_geo g
+WHERE d.geo_id IS NULL AND g.departamento = d.departamento AND g.municipio = d.municipio;
 
--- 2) Eliminar FKs anteriores (si existen) y agregar FKs como NOT VALID
+-- 3) Eliminar FKs anteriores (si existen) y agregar FKs sobre geo_id como NOT VALID
 ALTER TABLE IF EXISTS dim_prestadores
   DROP CONSTRAINT IF EXISTS fk_dim_prestadores_geo;
 
 ALTER TABLE IF EXISTS dim_prestadores
   ADD CONSTRAINT fk_dim_prestadores_geo
-  FOREIGN KEY (departamento, municipio)
-  REFERENCES dim_geo (departamento, municipio)
+  FOREIGN KEY (geo_id)
+  REFERENCES dim_geo (geo_id)
   NOT VALID;
 
 ALTER TABLE IF EXISTS dim_prestacion_geo
@@ -31,8 +56,8 @@ ALTER TABLE IF EXISTS dim_prestacion_geo
 
 ALTER TABLE IF EXISTS dim_prestacion_geo
   ADD CONSTRAINT fk_dim_prestacion_geo
-  FOREIGN KEY (departamento, municipio)
-  REFERENCES dim_geo (departamento, municipio)
+  FOREIGN KEY (geo_id)
+  REFERENCES dim_geo (geo_id)
   NOT VALID;
 
 ALTER TABLE IF EXISTS dim_calidad_geo
@@ -40,13 +65,38 @@ ALTER TABLE IF EXISTS dim_calidad_geo
 
 ALTER TABLE IF EXISTS dim_calidad_geo
   ADD CONSTRAINT fk_dim_calidad_geo
-  FOREIGN KEY (departamento, municipio)
-  REFERENCES dim_geo (departamento, municipio)
+  FOREIGN KEY (geo_id)
+  REFERENCES dim_geo (geo_id)
   NOT VALID;
 
+-- fact_calidad (src/load.py) también lleva geo_id. Con CALIDAD_PARTITIONS es una tabla
+-- particionada y Postgres no acepta NOT VALID ahí: se crea validada (recorre cada partición).
+ALTER TABLE IF EXISTS fact_calidad
+  DROP CONSTRAINT IF EXISTS fk_fact_calidad_geo;
+
+DO $$
+DECLARE
+  k "char" := (SELECT relkind FROM pg_class WHERE oid = to_regclass('fact_calidad'));
+BEGIN
+  IF k = 'p' THEN
+    ALTER TABLE fact_calidad
+      ADD CONSTRAINT fk_fact_calidad_geo FOREIGN KEY (geo_id) REFERENCES dim_geo (geo_id);
+  ELSIF k = 'r' THEN
+    ALTER TABLE fact_calidad
+      ADD CONSTRAINT fk_fact_calidad_geo FOREIGN KEY (geo_id) REFERENCES dim_geo (geo_id) NOT VALID;
+  END IF;
+END $$;
+
 COMMIT;
 
--- 3) Validar fuera de la transacción (menos locks; si algo falla, te dirá el detalle)
+-- 4) Validar fuera de la transacción (menos locks; si algo falla, te dirá el detalle)
 ALTER TABLE IF EXISTS dim_prestadores    VALIDATE CONSTRAINT fk_dim_prestadores_geo;
 ALTER TABLE IF EXISTS dim_prestacion_geo VALIDATE CONSTRAINT fk_dim_prestacion_geo;
 ALTER TABLE IF EXISTS dim_calidad_geo    VALIDATE CONSTRAINT fk_dim_calidad_geo;
+-- fact_calidad particionada ya quedó validada al crearla
+DO $$
+BEGIN
+  IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('fact_calidad')) = 'r' THEN
+    ALTER TABLE fact_calidad VALIDATE CONSTRAINT fk_fact_calidad_geo;
+  END IF;
+END $$;
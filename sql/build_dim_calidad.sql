@@ -1,86 +1,136 @@
 BEGIN;
 
+-- clean_calidad puede estar particionada por fecha_muestra (CALIDAD_PARTITIONS):
+-- los agregados por (departamento, municipio) se calculan parcialmente por partición.
+SET LOCAL enable_partitionwise_aggregate = on;
+SET LOCAL enable_partitionwise_join = on;
+
 CREATE TABLE IF NOT EXISTS dim_calidad_geo (
   departamento TEXT NOT NULL,
   municipio    TEXT NOT NULL,
   fecha_ult_muestra DATE,
-  -- estados básicos por parámetro clave (añade más si quieres)
+  -- estados básicos por parámetro clave (límites en calidad_limites)
   estado_ph     TEXT,   -- OK / ALERTA / SIN_DATO
   estado_cloro  TEXT,   -- OK / ALERTA / SIN_DATO
   -- métricas
   puntos_monitoreo INT,
   mediciones INT,
   parametros_distintos INT,
+  geo_id       INTEGER,   -- dim_geo.geo_id (src/geo.py)
   PRIMARY KEY (departamento, municipio)
 );
+ALTER TABLE dim_calidad_geo ADD COLUMN IF NOT EXISTS geo_id INTEGER;
+
+-- Límites por grupo de parámetro (editables; el build no pisa cambios manuales).
+-- `patron` es un LIKE sobre el parametro ya normalizado (mismas reglas que el transform).
+CREATE TABLE IF NOT EXISTS calidad_limites (
+  grupo     TEXT PRIMARY KEY,   -- PH → estado_ph, CLORO → estado_cloro
+  patron    TEXT NOT NULL,
+  valor_min DOUBLE PRECISION,
+  valor_max DOUBLE PRECISION
+);
+INSERT INTO calidad_limites (grupo, patron, valor_min, valor_max) VALUES
+  ('PH',    'PH',     0, 14),
+  ('CLORO', 'CLORO%', 0, 5)
+ON CONFLICT (grupo) DO NOTHING;
+
+-- Marca de agua por dimensión: hasta qué refresh de clean_calidad_agg ya se procesó
+-- (refreshed_at de clean_calidad_agg_log)
+CREATE TABLE IF NOT EXISTS dim_build_state (
+  dim      TEXT PRIMARY KEY,
+  built_at TIMESTAMPTZ NOT NULL
+);
+
+-- Modo: incremental (default) recalcula solo los municipios que tenían muestras antes
+-- o después en fechas que transform_calidad recalculó desde el último build
+-- (clean_calidad_agg_log); full recalcula todos.
+--   PGOPTIONS='-c etl.dim_calidad_mode=full' psql ... -f build_dim_calidad.sql
+CREATE TEMP TABLE _dim_cal_modo ON COMMIT DROP AS
+SELECT COALESCE(NULLIF(current_setting('etl.dim_calidad_mode', true), ''), 'incremental') = 'full' AS completo;
+
+CREATE TEMP TABLE _dim_cal_muni ON COMMIT DROP AS
+SELECT DISTINCT l.departamento, l.municipio
+FROM clean_calidad_agg_log l
+WHERE NOT (SELECT completo FROM _dim_cal_modo)
+  AND l.refreshed_at > COALESCE(
+        (SELECT built_at FROM dim_build_state WHERE dim = 'dim_calidad_geo'), '-infinity');
+ANALYZE _dim_cal_muni;
 
-WITH base AS (
+WITH lim AS (
   SELECT
-    UPPER(TRIM(departamento))  AS departamento,
-    UPPER(TRIM(municipio))     AS municipio,
-    parametro,
-    valor,
-    fecha_muestra              AS fecha
-  FROM clean_calidad
-  WHERE departamento IS NOT NULL AND municipio IS NOT NULL
+    MAX(patron)    FILTER (WHERE grupo = 'PH')    AS ph_patron,
+    MAX(valor_min) FILTER (WHERE grupo = 'PH')    AS ph_min,
+    MAX(valor_max) FILTER (WHERE grupo = 'PH')    AS ph_max,
+    MAX(patron)    FILTER (WHERE grupo = 'CLORO') AS cl_patron,
+    MAX(valor_min) FILTER (WHERE grupo = 'CLORO') AS cl_min,
+    MAX(valor_max) FILTER (WHERE grupo = 'CLORO') AS cl_max
+  FROM calidad_limites
 ),
-ult AS (
-  SELECT departamento, municipio, MAX(fecha) AS fecha_ult_muestra
-  FROM base
-  GROUP BY 1,2
-),
-m_ph AS (
-  SELECT b.departamento, b.municipio,
-         CASE
-           WHEN MAX(CASE WHEN b.parametro ILIKE '%PH%' THEN 1 END) IS NULL THEN 'SIN_DATO'
-           WHEN EXISTS (
-             SELECT 1 FROM base x
-             WHERE x.departamento=b.departamento AND x.municipio=b.municipio
-               AND x.parametro ILIKE '%PH%'
-               AND (x.valor < 0 OR x.valor > 14)
-           ) THEN 'ALERTA'
-           ELSE 'OK'
-         END AS estado_ph
-  FROM base b GROUP BY 1,2
-),
-m_cl AS (
-  SELECT b.departamento, b.municipio,
-         CASE
-           WHEN MAX(CASE WHEN b.parametro ILIKE '%CLORO%' THEN 1 END) IS NULL THEN 'SIN_DATO'
-           WHEN EXISTS (
-             SELECT 1 FROM base x
-             WHERE x.departamento=b.departamento AND x.municipio=b.municipio
-               AND x.parametro ILIKE '%CLORO%' AND (x.valor < 0 OR x.valor > 5)
-           ) THEN 'ALERTA'
-           ELSE 'OK'
-         END AS estado_cloro
-  FROM base b GROUP BY 1,2
+-- Solo una de las dos ramas corre (filtro de una vez sobre _dim_cal_modo); la
+-- incremental entra por idx_clean_calidad_geo_fecha para cada municipio tocado.
+src AS (
+  SELECT c.departamento, c.municipio, c.parametro, c.valor, c.fecha_muestra, c.nombre_punto
+  FROM clean_calidad c
+  WHERE (SELECT completo FROM _dim_cal_modo)
+  UNION ALL
+  SELECT c.departamento, c.municipio, c.parametro, c.valor, c.fecha_muestra, c.nombre_punto
+  FROM _dim_cal_muni t
+  JOIN clean_calidad c ON c.departamento = t.departamento AND c.municipio = t.municipio
 ),
-agg AS (
+-- Una sola pasada agrupada: estados por agregados condicionales, sin EXISTS por grupo
+g AS (
   SELECT
-    departamento, municipio,
-    COUNT(*)                                  AS mediciones,
-    COUNT(DISTINCT parametro)                 AS parametros_distintos,
-    COUNT(DISTINCT COALESCE(nombre_punto,'')) AS puntos_monitoreo
-  FROM clean_calidad
+    s.departamento, s.municipio,
+    MAX(s.fecha_muestra)                                                          AS fecha_ult_muestra,
+    bool_or(s.parametro LIKE l.ph_patron)                                         AS hay_ph,
+    bool_or(s.parametro LIKE l.ph_patron AND (s.valor < l.ph_min OR s.valor > l.ph_max)) AS alerta_ph,
+    bool_or(s.parametro LIKE l.cl_patron)                                         AS hay_cl,
+    bool_or(s.parametro LIKE l.cl_patron AND (s.valor < l.cl_min OR s.valor > l.cl_max)) AS alerta_cl,
+    COUNT(*)                                                                      AS mediciones,
+    COUNT(DISTINCT s.parametro)                                                   AS parametros_distintos,
+    COUNT(DISTINCT COALESCE(s.nombre_punto,''))                                   AS puntos_monitoreo
+  FROM src s
+  CROSS JOIN lim l
+  WHERE s.departamento IS NOT NULL AND s.municipio IS NOT NULL
   GROUP BY 1,2
 )
 INSERT INTO dim_calidad_geo AS d
-(departamento, municipio, fecha_ult_muestra, estado_ph, estado_cloro, puntos_monitoreo, mediciones, parametros_distintos)
+(departamento, municipio, fecha_ult_muestra, estado_ph, estado_cloro, puntos_monitoreo, mediciones, parametros_distintos, geo_id)
 SELECT
-  u.departamento, u.municipio, u.fecha_ult_muestra,
-  p.estado_ph, c.estado_cloro,
-  COALESCE(a.puntos_monitoreo,0), COALESCE(a.mediciones,0), COALESCE(a.parametros_distintos,0)
-FROM ult u
-LEFT JOIN m_ph p USING(departamento, municipio)
-LEFT JOIN m_cl c USING(departamento, municipio)
-LEFT JOIN agg  a USING(departamento, municipio)
+  departamento, municipio, fecha_ult_muestra,
+  CASE WHEN hay_ph IS NOT TRUE THEN 'SIN_DATO' WHEN alerta_ph THEN 'ALERTA' ELSE 'OK' END,
+  CASE WHEN hay_cl IS NOT TRUE THEN 'SIN_DATO' WHEN alerta_cl THEN 'ALERTA' ELSE 'OK' END,
+  puntos_monitoreo, mediciones, parametros_distintos,
+  dg.geo_id
+FROM g
+LEFT JOIN dim_geo dg USING (departamento, municipio)
 ON CONFLICT (departamento, municipio) DO UPDATE SET
   fecha_ult_muestra    = EXCLUDED.fecha_ult_muestra,
   estado_ph            = EXCLUDED.estado_ph,
   estado_cloro         = EXCLUDED.estado_cloro,
   puntos_monitoreo     = EXCLUDED.puntos_monitoreo,
   mediciones           = EXCLUDED.mediciones,
-  parametros_distintos = EXCLUDED.parametros_distintos;
+  parametros_distintos = EXCLUDED.parametros_distintos,
+  geo_id               = EXCLUDED.geo_id;
+
+-- Municipios que ya no tienen muestras en clean_calidad (todos en modo full, los
+-- tocados en incremental): su fila quedaría con métricas viejas
+DELETE FROM dim_calidad_geo d
+WHERE ((SELECT completo FROM _dim_cal_modo)
+       OR EXISTS (SELECT 1 FROM _dim_cal_muni t
+                  WHERE t.departamento = d.departamento AND t.municipio = d.municipio))
+  AND NOT EXISTS (SELECT 1 FROM clean_calidad c
+                  WHERE c.departamento = d.departamento AND c.municipio = d.municipio);
+
+-- Avanza la marca de agua hasta el último refresh visible en esta transacción y
+-- descarta del log lo ya procesado
+INSERT INTO dim_build_state (dim, built_at)
+SELECT 'dim_calidad_geo', MAX(refreshed_at)
+FROM clean_calidad_agg_log
+HAVING MAX(refreshed_at) IS NOT NULL
+ON CONFLICT (dim) DO UPDATE SET built_at = EXCLUDED.built_at;
+
+DELETE FROM clean_calidad_agg_log
+WHERE refreshed_at <= (SELECT built_at FROM dim_build_state WHERE dim = 'dim_calidad_geo');
 
 COMMIT;
@@ -2,21 +2,49 @@
 -- Crea la dimensión geográfica central y la puebla desde las tablas limpias
 BEGIN;
 
+-- dim_base_prestadores (base normalizada de clean_staging) la arma sql/dim_base.sql;
+-- src/dims.py la corre antes y la borra al terminar. A mano: python -m src.dims --only <nodo>
+DO $$
+BEGIN
+  IF to_regclass('dim_base_prestadores') IS NULL THEN
+    RAISE EXCEPTION 'dim_base_prestadores no existe: correr con python -m src.dims (o psql -f sql/dim_base.sql antes)';
+  END IF;
+END $$;
+
+-- geo_id: clave entera compacta que llevan dimensiones y hechos. Normalmente ya la
+-- asignó el transform (src/geo.py); aquí solo se numeran los pares que falten.
 CREATE TABLE IF NOT EXISTS dim_geo (
+  geo_id       INTEGER,
   departamento TEXT NOT NULL,
   municipio    TEXT NOT NULL,
   CONSTRAINT pk_dim_geo PRIMARY KEY (departamento, municipio)
 );
+ALTER TABLE dim_geo ADD COLUMN IF NOT EXISTS geo_id INTEGER;
+CREATE UNIQUE INDEX IF NOT EXISTS uq_dim_geo_id ON dim_geo(geo_id);
+
+-- misma clave de advisory lock que src/geo.py: nadie más numera mientras tanto
+SELECT pg_advisory_xact_lock(74201);
 
--- Población inicial desde clean_* (normalmente ya normalizadas en transform)
+-- Población desde la base normalizada de prestadores (sql/dim_base.sql) y desde
+-- dim_calidad_geo, que ya tiene un municipio por fila (src/dims.py corre esto después
+-- de las dimensiones, sin volver a recorrer clean_calidad)
 WITH geos AS (
-  SELECT DISTINCT departamento, municipio FROM clean_staging
+  SELECT DISTINCT departamento, municipio FROM dim_base_prestadores
   UNION
-  SELECT DISTINCT departamento, municipio FROM clean_calidad
+  SELECT departamento, municipio FROM dim_calidad_geo
+),
+faltan AS (
+  SELECT g.departamento, g.municipio
+  FROM geos g
+  LEFT JOIN dim_geo d USING (departamento, municipio)
+  WHERE d.geo_id IS NULL
 )
-INSERT INTO dim_geo (departamento, municipio)
-SELECT g.departamento, g.municipio
-FROM geos g
-ON CONFLICT (departamento, municipio) DO NOTHING;
+INSERT INTO dim_geo (geo_id, departamento, municipio)
+SELECT (SELECT COALESCE(MAX(geo_id), 0) FROM dim_geo)
+         + ROW_NUMBER() OVER (ORDER BY f.departamento, f.municipio),
+       f.departamento, f.municipio
+FROM faltan f
+ON CONFLICT (departamento, municipio) DO UPDATE SET geo_id = EXCLUDED.geo_id
+WHERE dim_geo.geo_id IS NULL;
 
 COMMIT;
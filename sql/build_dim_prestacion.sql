@@ -1,5 +1,14 @@
 BEGIN;
 
+-- dim_base_prestadores (base normalizada de clean_staging) la arma sql/dim_base.sql;
+-- src/dims.py la corre antes y la borra al terminar. A mano: python -m src.dims --only <nodo>
+DO $$
+BEGIN
+  IF to_regclass('dim_base_prestadores') IS NULL THEN
+    RAISE EXCEPTION 'dim_base_prestadores no existe: correr con python -m src.dims (o psql -f sql/dim_base.sql antes)';
+  END IF;
+END $$;
+
 CREATE TABLE IF NOT EXISTS dim_prestacion_geo (
   departamento TEXT NOT NULL,
   municipio    TEXT NOT NULL,
@@ -9,18 +18,19 @@ CREATE TABLE IF NOT EXISTS dim_prestacion_geo (
   aseo_total INT,
   operativos_total INT,
   suspendidos_total INT,
+  geo_id       INTEGER,   -- dim_geo.geo_id (src/geo.py)
   PRIMARY KEY (departamento, municipio)
 );
+ALTER TABLE dim_prestacion_geo ADD COLUMN IF NOT EXISTS geo_id INTEGER;
 
 WITH prov AS (
   SELECT DISTINCT
-    UPPER(TRIM(departamento)) AS departamento,
-    UPPER(TRIM(municipio))    AS municipio,
-    UPPER(TRIM(COALESCE(servicio,''))) AS servicio,
-    UPPER(TRIM(COALESCE(estado,'')))   AS estado,
+    departamento,
+    municipio,
+    servicio_n AS servicio,
+    estado_n   AS estado,
     provider_id
-  FROM clean_staging
-  WHERE departamento IS NOT NULL AND municipio IS NOT NULL AND provider_id IS NOT NULL
+  FROM dim_base_prestadores
 ),
 agg AS (
   SELECT
@@ -35,14 +45,17 @@ agg AS (
   GROUP BY 1,2
 )
 INSERT INTO dim_prestacion_geo AS d
-(departamento, municipio, total_prestadores, acueducto_total, alcantarillado_total, aseo_total, operativos_total, suspendidos_total)
-SELECT * FROM agg
+(departamento, municipio, total_prestadores, acueducto_total, alcantarillado_total, aseo_total, operativos_total, suspendidos_total, geo_id)
+SELECT a.*, g.geo_id
+FROM agg a
+LEFT JOIN dim_geo g USING (departamento, municipio)
 ON CONFLICT (departamento, municipio) DO UPDATE SET
   total_prestadores    = EXCLUDED.total_prestadores,
   acueducto_total      = EXCLUDED.acueducto_total,
   alcantarillado_total = EXCLUDED.alcantarillado_total,
   aseo_total           = EXCLUDED.aseo_total,
   operativos_total     = EXCLUDED.operativos_total,
-  suspendidos_total    = EXCLUDED.suspendidos_total;
+  suspendidos_total    = EXCLUDED.suspendidos_total,
+  geo_id               = EXCLUDED.geo_id;
 
 COMMIT;
@@ -1,5 +1,14 @@
 BEGIN;
 
+-- dim_base_prestadores (base normalizada de clean_staging) la arma sql/dim_base.sql;
+-- src/dims.py la corre antes y la borra al terminar. A mano: python -m src.dims --only <nodo>
+DO $$
+BEGIN
+  IF to_regclass('dim_base_prestadores') IS NULL THEN
+    RAISE EXCEPTION 'dim_base_prestadores no existe: correr con python -m src.dims (o psql -f sql/dim_base.sql antes)';
+  END IF;
+END $$;
+
 CREATE TABLE IF NOT EXISTS dim_prestadores (
   departamento TEXT NOT NULL,
   municipio    TEXT NOT NULL,
@@ -12,31 +21,34 @@ CREATE TABLE IF NOT EXISTS dim_prestadores (
   telefono     TEXT,
   email        TEXT,
   es_publica   BOOLEAN,   -- se llenará luego (clasificación pública/privada)
+  geo_id       INTEGER,   -- dim_geo.geo_id (src/geo.py)
   PRIMARY KEY (departamento, municipio, provider_id)
 );
+ALTER TABLE dim_prestadores ADD COLUMN IF NOT EXISTS geo_id INTEGER;
 
 WITH src AS (
   SELECT
-    UPPER(TRIM(departamento)) AS departamento,
-    UPPER(TRIM(municipio))    AS municipio,
+    departamento,
+    municipio,
     provider_id,
     MAX(nombre)        AS nombre,
     MAX(servicio)      AS servicio,
     MAX(estado)        AS estado,
     MAX(clasificacion) AS clasificacion,
     MAX(direccion)     AS direccion,
-    MAX(CAST(telefono AS TEXT)) AS telefono,
+    MAX(telefono)      AS telefono,
     MAX(email)         AS email
-  FROM clean_staging
-  WHERE departamento IS NOT NULL AND municipio IS NOT NULL AND provider_id IS NOT NULL
+  FROM dim_base_prestadores
   GROUP BY 1,2,3
 )
 INSERT INTO dim_prestadores AS d
-(departamento, municipio, provider_id, nombre, servicio, estado, clasificacion, direccion, telefono, email, es_publica)
+(departamento, municipio, provider_id, nombre, servicio, estado, clasificacion, direccion, telefono, email, es_publica, geo_id)
 SELECT
-  departamento, municipio, provider_id, nombre, servicio, estado, clasificacion, direccion, telefono, email,
-  NULL::BOOLEAN AS es_publica
-FROM src
+  s.departamento, s.municipio, s.provider_id, s.nombre, s.servicio, s.estado, s.clasificacion, s.direccion, s.telefono, s.email,
+  NULL::BOOLEAN AS es_publica,
+  g.geo_id
+FROM src s
+LEFT JOIN dim_geo g USING (departamento, municipio)
 ON CONFLICT (departamento, municipio, provider_id) DO UPDATE SET
   nombre        = EXCLUDED.nombre,
   servicio      = EXCLUDED.servicio,
@@ -44,6 +56,7 @@ ON CONFLICT (departamento, municipio, provider_id) DO UPDATE SET
   clasificacion = EXCLUDED.clasificacion,
   direccion     = EXCLUDED.direccion,
   telefono      = EXCLUDED.telefono,
-  email         = EXCLUDED.email;
+  email         = EXCLUDED.email,
+  geo_id        = EXCLUDED.geo_id;
 
 COMMIT;
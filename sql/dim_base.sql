@@ -0,0 +1,29 @@
+-- sql/dim_base.sql
+-- Base normalizada de prestadores compartida por build_dim_prestacion / build_dim_prestadores /
+-- build_dim_geo. La arma src/dims.py una vez por corrida (UNLOGGED: se reconstruye siempre
+-- desde clean_staging y la borra al terminar; una tabla TEMP no se vería desde las otras
+-- conexiones del pool).
+BEGIN;
+
+DROP TABLE IF EXISTS dim_base_prestadores;
+
+CREATE UNLOGGED TABLE dim_base_prestadores AS
+SELECT
+  UPPER(TRIM(departamento))          AS departamento,
+  UPPER(TRIM(municipio))             AS municipio,
+  provider_id,
+  nombre,
+  servicio,
+  estado,
+  UPPER(TRIM(COALESCE(servicio,''))) AS servicio_n,
+  UPPER(TRIM(COALESCE(estado,'')))   AS estado_n,
+  clasificacion,
+  direccion,
+  CAST(telefono AS TEXT)             AS telefono,
+  email
+FROM clean_staging
+WHERE departamento IS NOT NULL AND municipio IS NOT NULL AND provider_id IS NOT NULL;
+
+ANALYZE dim_base_prestadores;
+
+COMMIT;
@@ -0,0 +1,68 @@
+# src/bulk_load.py
+# Carga masiva de DataFrames a staging:
+#   - PostgreSQL: COPY FROM STDIN desde un buffer CSV en memoria
+#   - SQLite / otros: executemany (un INSERT con muchos parámetros)
+import io
+import os
+
+import pandas as pd
+from sqlalchemy import MetaData, Table
+from sqlalchemy.engine import Engine
+
+# Filas por buffer CSV enviado a COPY (acota la memoria del buffer)
+COPY_BATCH = int(os.getenv("COPY_BATCH", "100000"))
+
+_NULL = "\\N"
+
+
+def _qi(name: str) -> str:
+    """Quote de identificador para PostgreSQL."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def _copy_postgres(df: pd.DataFrame, table: str, eng: Engine) -> None:
+    cols = ", ".join(_qi(c) for c in df.columns)
+    sql = f"COPY {_qi(table)} ({cols}) FROM STDIN WITH (FORMAT csv, NULL '{_NULL}')"
+    raw = eng.raw_connection()
+    try:
+        cur = raw.cursor()
+        for start in range(0, len(df), COPY_BATCH):
+            buf = io.StringIO()
+            df.iloc[start:start + COPY_BATCH].to_csv(buf, index=False, header=False, na_rep=_NULL)
+            buf.seek(0)
+            if hasattr(cur, "copy_expert"):      # psycopg2
+                cur.copy_expert(sql, buf)
+            else:                                # psycopg 3
+                with cur.copy(sql) as cp:
+                    cp.write(buf.getvalue())
+        cur.close()
+        raw.commit()
+    except Exception:
+        raw.rollback()
+        raise
+    finally:
+        raw.close()
+
+
+def _executemany(df: pd.DataFrame, table: str, eng: Engine) -> None:
+    records = df.astype(object).where(df.notna(), None).to_dict("records")
+    with eng.begin() as conn:
+        tbl = Table(table, MetaData(), autoload_with=conn)
+        conn.execute(tbl.insert(), records)
+
+
+def bulk_load(df: pd.DataFrame, table: str, eng: Engine, if_exists: str = "append") -> int:
+    """
+    Escribe `df` en `table` y devuelve el número de filas cargadas.
+    La tabla se crea (o reemplaza, con if_exists="replace") a partir del
+    esquema del DataFrame; luego los datos se envían por COPY en PostgreSQL
+    o por executemany en el resto de dialectos.
+    """
+    df.head(0).to_sql(table, eng, if_exists=if_exists, index=False)
+    if df.empty or len(df.columns) == 0:
+        return 0
+    if eng.dialect.name == "postgresql":
+        _copy_postgres(df, table, eng)
+    else:
+        _executemany(df, table, eng)
+    return len(df)
@@ -1,13 +1,18 @@
 # src/checks_cli.py
 # -*- coding: utf-8 -*-
+import argparse
+import json
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import contextmanager
 from typing import Dict, List, Tuple
 
 from sqlalchemy import text
 from sqlalchemy.engine import Engine
 
+from . import instrument
+
 # (Opcional) usa tu helper si existe
 try:
     from .util_db import get_engine as _get_engine
@@ -57,26 +62,251 @@ def connect():
     with eng.begin() as conn:
         yield conn
 
-def _count(conn, sql: str) -> int:
-    return int(conn.execute(text(sql)).scalar() or 0)
-
-
 # ---------------------------
 # lógica de chequeos
 # ---------------------------
+#
+# Cada tabla se revisa en UNA sola lectura: las métricas fila a fila salen como
+# COUNT(*) FILTER (...) dentro de la misma agregación que cuenta duplicados
+# (GROUP BY de la clave lógica). Las dos tablas se revisan en paralelo, cada una
+# en su propia conexión.
+
+_SQL_STAGING = """
+    WITH g AS (
+      SELECT
+        COUNT(*) AS c,
+        COUNT(*) FILTER (
+          WHERE provider_id IS NULL OR nombre IS NULL OR
+                departamento IS NULL OR municipio IS NULL OR servicio IS NULL
+        ) AS nulls
+      FROM {t}
+      GROUP BY provider_id, servicio, departamento, municipio
+    )
+    SELECT
+      COALESCE(SUM(c), 0)                 AS rows_clean_staging,
+      COALESCE(SUM(nulls), 0)             AS nulls_clean_staging,
+      COUNT(*) FILTER (WHERE c > 1)       AS dups_clean_staging
+    FROM g;
+"""
+
+# g5: clave por punto (dups_calidad_punto) → g4: clave municipio/día/parámetro (colisiones)
+_SQL_CALIDAD = """
+    WITH g5 AS (
+      SELECT
+        departamento, municipio, parametro, fecha_muestra,
+        COUNT(*) AS c,
+        COUNT(*) FILTER (
+          WHERE departamento IS NULL OR municipio IS NULL OR
+                fecha_muestra IS NULL OR parametro IS NULL
+        ) AS nulls,
+        COUNT(*) FILTER (WHERE fecha_muestra < DATE '2000-01-01' OR fecha_muestra > CURRENT_DATE) AS fechas,
+        COUNT(*) FILTER (WHERE (latitud IS NULL) <> (longitud IS NULL)) AS latlon,
+        COUNT(*) FILTER (
+          WHERE (latitud  IS NOT NULL AND (latitud  < -5  OR latitud  > 15))
+             OR (longitud IS NOT NULL AND (longitud < -82 OR longitud > -66))
+        ) AS coords,
+        COUNT(*) FILTER (WHERE parametro = 'PH' AND valor IS NOT NULL AND (valor < 0 OR valor > 14)) AS ph,
+        COUNT(*) FILTER (WHERE parametro LIKE 'CLORO%' AND valor IS NOT NULL AND (valor < 0 OR valor > 5)) AS cloro
+      FROM {t}{filtro}
+      GROUP BY departamento, municipio, parametro, fecha_muestra, COALESCE(nombre_punto,'')
+    ),
+    g4 AS (
+      SELECT
+        SUM(c) AS c,
+        COUNT(*) FILTER (WHERE c > 1) AS dups_punto,
+        SUM(nulls) AS nulls, SUM(fechas) AS fechas, SUM(latlon) AS latlon,
+        SUM(coords) AS coords, SUM(ph) AS ph, SUM(cloro) AS cloro,
+        fecha_muestra
+      FROM g5
+      GROUP BY departamento, municipio, parametro, fecha_muestra
+    )
+    SELECT{lote}
+      COALESCE(SUM(c), 0)             AS rows_clean_calidad,
+      COALESCE(SUM(nulls), 0)         AS nulls_clean_calidad,
+      COALESCE(SUM(dups_punto), 0)    AS dups_calidad_punto,
+      COUNT(*) FILTER (WHERE c > 1)   AS colisiones_calidad_muni_dia,
+      COALESCE(SUM(fechas), 0)        AS fechas_fuera_rango,
+      COALESCE(SUM(latlon), 0)        AS latlon_despareados,
+      COALESCE(SUM(coords), 0)        AS coords_fuera_col,
+      COALESCE(SUM(ph), 0)            AS ph_fuera_0_14,
+      COALESCE(SUM(cloro), 0)         AS cloro_fuera_0_5,
+      MIN(fecha_muestra)              AS fecha_min,
+      MAX(fecha_muestra)              AS fecha_max
+    FROM g4{grupo};
+"""
+
+# Métricas de calidad por mes de fecha_muestra (lote NULL = filas sin fecha)
+_LOTE_MES = dict(
+    lote="\n      to_char(date_trunc('month', fecha_muestra), 'YYYY-MM') AS lote,",
+    grupo="\n    GROUP BY 1",
+)
 
-def _collect(conn) -> Tuple[List[str], Dict[str, int]]:
+
+# ---------------------------
+# estado incremental
+# ---------------------------
+#
+# clean_calidad se revisa por lotes de un mes de fecha_muestra (haya o no particiones:
+# con índice en fecha_muestra o poda de particiones cada mes es una lectura por rango).
+# Las métricas de cada mes se guardan en dq_check_state con una huella que mantiene el
+# transform y no hace falta leer clean_calidad para sacarla: en clean_calidad_agg_state,
+# _refresh_calidad_agg deja una fila por fecha con sus filas y `refreshed_at`, y la
+# reescribe para cada fecha que tocó el build (incremental, por particiones o full).
+# Huella del mes = fechas + filas + último refreshed_at: si no cambió, el transform no
+# tocó ninguna fecha del mes y sus métricas se toman del estado. Los meses cambiados se
+# leen en una sola consulta agrupada por mes (sin filtro si cambiaron todos, p. ej.
+# tras un build full sin particiones) y los totales se suman. Todas las claves de
+# duplicados incluyen fecha_muestra, así que no cruzan meses y la suma es exacta. Las
+# filas sin fecha_muestra (lote NULL) se leen siempre.
+#
+# La huella solo ve lo que escribe el transform: tras tocar clean_calidad a mano hay que
+# correr CHECKS_FULL=1 (o --full en CLI), que re-verifica todos los meses y reescribe el
+# estado. Sin clean_calidad_agg_state se lee la tabla entera. clean_staging se
+# reconstruye completa en cada corrida y siempre se lee entera.
+
+CHECKS_INCREMENTAL = os.getenv("CHECKS_INCREMENTAL", "1") == "1"
+CHECKS_FULL = os.getenv("CHECKS_FULL", "0") == "1"
+
+_STATE_DDL = """
+    CREATE TABLE IF NOT EXISTS dq_check_state (
+      tabla      TEXT NOT NULL,
+      lote       TEXT NOT NULL,
+      huella     TEXT NOT NULL,
+      metricas   JSONB NOT NULL,
+      checked_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+      PRIMARY KEY (tabla, lote)
+    );
+"""
+
+# Huella de cada mes según lo que dejó el transform en clean_calidad_agg_state
+_SQL_HUELLAS = """
+    SELECT to_char(date_trunc('month', fecha_muestra), 'YYYY-MM') AS lote,
+           COUNT(*) || ':' || SUM(filas) || ':' || extract(epoch FROM MAX(refreshed_at)) AS huella
+    FROM clean_calidad_agg_state
+    GROUP BY 1;
+"""
+
+
+def _convertir(row) -> Dict:
+    return {k: (v.isoformat() if hasattr(v, "isoformat") else v) if k.startswith("fecha_") else int(v or 0)
+            for k, v in row.items() if k != "lote"}
+
+
+def _metricas(conn, t: str, sql: str) -> Dict:
+    row = conn.execute(text(sql.format(t=t, filtro="", lote="", grupo=""))).mappings().one()
+    return _convertir(row)
+
+
+def _sumar(total: Dict, met: Dict) -> None:
+    for k, v in met.items():
+        if k in ("fecha_min", "fecha_max"):
+            fechas = [x for x in (total.get(k), v) if x]
+            total[k] = (min if k == "fecha_min" else max)(fechas) if fechas else None
+        else:
+            total[k] = total.get(k, 0) + v
+
+
+def _vigente(prev, huella: str) -> bool:
+    """El lote no cambió y su resultado no depende de la fecha en que se revisó."""
+    if prev is None or prev["huella"] != huella:
+        return False
+    # fechas_fuera_rango compara contra CURRENT_DATE: si el lote tiene fechas a
+    # partir del día de la revisión anterior, el resultado pudo cambiar.
+    fmax = prev["metricas"].get("fecha_max")
+    return not fmax or fmax < prev["checked_at"].date().isoformat()
+
+
+def _filtro_meses(meses: List[str]) -> str:
+    """WHERE de las filas sin fecha + los meses `meses` ('YYYY-MM'), por rango de fecha_muestra."""
+    rangos = []
+    for m in meses:
+        y, mm = int(m[:4]), int(m[5:7])
+        fin = f"{y + 1}-01-01" if mm == 12 else f"{y}-{mm + 1:02d}-01"
+        rangos.append(f"(fecha_muestra >= DATE '{m}-01' AND fecha_muestra < DATE '{fin}')")
+    return "\n      WHERE fecha_muestra IS NULL" + "".join(f"\n         OR {r}" for r in rangos)
+
+
+def _scan_incremental(conn, table: str, sql: str, full: bool) -> Dict:
+    if conn.execute(text("SELECT to_regclass(:t) IS NULL;"), {"t": table}).scalar():
+        raise RuntimeError(f'relation "{table}" does not exist')
+    if conn.execute(text("SELECT to_regclass('clean_calidad_agg_state') IS NULL;")).scalar():
+        print(f"[checks] {table}: sin clean_calidad_agg_state → lectura completa")
+        return _metricas(conn, table, sql)
+
+    huellas = dict(conn.execute(text(_SQL_HUELLAS)).all())
+    estado = {
+        r["lote"]: r for r in conn.execute(
+            text("SELECT lote, huella, metricas, checked_at FROM dq_check_state WHERE tabla = :t;"), {"t": table}
+        ).mappings()
+    }
+
+    total: Dict = {}
+    vigentes = [l for l, h in huellas.items() if not full and _vigente(estado.get(l), h)]
+    for l in vigentes:
+        _sumar(total, estado[l]["metricas"])
+    cambian = sorted(set(huellas) - set(vigentes))
+
+    # cambiaron todos (o no hay estado): una lectura completa, también agrupada por mes
+    filtro = "" if len(cambian) == len(huellas) else _filtro_meses(cambian)
+    for row in conn.execute(text(sql.format(t=table, filtro=filtro, **_LOTE_MES))).mappings():
+        met = _convertir(row)
+        _sumar(total, met)
+        if row["lote"] in huellas:
+            conn.execute(text("""
+                INSERT INTO dq_check_state (tabla, lote, huella, metricas, checked_at)
+                VALUES (:t, :l, :h, CAST(:m AS jsonb), now())
+                ON CONFLICT (tabla, lote) DO UPDATE
+                  SET huella = EXCLUDED.huella, metricas = EXCLUDED.metricas, checked_at = EXCLUDED.checked_at;
+            """), {"t": table, "l": row["lote"], "h": huellas[row["lote"]], "m": json.dumps(met)})
+
+    # meses que ya no tienen filas (y estado de versiones anteriores: lotes por partición
+    # o de otras tablas)
+    conn.execute(
+        text("DELETE FROM dq_check_state WHERE tabla <> :t OR NOT (lote = ANY(:ls));"),
+        {"t": table, "ls": list(huellas)},
+    )
+    if not total:
+        # tabla vacía: métricas en cero
+        total = _metricas(conn, table, sql)
+    print(f"[checks] {table}: meses revisados={len(cambian)}/{len(huellas)}{' (full)' if full else ''}")
+    return total
+
+
+def _scan(eng: Engine, table: str, sql: str, full: bool = False, incremental: bool = False) -> Dict:
+    """Lectura de `table` en su propia conexión; levanta la excepción si no se puede leer."""
+    with instrument.step(f"checks.{table}"), eng.begin() as conn:
+        if conn.dialect.name != "postgresql":
+            return _metricas(conn, table, sql)
+        # clean_calidad particionada por fecha: agregados por partición (el GROUP BY
+        # incluye fecha_muestra)
+        conn.execute(text("SET LOCAL enable_partitionwise_aggregate = on;"))
+        if not (incremental and CHECKS_INCREMENTAL):
+            return _metricas(conn, table, sql)
+        return _scan_incremental(conn, table, sql, full)
+
+
+def _collect(eng: Engine, full: bool = CHECKS_FULL) -> Tuple[List[str], Dict[str, int]]:
     """
-    Ejecuta todos los chequeos y devuelve:
+    Ejecuta todos los chequeos (solo sobre los lotes nuevos o cambiados, salvo `full`) y devuelve:
       - problems: lista de strings con problemas (vacía si todo ok)
       - metrics:  dict con métricas para logging/XCom
     """
     problems: List[str] = []
     m: Dict[str, int] = {}
 
+    if CHECKS_INCREMENTAL and eng.dialect.name == "postgresql":
+        with eng.begin() as conn:
+            conn.execute(text(_STATE_DDL))
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        fut_st = pool.submit(_scan, eng, "clean_staging", _SQL_STAGING)
+        fut_ca = pool.submit(_scan, eng, "clean_calidad", _SQL_CALIDAD, full, incremental=True)
+    res: Dict[str, Dict[str, int]] = {}
+
     # 1) existencia y conteos
     try:
-        m["rows_clean_staging"] = _count(conn, "SELECT COUNT(*) FROM clean_staging;")
+        res["st"] = fut_st.result()
+        m["rows_clean_staging"] = res["st"]["rows_clean_staging"]
         print(f"[OK] clean_staging filas: {m['rows_clean_staging']}")
         if m["rows_clean_staging"] == 0:
             problems.append("clean_staging está vacío.")
@@ -84,7 +314,8 @@ def _collect(conn) -> Tuple[List[str], Dict[str, int]]:
         problems.append(f"clean_staging no existe o error de lectura: {e}")
 
     try:
-        m["rows_clean_calidad"] = _count(conn, "SELECT COUNT(*) FROM clean_calidad;")
+        res["ca"] = fut_ca.result()
+        m["rows_clean_calidad"] = res["ca"]["rows_clean_calidad"]
         print(f"[OK] clean_calidad filas: {m['rows_clean_calidad']}")
         if m["rows_clean_calidad"] == 0:
             problems.append("clean_calidad está vacío.")
@@ -94,47 +325,27 @@ def _collect(conn) -> Tuple[List[str], Dict[str, int]]:
     if problems:
         return problems, m  # si faltan tablas, cortamos aquí
 
+    st, ca = res["st"], res["ca"]
+
     # 2) nulos prohibidos (claves)
-    m["nulls_clean_staging"] = _count(conn, """
-        SELECT COUNT(*) FROM clean_staging
-        WHERE provider_id IS NULL OR nombre IS NULL OR
-              departamento IS NULL OR municipio IS NULL OR servicio IS NULL;
-    """)
+    m["nulls_clean_staging"] = st["nulls_clean_staging"]
     print(f"[CHK] nulos en claves (clean_staging): {m['nulls_clean_staging']}")
     if m["nulls_clean_staging"] > 0:
         problems.append(f"clean_staging tiene {m['nulls_clean_staging']} filas con nulos en claves.")
 
-    m["nulls_clean_calidad"] = _count(conn, """
-        SELECT COUNT(*) FROM clean_calidad
-        WHERE departamento IS NULL OR municipio IS NULL OR
-              fecha_muestra IS NULL OR parametro IS NULL;
-    """)
+    m["nulls_clean_calidad"] = ca["nulls_clean_calidad"]
     print(f"[CHK] nulos en claves (clean_calidad): {m['nulls_clean_calidad']}")
     if m["nulls_clean_calidad"] > 0:
         problems.append(f"clean_calidad tiene {m['nulls_clean_calidad']} filas con nulos en claves.")
 
     # 3) duplicados por llaves lógicas (prestadores)
-    m["dups_clean_staging"] = _count(conn, """
-        SELECT COUNT(*) FROM (
-          SELECT provider_id, servicio, departamento, municipio, COUNT(*) c
-          FROM clean_staging
-          GROUP BY 1,2,3,4
-          HAVING COUNT(*) > 1
-        ) t;
-    """)
+    m["dups_clean_staging"] = st["dups_clean_staging"]
     print(f"[CHK] duplicados clave (clean_staging): {m['dups_clean_staging']}")
     if m["dups_clean_staging"] > 0:
         problems.append(f"clean_staging tiene {m['dups_clean_staging']} combinaciones clave duplicadas.")
 
     # 3b) duplicados en calidad por punto
-    m["dups_calidad_punto"] = _count(conn, """
-        SELECT COUNT(*) FROM (
-          SELECT departamento, municipio, parametro, fecha_muestra, COALESCE(nombre_punto,'') AS p, COUNT(*) c
-          FROM clean_calidad
-          GROUP BY 1,2,3,4,5
-          HAVING COUNT(*) > 1
-        ) t;
-    """)
+    m["dups_calidad_punto"] = ca["dups_calidad_punto"]
     print(f"[CHK] duplicados clave (clean_calidad por punto): {m['dups_calidad_punto']}")
     if m["dups_calidad_punto"] > 0:
         problems.append(
@@ -142,56 +353,33 @@ def _collect(conn) -> Tuple[List[str], Dict[str, int]]:
         )
 
     # (info) colisiones municipio/día/parámetro
-    m["colisiones_calidad_muni_dia"] = _count(conn, """
-        SELECT COUNT(*) FROM (
-          SELECT departamento, municipio, parametro, fecha_muestra, COUNT(*) c
-          FROM clean_calidad
-          GROUP BY 1,2,3,4
-          HAVING COUNT(*) > 1
-        ) t;
-    """)
+    m["colisiones_calidad_muni_dia"] = ca["colisiones_calidad_muni_dia"]
     print(f"[INFO] colisiones municipio/día/parámetro: {m['colisiones_calidad_muni_dia']}")
 
     # 4) rango de fechas
-    m["fechas_fuera_rango"] = _count(conn, """
-        SELECT COUNT(*) FROM clean_calidad
-        WHERE fecha_muestra < DATE '2000-01-01' OR fecha_muestra > CURRENT_DATE;
-    """)
+    m["fechas_fuera_rango"] = ca["fechas_fuera_rango"]
     print(f"[CHK] fechas fuera de rango (clean_calidad): {m['fechas_fuera_rango']}")
     if m["fechas_fuera_rango"] > 0:
         problems.append(f"clean_calidad tiene {m['fechas_fuera_rango']} fechas fuera de rango.")
 
     # 5) coordenadas
-    m["latlon_despareados"] = _count(conn, """
-        SELECT COUNT(*) FROM clean_calidad
-        WHERE (latitud IS NULL) <> (longitud IS NULL);
-    """)
+    m["latlon_despareados"] = ca["latlon_despareados"]
     print(f"[CHK] lat/lon despareados: {m['latlon_despareados']}")
     if m["latlon_despareados"] > 0:
         problems.append(f"clean_calidad tiene {m['latlon_despareados']} filas con lat/lon despareados.")
 
-    m["coords_fuera_col"] = _count(conn, """
-        SELECT COUNT(*) FROM clean_calidad
-        WHERE (latitud  IS NOT NULL AND (latitud  < -5  OR latitud  > 15))
-           OR (longitud IS NOT NULL AND (longitud < -82 OR longitud > -66));
-    """)
+    m["coords_fuera_col"] = ca["coords_fuera_col"]
     print(f"[CHK] coordenadas fuera de rango COL: {m['coords_fuera_col']}")
     if m["coords_fuera_col"] > 0:
         problems.append(f"clean_calidad tiene {m['coords_fuera_col']} coordenadas fuera de rango COL.")
 
     # 6) reglas por parámetro
-    m["ph_fuera_0_14"] = _count(conn, """
-        SELECT COUNT(*) FROM clean_calidad
-        WHERE parametro = 'PH' AND valor IS NOT NULL AND (valor < 0 OR valor > 14);
-    """)
+    m["ph_fuera_0_14"] = ca["ph_fuera_0_14"]
     print(f"[CHK] pH fuera de 0..14: {m['ph_fuera_0_14']}")
     if m["ph_fuera_0_14"] > 0:
         problems.append("pH fuera de 0..14 (deberían haber quedado en NULL para imputar).")
 
-    m["cloro_fuera_0_5"] = _count(conn, """
-        SELECT COUNT(*) FROM clean_calidad
-        WHERE parametro LIKE 'CLORO%' AND valor IS NOT NULL AND (valor < 0 OR valor > 5);
-    """)
+    m["cloro_fuera_0_5"] = ca["cloro_fuera_0_5"]
     print(f"[CHK] CLORO fuera de 0..5: {m['cloro_fuera_0_5']}")
     if m["cloro_fuera_0_5"] > 0:
         problems.append("CLORO fuera de 0..5 (deberían haber quedado en NULL para imputar).")
@@ -222,24 +410,30 @@ def run(**kwargs):
     - Lanza RuntimeError si hay problemas.
     """
     print("\n=== DQ QUICKCHECK (Airflow Task) ===")
-    with connect() as conn:
-        problems, metrics = _collect(conn)
+    full = bool(kwargs.get("full", CHECKS_FULL))
+    with instrument.run("checks") as r:
+        problems, metrics = _collect(_build_engine(), full)
 
     if problems:
         _fail(problems)
 
     print("\n✅ [DQ QUICKCHECK] OK — datos básicos consistentes.\n")
     # Lo que retorna el callable se guarda en XCom (Airflow 2.x)
-    return {"status": "ok", **metrics}
+    return {"status": "ok", **metrics, "instrument": r.summary()}
 
 def main():
     """
     Modo CLI (python -m src.checks_cli).
     Guarda comportamiento clásico con sys.exit para devolver códigos de salida.
     """
+    ap = argparse.ArgumentParser(description="DQ quickcheck de clean_staging / clean_calidad")
+    ap.add_argument("--full", action="store_true", default=CHECKS_FULL,
+                    help="re-verifica todos los lotes aunque no hayan cambiado")
+    args = ap.parse_args()
+
     print("\n=== DQ QUICKCHECK (terminal) ===")
-    with connect() as conn:
-        problems, metrics = _collect(conn)
+    with instrument.run("checks"):
+        problems, metrics = _collect(_build_engine(), args.full)
 
     if problems:
         _fail(problems)
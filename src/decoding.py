@@ -0,0 +1,94 @@
+# src/decoding.py
+# Lectura de CSV con codificación mixta en una sola pasada.
+#
+# Los exports de datos.gov.co a veces mezclan utf-8 y latin-1 por línea. En vez de
+# parsear todo como utf-8 y, ante el primer byte inválido, volver a parsear el archivo
+# entero como latin-1, `RepairReader`:
+#   - adivina la codificación principal con un prefijo del archivo (`sniff`)
+#   - lee por bloques de ~1 MB cortados en fin de línea; si el bloque no es utf-8
+#     válido (o la principal es latin-1), lo revisa línea por línea: cada línea se
+#     toma como utf-8 si es válida y si no se transcodifica desde latin-1
+#   - cuenta las líneas reparadas (las que quedaron en la otra codificación)
+# pandas lee el resultado como utf-8, así que el CSV se parsea una sola vez.
+import io
+from typing import BinaryIO, Optional
+
+_BOM = b"\xef\xbb\xbf"
+SNIFF_BYTES = 1 << 16
+BLOCK_BYTES = 1 << 20
+
+
+def sniff(fh: BinaryIO, size: int = SNIFF_BYTES) -> str:
+    """'utf-8' si el prefijo es utf-8 válido (o solo ASCII), si no 'latin-1'. No mueve el archivo."""
+    pos = fh.tell()
+    prefix = fh.read(size)
+    fh.seek(pos)
+    try:
+        prefix.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # una secuencia multibyte cortada al final del prefijo no cuenta
+        if not (e.reason == "unexpected end of data" and e.start >= len(prefix) - 3):
+            return "latin-1"
+    return "utf-8"
+
+
+class RepairReader(io.RawIOBase):
+    """
+    Archivo binario sobre `fh` que entrega siempre utf-8: los bloques válidos pasan tal
+    cual (sin decodificar ni copiar) y las líneas en la otra codificación se transcodifican.
+    Se lee con pd.read_csv(..., encoding="utf-8").
+    """
+
+    def __init__(self, fh: BinaryIO, encoding: Optional[str] = None, block: int = BLOCK_BYTES):
+        self._fh = fh
+        if fh.tell() == 0 and fh.read(3) != _BOM:
+            fh.seek(0)
+        self.source_encoding = encoding or sniff(fh)
+        self._block = block
+        self._buf = b""
+        self._pos = 0  # lo ya entregado de _buf
+        self.repaired = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def _repair_lines(self, raw: bytes) -> bytes:
+        out = []
+        for line in raw.splitlines(keepends=True):
+            try:
+                line.decode("utf-8")
+                usada = "utf-8"
+            except UnicodeDecodeError:
+                line = line.decode("latin-1").encode("utf-8")
+                usada = "latin-1"
+            # ASCII puro es igual en ambas: solo cuenta si quedó en la otra codificación
+            if usada != self.source_encoding and not line.isascii():
+                self.repaired += 1
+            out.append(line)
+        return b"".join(out)
+
+    def _utf8(self, raw: bytes) -> bytes:
+        if self.source_encoding == "utf-8" or raw.isascii():
+            try:
+                raw.decode("utf-8")
+                return raw
+            except UnicodeDecodeError:
+                pass
+        return self._repair_lines(raw)
+
+    def readinto(self, b) -> int:
+        if self._pos >= len(self._buf):
+            raw = self._fh.read(self._block)
+            if not raw:
+                return 0
+            # bloques cortados en fin de línea (0x0A nunca es parte de un carácter multibyte)
+            if not raw.endswith(b"\n"):
+                raw += self._fh.readline()
+            self._buf, self._pos = self._utf8(raw), 0
+        n = min(len(b), len(self._buf) - self._pos)
+        b[:n] = self._buf[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def stats(self) -> dict:
+        return {"encoding": self.source_encoding, "repaired_lines": self.repaired}
@@ -0,0 +1,152 @@
+# src/dims.py
+# -- coding: utf-8 --
+"""
+Construcción de las dimensiones como grafo de dependencias sobre los .sql de sql/.
+
+    dim_base ─┬─ build_dim_prestacion ──┐
+              ├─ build_dim_prestadores ─┼─ build_dim_geo ── add_geo_fks
+    build_dim_calidad ──────────────────┘
+
+- dim_base arma una sola vez la base normalizada de clean_staging (dim_base_prestadores)
+  que leen las dimensiones de prestadores y dim_geo; se borra al terminar.
+- Los nodos sin dependencias pendientes corren en paralelo, cada uno en su propia
+  conexión del pool (DIMS_WORKERS, default 3), con los BEGIN/COMMIT del propio archivo.
+- dim_geo y las FKs corren al final, cuando ya existen todas las dimensiones.
+- Cada nodo se cronometra; el resumen usa el formato de src.instrument (se guarda en
+  INSTRUMENT_DIR/build_dims-<ts>.json y se compara con `python -m src.instrument compare`).
+- DIMS_FULL=1 (o --full) corre build_dim_calidad en modo completo en vez de incremental.
+
+Uso:  python -m src.dims [--full] [--only build_dim_calidad,...]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .util_db import get_engine
+from . import instrument
+
+HOST_DIR   = Path(__file__).resolve().parents[1] / "sql"
+DOCKER_DIR = Path("/opt/airflow/sql")
+SQL_DIR = Path(os.getenv("SQL_DIR") or (DOCKER_DIR if DOCKER_DIR.exists() else HOST_DIR))
+
+DIMS_WORKERS = int(os.getenv("DIMS_WORKERS", "3"))
+DIMS_FULL = os.getenv("DIMS_FULL", "0") == "1"
+
+# nodo → (archivo, dependencias)
+GRAPH: Dict[str, tuple] = {
+    "dim_base":              ("dim_base.sql", []),
+    "build_dim_calidad":     ("build_dim_calidad.sql", []),
+    "build_dim_prestacion":  ("build_dim_prestacion.sql", ["dim_base"]),
+    "build_dim_prestadores": ("build_dim_prestadores.sql", ["dim_base"]),
+    "build_dim_geo":         ("build_dim_geo.sql", ["dim_base", "build_dim_calidad"]),
+    "add_geo_fks":           ("add_geo_fks.sql", ["build_dim_geo", "build_dim_prestacion",
+                                                  "build_dim_prestadores", "build_dim_calidad"]),
+}
+
+# Tablas intermedias que se borran al terminar
+_BASES = ("dim_base_prestadores",)
+
+
+def _closure(nodes: List[str]) -> List[str]:
+    """`nodes` más todas sus dependencias, en el orden de GRAPH."""
+    need, stack = set(), list(nodes)
+    while stack:
+        n = stack.pop()
+        if n not in GRAPH:
+            raise KeyError(f"[dims] nodo desconocido: {n}")
+        if n not in need:
+            need.add(n)
+            stack.extend(GRAPH[n][1])
+    return [n for n in GRAPH if n in need]
+
+
+def _run_sql_file(eng, path: Path, full: bool) -> None:
+    """Ejecuta el .sql como psql -f: autocommit, con sus propios BEGIN/COMMIT."""
+    raw = eng.raw_connection()
+    dbapi = raw.driver_connection
+    try:
+        dbapi.autocommit = True
+        with dbapi.cursor() as cur:
+            if full:
+                cur.execute("SET etl.dim_calidad_mode = 'full';")
+            try:
+                cur.execute(path.read_text(encoding="utf-8"))
+            finally:
+                if full:
+                    cur.execute("RESET etl.dim_calidad_mode;")
+    finally:
+        dbapi.autocommit = False
+        raw.close()
+
+
+def _node(eng, name: str, full: bool) -> Dict:
+    t0 = time.perf_counter()
+    _run_sql_file(eng, SQL_DIR / GRAPH[name][0], full)
+    ms = (time.perf_counter() - t0) * 1000
+    print(f"[dims] {name:<22} {ms / 1000:8.2f}s")
+    return {"step": name, "sql": GRAPH[name][0], "ms": round(ms, 2), "rows": -1}
+
+
+def build(eng=None, only: Optional[List[str]] = None, full: bool = DIMS_FULL,
+          workers: int = DIMS_WORKERS) -> Dict:
+    """Corre el grafo (o `only` + sus dependencias). Devuelve el resumen por nodo."""
+    eng = eng or get_engine()
+    nodes = _closure(only) if only else list(GRAPH)
+    run = instrument.Run("build_dims")
+    done, running, failed = set(), {}, None
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        try:
+            while len(done) < len(nodes):
+                if failed is None:
+                    for n in nodes:
+                        if n not in done and n not in running and all(d in done for d in GRAPH[n][1] if d in nodes):
+                            running[n] = pool.submit(_node, eng, n, full)
+                if not running:
+                    break
+                fin, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+                for n, fut in list(running.items()):
+                    if fut not in fin:
+                        continue
+                    del running[n]
+                    try:
+                        run.add(fut.result())
+                        done.add(n)
+                    except Exception as e:
+                        print(f"[dims] {n} falló: {e}")
+                        failed = failed or e
+        finally:
+            if "dim_base" in nodes:
+                for t in _BASES:
+                    with eng.begin() as conn:
+                        conn.exec_driver_sql(f"DROP TABLE IF EXISTS {t};")
+
+    run.total_ms = (time.perf_counter() - run.t0) * 1000
+    if instrument.INSTRUMENT:
+        run.save()
+    print(f"[dims] {len(done)}/{len(nodes)} nodos en {run.total_ms / 1000:.2f}s")
+    if failed is not None:
+        raise failed
+    return run.summary()
+
+
+def run(**kwargs) -> Dict:
+    """Callable del DAG (tarea build_dims)."""
+    return build()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(prog="python -m src.dims")
+    ap.add_argument("--full", action="store_true", help="build_dim_calidad en modo completo")
+    ap.add_argument("--only", default="", help="nodos a correr (con sus dependencias), separados por coma")
+    ap.add_argument("--workers", type=int, default=DIMS_WORKERS)
+    args = ap.parse_args()
+    only = [n.strip() for n in args.only.split(",") if n.strip()] or None
+    build(only=only, full=args.full or DIMS_FULL, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+# src/entity.py
+# -- coding: utf-8 --
+"""
+Resolución de entidades de prestadores: agrupa en un mismo cluster_id los provider_id
+que son el mismo prestador escrito distinto ("ACUEDUCTO EL MACAL" / "ACUEDUCTO  EL MACAL .").
+
+provider_id es el NIT o md5(nombre|dep|muni|servicio), así que cualquier diferencia en
+el nombre crea otro prestador y el dedupe de transform / merge_pipeline solo junta claves
+exactas. Esta etapa corre después del merge, sobre clean_staging:
+
+- Bloqueo: solo se comparan nombres del mismo (departamento, municipio, servicio); nunca
+  todos contra todos. clean_staging se lee en streaming ordenado por bloque.
+- Nombre canónico: sin tildes / puntuación / espacios repetidos y sin palabras genéricas
+  (ACUEDUCTO, JUNTA, ASOCIACION, DE, ESP...). Los canónicos iguales se unen directo.
+- Similitud: Jaccard de trigramas de caracteres (con los bordes de palabra) ≥ ER_THRESHOLD
+  (default 0.85) y mismos números ("SECTOR 1" ≠ "SECTOR 2"). Los candidatos salen por
+  filtrado de prefijo (trigramas más raros del bloque primero) con numpy, así que los
+  pares que no pueden llegar al umbral no se comparan.
+- Los lotes de bloques se comparan en paralelo en ER_WORKERS procesos; el proceso
+  principal solo junta los pares (union-find) y nunca une dos NIT distintos.
+
+Resultado: prestador_cluster(provider_id PK, cluster_id, score). cluster_id es el NIT del
+cluster si lo tiene, si no el menor provider_id; los que no se unieron a nadie quedan con
+cluster_id = provider_id y score 1.
+
+Uso:  python -m src.entity [--threshold 0.85] [--workers 4]
+"""
+import argparse
+import math
+import os
+import re
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from .bulk_load import bulk_load
+from .normalize import norm_text
+from .util_db import get_engine
+from . import instrument
+
+ER_THRESHOLD = float(os.getenv("ER_THRESHOLD", "0.85"))
+ER_WORKERS = int(os.getenv("ER_WORKERS", str(min(os.cpu_count() or 1, 4))))
+# filas de clean_staging por lote enviado a un proceso (siempre bloques completos)
+ER_BATCH_ROWS = int(os.getenv("ER_BATCH_ROWS", "50000"))
+
+# Palabras que no distinguen a un prestador de otro del mismo bloque
+_GENERICAS = frozenset("""
+    ACUEDUCTO ALCANTARILLADO ASEO ACUEDUCTOS ADMINISTRADORA ADMINISTRACION ASOCIACION
+    ASOCIACIONES ASOCIADOS JUNTA JUNTAS USUARIOS SUSCRIPTORES SERVICIO SERVICIOS PUBLICO
+    PUBLICOS PUBLICA PUBLICAS DOMICILIARIOS EMPRESA EMPRESAS COMUNITARIO COMUNITARIA
+    VEREDA VEREDAL RURAL MUNICIPAL MUNICIPIO CORPORACION COOPERATIVA AGUA AGUAS
+    DE DEL LA LAS EL LOS Y E EN
+    ESP SA SAS LTDA EICE APC
+""".split())
+_NO_ALNUM = re.compile(r"[^0-9A-Z]+")
+# provider_id que no es md5 → viene de un NIT
+_MD5 = re.compile(r"[0-9a-f]{32}")
+
+Par = Tuple[str, str, float]
+
+
+def canonical(nombre: str) -> Tuple[str, frozenset]:
+    """(nombre canónico, números del nombre). 'E.S.P.' → 'ESP' y se descarta como genérica."""
+    s = norm_text(nombre or "")
+    s = _NO_ALNUM.sub(" ", s.replace(".", ""))
+    tokens = s.split()
+    utiles = [t for t in tokens if t not in _GENERICAS] or tokens
+    # tokens [0-9A-Z]+: los que no son solo letras llevan números
+    return " ".join(utiles), frozenset(t for t in utiles if not t.isalpha())
+
+
+def _trigramas(s: str) -> frozenset:
+    s = f" {s} "
+    return frozenset(s[i:i + 3] for i in range(len(s) - 2))
+
+
+def similares(claves: List[str], numeros: List[frozenset], umbral: float) -> List[Tuple[int, int, float]]:
+    """
+    Pares (i, j, jaccard) de `claves` (canónicos distintos de un bloque) con Jaccard de
+    trigramas ≥ umbral y los mismos números. Candidatos por filtrado de prefijo: si
+    J(x, y) ≥ t, x e y comparten al menos un trigrama entre los |x| - ceil(t·|x|) + 1
+    más raros de cada uno.
+    """
+    n = len(claves)
+    if n < 2:
+        return []
+    grams = [_trigramas(c) for c in claves]
+    freq = Counter(g for gs in grams for g in gs)
+    orden = {g: k for k, (g, _) in enumerate(sorted(freq.items(), key=lambda x: (x[1], x[0])))}
+    largo = np.fromiter((len(gs) for gs in grams), dtype=np.int64, count=n)
+
+    docs, ids = [], []
+    for i, gs in enumerate(grams):
+        p = len(gs) - math.ceil(umbral * len(gs)) + 1
+        pref = sorted(orden[g] for g in gs)[:p]
+        docs.extend([i] * len(pref))
+        ids.extend(pref)
+    docs, ids = np.asarray(docs, dtype=np.int64), np.asarray(ids, dtype=np.int64)
+
+    # documentos agrupados por trigrama de prefijo → pares dentro de cada grupo
+    o = np.lexsort((docs, ids))
+    docs, ids = docs[o], ids[o]
+    cortes = np.flatnonzero(np.diff(ids)) + 1
+    fin = np.concatenate((cortes, [len(ids)]))
+    tam = np.diff(np.concatenate(([0], fin)))
+    # cada posición se empareja con las siguientes de su grupo (sin bucle por grupo)
+    despues = np.repeat(fin, tam) - np.arange(len(ids)) - 1
+    total = int(despues.sum())
+    if not total:
+        return []
+    pa = np.repeat(np.arange(len(ids)), despues)
+    pb = pa + 1 + np.arange(total) - np.repeat(np.cumsum(despues) - despues, despues)
+    cand = np.unique(docs[pa] * n + docs[pb])
+    a, b = cand // n, cand % n
+
+    # filtro por largo: J ≤ min/max
+    la, lb = largo[a], largo[b]
+    ok = np.minimum(la, lb) >= umbral * np.maximum(la, lb)
+    a, b, la, lb = a[ok], b[ok], la[ok], lb[ok]
+    if not len(a):
+        return []
+    inter = np.fromiter((len(grams[x] & grams[y]) for x, y in zip(a.tolist(), b.tolist())),
+                        dtype=np.int64, count=len(a))
+    jac = inter / (la + lb - inter)
+    ok = jac >= umbral
+    return [(x, y, float(j)) for x, y, j in zip(a[ok].tolist(), b[ok].tolist(), jac[ok].tolist())
+            if numeros[x] == numeros[y]]
+
+
+def _pares_bloque(filas: List[Tuple[str, str]], umbral: float) -> List[Par]:
+    """Pares (provider_id, provider_id, score) de un bloque; `filas` = [(provider_id, nombre)]."""
+    por_clave: Dict[str, List[str]] = {}
+    numeros: Dict[str, frozenset] = {}
+    for pid, nombre in filas:
+        clave, nums = canonical(nombre)
+        por_clave.setdefault(clave, []).append(pid)
+        numeros[clave] = nums
+    pares = []
+    for pids in por_clave.values():
+        pares.extend((pids[0], otro, 1.0) for otro in pids[1:])
+    claves = list(por_clave)
+    for i, j, score in similares(claves, [numeros[c] for c in claves], umbral):
+        pares.append((por_clave[claves[i]][0], por_clave[claves[j]][0], score))
+    return pares
+
+
+def _pares_lote(bloques: List[List[Tuple[str, str]]], umbral: float) -> List[Par]:
+    """Trabajo de un proceso: todos los bloques del lote."""
+    out = []
+    for filas in bloques:
+        if len(filas) > 1:
+            out.extend(_pares_bloque(filas, umbral))
+    return out
+
+
+def _bloques(conn, batch_rows: int) -> Iterable[List[List[Tuple[str, str]]]]:
+    """Lotes de bloques completos (departamento, municipio, servicio) leídos en streaming."""
+    res = conn.execution_options(stream_results=True).execute(text("""
+        SELECT DISTINCT departamento, municipio, servicio, provider_id, nombre
+        FROM clean_staging
+        WHERE COALESCE(provider_id, '') <> '' AND COALESCE(nombre, '') <> ''
+        ORDER BY departamento, municipio, servicio, provider_id;
+    """))
+    lote, filas, clave, n = [], [], None, 0
+    while True:
+        chunk = res.fetchmany(10000)
+        if not chunk:
+            break
+        for dep, mun, serv, pid, nombre in chunk:
+            if (dep, mun, serv) != clave:
+                if filas:
+                    lote.append(filas)
+                    if n >= batch_rows:
+                        yield lote
+                        lote, n = [], 0
+                filas, clave = [], (dep, mun, serv)
+            filas.append((pid, nombre))
+            n += 1
+    if filas:
+        lote.append(filas)
+    if lote:
+        yield lote
+
+
+def _es_nit(pid: str) -> bool:
+    return not _MD5.fullmatch(pid)
+
+
+def clusters(pares: Iterable[Par]) -> Dict[str, Tuple[str, float]]:
+    """
+    Union-find sobre los pares (los de mayor score primero). Nunca junta dos NIT distintos.
+    Devuelve {provider_id: (cluster_id, score)} solo para los provider_id con pareja.
+    """
+    padre: Dict[str, str] = {}
+    nit: Dict[str, Optional[str]] = {}
+    score: Dict[str, float] = {}
+
+    def raiz(x: str) -> str:
+        padre.setdefault(x, x)
+        if x not in nit:
+            nit[x] = x if _es_nit(x) else None
+        while padre[x] != x:
+            padre[x] = padre[padre[x]]
+            x = padre[x]
+        return x
+
+    for a, b, s in sorted(pares, key=lambda p: -p[2]):
+        ra, rb = raiz(a), raiz(b)
+        if ra == rb or (nit[ra] and nit[rb] and nit[ra] != nit[rb]):
+            continue
+        padre[rb] = ra
+        nit[ra] = nit[ra] or nit[rb]
+        score[a] = max(score.get(a, 0.0), s)
+        score[b] = max(score.get(b, 0.0), s)
+
+    miembros: Dict[str, List[str]] = {}
+    for x in padre:
+        miembros.setdefault(raiz(x), []).append(x)
+    out = {}
+    for r, xs in miembros.items():
+        if len(xs) < 2:
+            continue
+        cid = nit[r] or min(xs)
+        out.update({x: (cid, score[x]) for x in xs})
+    return out
+
+
+def _create_table(conn) -> None:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS prestador_cluster (
+          provider_id TEXT PRIMARY KEY,
+          cluster_id  TEXT NOT NULL,
+          score       DOUBLE PRECISION    -- similitud del par que lo unió (1 = nombre canónico igual / solo)
+        );
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_prestador_cluster_cid ON prestador_cluster(cluster_id);"))
+
+
+def resolve(eng=None, umbral: float = ER_THRESHOLD, workers: int = ER_WORKERS,
+            batch_rows: int = ER_BATCH_ROWS) -> Dict:
+    """Recalcula prestador_cluster desde clean_staging. Devuelve conteos + instrumentación."""
+    eng = eng or get_engine()
+    with instrument.run("entity_resolution") as r:
+        pares: List[Par] = []
+        with instrument.step("er.compare"), eng.connect() as conn:
+            if workers > 1:
+                with ProcessPoolExecutor(max_workers=workers) as pool:
+                    pendientes = []
+                    for lote in _bloques(conn, batch_rows):
+                        pendientes.append(pool.submit(_pares_lote, lote, umbral))
+                        # acota la memoria: como mucho 2 lotes en cola por proceso
+                        while len(pendientes) >= 2 * workers:
+                            pares.extend(pendientes.pop(0).result())
+                    for fut in pendientes:
+                        pares.extend(fut.result())
+            else:
+                for lote in _bloques(conn, batch_rows):
+                    pares.extend(_pares_lote(lote, umbral))
+
+        with instrument.step("er.cluster"):
+            mapa = clusters(pares)
+
+        with instrument.step("er.write"):
+            df = pd.DataFrame(
+                [(pid, cid, s) for pid, (cid, s) in mapa.items()],
+                columns=["provider_id", "cluster_id", "score"],
+            )
+            bulk_load(df, "prestador_cluster_stage", eng, if_exists="replace")
+            with eng.begin() as conn:
+                _create_table(conn)
+                conn.execute(text("DELETE FROM prestador_cluster;"))
+                conn.execute(text("""
+                    INSERT INTO prestador_cluster (provider_id, cluster_id, score)
+                    SELECT provider_id, cluster_id, score FROM prestador_cluster_stage;
+                """))
+                conn.execute(text("""
+                    INSERT INTO prestador_cluster (provider_id, cluster_id, score)
+                    SELECT DISTINCT s.provider_id, s.provider_id, 1.0
+                    FROM clean_staging s
+                    WHERE COALESCE(s.provider_id, '') <> ''
+                      AND NOT EXISTS (SELECT 1 FROM prestador_cluster c WHERE c.provider_id = s.provider_id);
+                """))
+                conn.execute(text("DROP TABLE IF EXISTS prestador_cluster_stage;"))
+                total = conn.execute(text("SELECT COUNT(*) FROM prestador_cluster;")).scalar() or 0
+
+        unidos = len(mapa)
+        n_clusters = len({cid for cid, _ in mapa.values()})
+    print(f"[entity] prestador_cluster: {total} provider_id, {unidos} en {n_clusters} clusters "
+          f"({len(pares)} pares ≥ {umbral})")
+    return {"provider_ids": total, "merged_provider_ids": unidos, "clusters": n_clusters,
+            "pairs": len(pares), **r.summary()}
+
+
+def run(**kwargs) -> Dict:
+    """Callable del DAG (tarea resolve_prestadores)."""
+    return resolve()
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(prog="python -m src.entity")
+    ap.add_argument("--threshold", type=float, default=ER_THRESHOLD)
+    ap.add_argument("--workers", type=int, default=ER_WORKERS)
+    args = ap.parse_args()
+    resolve(umbral=args.threshold, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
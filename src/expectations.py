@@ -0,0 +1,187 @@
+# src/expectations.py
+# -- coding: utf-8 --
+"""
+Evaluador liviano de la suite de Great Expectations (ge/expectations/*.json) sobre
+los chunks que van leyendo los extractores, sin depender de great_expectations.
+
+Cada expectativa se resuelve con máscaras vectorizadas de pandas/NumPy por chunk y
+los conteos (evaluadas / inesperadas) se acumulan entre chunks. Las que no toleran
+fallas (sin `mostly`) cortan en el primer chunk malo, antes de cargarlo, así un
+archivo fuente roto falla en el extract y no después de load + transform.
+
+- GE_INLINE=0 desactiva la validación en el extract.
+- GE_SUITE_DIR cambia la carpeta de suites (default: <repo>/ge/expectations).
+
+Tipos soportados: expect_table_row_count_to_be_between, expect_column_to_exist,
+expect_column_values_to_not_be_null, expect_column_values_to_be_null,
+expect_column_values_to_be_between, expect_column_values_to_be_in_set,
+expect_column_values_to_not_be_in_set, expect_column_values_to_match_regex.
+El resto se informa como `skipped`.
+
+Las suites que valida el extract describen el archivo crudo (p. ej. quality_raw: el
+extract ve filas que transform descarta después, como las que no traen departamento,
+así que ahí los no-nulos llevan `mostly`). El umbral que se aplica es el del JSON, el
+mismo que informa el checkpoint de GE.
+"""
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+GE_INLINE = os.getenv("GE_INLINE", "1") == "1"
+GE_SUITE_DIR = Path(os.getenv("GE_SUITE_DIR", Path(__file__).resolve().parents[1] / "ge" / "expectations"))
+
+
+class ExpectationError(RuntimeError):
+    """Una expectativa de la suite no se cumple."""
+
+
+def _nulos(s: pd.Series) -> np.ndarray:
+    return s.isna().to_numpy()
+
+
+def _numeros(s: pd.Series) -> pd.Series:
+    if s.dtype != object:
+        return pd.to_numeric(s, errors="coerce")
+    return pd.to_numeric(s.str.replace(",", ".", regex=False), errors="coerce")
+
+
+def _fuera_de_rango(s: pd.Series, kw: Dict) -> np.ndarray:
+    v = _numeros(s).to_numpy(dtype=float)
+    bad = np.zeros(len(v), dtype=bool)
+    lo, hi = kw.get("min_value"), kw.get("max_value")
+    if lo is not None:
+        bad |= (v < lo) if not kw.get("strict_min") else (v <= lo)
+    if hi is not None:
+        bad |= (v > hi) if not kw.get("strict_max") else (v >= hi)
+    # un no numérico no nulo tampoco cumple
+    bad |= np.isnan(v) & ~_nulos(s)
+    return bad
+
+
+# tipo → función(serie, kwargs) que devuelve la máscara de valores inesperados
+# (sobre los valores no nulos, como en GE, salvo not_be_null / be_null)
+_COLUMNA = {
+    "expect_column_values_to_not_be_null": lambda s, kw: _nulos(s),
+    "expect_column_values_to_be_null": lambda s, kw: ~_nulos(s),
+    "expect_column_values_to_be_between": _fuera_de_rango,
+    "expect_column_values_to_be_in_set":
+        lambda s, kw: ~s.isin(kw.get("value_set", [])).to_numpy() & ~_nulos(s),
+    "expect_column_values_to_not_be_in_set":
+        lambda s, kw: s.isin(kw.get("value_set", [])).to_numpy() & ~_nulos(s),
+    "expect_column_values_to_match_regex":
+        lambda s, kw: ~s.astype(str).str.contains(kw["regex"], regex=True).to_numpy() & ~_nulos(s),
+}
+_NULL_SENSITIVE = {"expect_column_values_to_not_be_null", "expect_column_values_to_be_null"}
+
+
+class Suite:
+    """Acumula los resultados de una suite chunk a chunk."""
+
+    def __init__(self, name: str, expectations: List[Dict], rows: int = 0):
+        self.name = name
+        self.rows = rows  # filas ya validadas (p. ej. cargas anteriores en modo append)
+        self.results = []
+        for e in expectations:
+            self.results.append({"expectation_type": e["expectation_type"], "kwargs": dict(e.get("kwargs", {})),
+                                 "evaluated": 0, "unexpected": 0, "success": True})
+
+    @classmethod
+    def load(cls, name: str, rows: int = 0) -> "Suite":
+        path = GE_SUITE_DIR / f"{name}.json"
+        with open(path, encoding="utf-8") as fh:
+            return cls(name, json.load(fh).get("expectations", []), rows)
+
+    def validate(self, df: pd.DataFrame) -> None:
+        """Evalúa el chunk; levanta ExpectationError si alguna expectativa estricta falla."""
+        self.rows += len(df)
+        for r in self.results:
+            kind, kw = r["expectation_type"], r["kwargs"]
+            if kind == "expect_table_row_count_to_be_between":
+                hi = kw.get("max_value")
+                if hi is not None and self.rows > hi:
+                    r["success"] = False
+                    self._fail(r, f"filas={self.rows} > {hi}")
+                continue
+            if kind == "expect_column_to_exist":
+                r["evaluated"] += 1
+                if kw["column"] not in df.columns:
+                    r["unexpected"] += 1
+                    r["success"] = False
+                    self._fail(r, f"no existe la columna {kw['column']!r}")
+                continue
+            fn = _COLUMNA.get(kind)
+            if fn is None:
+                r["skipped"] = True
+                continue
+            col = kw["column"]
+            if col not in df.columns:
+                r["success"] = False
+                self._fail(r, f"no existe la columna {col!r}")
+            s = df[col]
+            bad = fn(s, kw)
+            r["evaluated"] += len(s) if kind in _NULL_SENSITIVE else int((~_nulos(s)).sum())
+            r["unexpected"] += int(bad.sum())
+            if r["unexpected"] and kw.get("mostly") is None:
+                r["success"] = False
+                self._fail(r, f"{r['unexpected']} valores inesperados en {col!r}")
+
+    def finish(self) -> List[Dict]:
+        """Cierra la validación (row count mínimo, `mostly`) y devuelve los resultados."""
+        for r in self.results:
+            kind, kw = r["expectation_type"], r["kwargs"]
+            if kind == "expect_table_row_count_to_be_between":
+                r["evaluated"] = self.rows
+                lo = kw.get("min_value")
+                if lo is not None and self.rows < lo:
+                    r["success"] = False
+                    self._fail(r, f"filas={self.rows} < {lo}")
+            elif kw.get("mostly") is not None and r["evaluated"]:
+                if 1 - r["unexpected"] / r["evaluated"] < kw["mostly"]:
+                    r["success"] = False
+                    self._fail(r, f"{r['unexpected']}/{r['evaluated']} inesperados (mostly={kw['mostly']})")
+        return self.results
+
+    def summary(self) -> Dict:
+        """Conteos por expectativa para XCom."""
+        return {
+            "suite": self.name,
+            "rows": self.rows,
+            "success": all(r["success"] for r in self.results),
+            "expectations": [
+                {"type": r["expectation_type"],
+                 "column": r["kwargs"].get("column"),
+                 "evaluated": r["evaluated"],
+                 "passed": r["evaluated"] - r["unexpected"] if "column" in r["kwargs"] else int(r["success"]),
+                 "failed": r["unexpected"] if "column" in r["kwargs"] else int(not r["success"]),
+                 "success": r["success"],
+                 **({"skipped": True} if r.get("skipped") else {})}
+                for r in self.results
+            ],
+        }
+
+    def log(self, prefix: str) -> None:
+        for e in self.summary()["expectations"]:
+            col = f"({e['column']})" if e["column"] else ""
+            estado = "skipped" if e.get("skipped") else f"ok={e['passed']} fallas={e['failed']}"
+            print(f"[{prefix}] {self.name}: {e['type']}{col} {estado}")
+
+    def _fail(self, r: Dict, detalle: str) -> None:
+        col = r["kwargs"].get("column")
+        raise ExpectationError(
+            f"[expectations] {self.name}: {r['expectation_type']}"
+            f"{f'({col})' if col else ''} falló tras {self.rows} filas: {detalle}"
+        )
+
+
+def load_suite(name: str, rows: int = 0) -> Optional[Suite]:
+    """Suite `name` si la validación inline está activa y el archivo existe (si no, None)."""
+    if not GE_INLINE:
+        return None
+    if not (GE_SUITE_DIR / f"{name}.json").exists():
+        print(f"[expectations] sin suite {name!r} en {GE_SUITE_DIR} → no se valida")
+        return None
+    return Suite.load(name, rows)
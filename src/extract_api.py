@@ -1,10 +1,16 @@
+import hashlib
 import os
 import time
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 import pandas as pd
-from unicodedata import normalize
 from .util_db import get_engine
-from typing import Dict, Union
+from .bulk_load import bulk_load
+from . import http_cache, schema, snapshot
+from .normalize import clean_cols
+from typing import Dict, List, Optional, Union
+from concurrent.futures import ThreadPoolExecutor
 
 
 API_URL    = (os.getenv("API_URL") or "").strip()
@@ -12,46 +18,76 @@ API_TOKEN  = (os.getenv("API_TOKEN") or "").strip()
 API_SELECT = (os.getenv("API_SELECT") or "").strip()
 API_WHERE  = (os.getenv("API_WHERE")  or "").strip()
 LIMIT      = int(os.getenv("LIMIT", "5000"))
+# Páginas en vuelo simultáneamente (1 = secuencial)
+API_CONCURRENCY = int(os.getenv("API_CONCURRENCY", "4"))
+# Caché local con peticiones condicionales (ETag / Last-Modified); 0 = desactivada
+API_CACHE  = os.getenv("API_CACHE", "1") != "0"
 
 # Retries simples para 429/5xx
 MAX_RETRIES = 3
 BACKOFF_SEC = 3
 
-def _clean_cols(cols):
-    s = pd.Index(cols).astype(str).str.strip().str.lower()
-    # quita acentos:
-    s = s.map(lambda x: normalize("NFKD", x).encode("ascii", "ignore").decode("utf-8"))
-    return s.str.replace(r"[^\w]+", "_", regex=True)
-
-
-
 Params = Dict[str, Union[str, int]]
 
-def _fetch_page(offset: int) -> pd.DataFrame:
+def _headers() -> Dict[str, str]:
     headers = {"Accept": "application/json"}
     if API_TOKEN:
         headers["X-App-Token"] = API_TOKEN
-
-    # tipamos explícitamente para permitir str o int
-    params: Params = {"$limit": LIMIT, "$offset": offset}
-    if API_SELECT:
-        params["$select"] = API_SELECT
-    if API_WHERE:
-        params["$where"] = API_WHERE
-
+    return headers
+
+# Sesión compartida (keep-alive); el pool admite una conexión por hilo del fetcher
+_SESSION = None
+_SESSION_LOCK = threading.Lock()
+
+# Contadores de caché para el log
+_CACHE_STATS = {"hit": 0, "miss": 0}
+_STATS_LOCK = threading.Lock()
+
+def _session() -> requests.Session:
+    global _SESSION
+    with _SESSION_LOCK:
+        if _SESSION is None:
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(API_CONCURRENCY, 10))
+            s.mount("http://", adapter)
+            s.mount("https://", adapter)
+            s.headers.update(_headers())
+            _SESSION = s
+        return _SESSION
+
+def _count_cache(kind: str) -> None:
+    with _STATS_LOCK:
+        _CACHE_STATS[kind] += 1
+
+def _get_json(params: Params):
+    """
+    GET a API_URL con los retries de 429/5xx; devuelve el JSON ya desempaquetado.
+    Si hay copia en caché se envía una petición condicional: un 304 se resuelve
+    leyendo el cuerpo guardado en disco.
+    """
+    key = http_cache.cache_key(API_URL, params)
+    entry = http_cache.load(key) if API_CACHE else None
     attempt = 0
     while True:
         try:
-            r = requests.get(API_URL, headers=headers, params=params, timeout=60)
+            r = _session().get(API_URL, headers=http_cache.conditional_headers(entry),
+                               params=params, timeout=60)
             if r.status_code in (429, 500, 502, 503, 504) and attempt < MAX_RETRIES:
                 attempt += 1
                 time.sleep(BACKOFF_SEC * attempt)
                 continue
-            r.raise_for_status()
-            data = r.json()
+            if r.status_code == 304 and entry:
+                _count_cache("hit")
+                data = http_cache.read_body(entry)
+            else:
+                r.raise_for_status()
+                _count_cache("miss")
+                data = r.json()
+                if API_CACHE:
+                    http_cache.store(key, API_URL, r.headers, r.content)
             if isinstance(data, dict) and "data" in data:
                 data = data["data"]
-            return pd.DataFrame(data)
+            return data
         except requests.RequestException as e:
             if attempt < MAX_RETRIES:
                 attempt += 1
@@ -59,18 +95,32 @@ def _fetch_page(offset: int) -> pd.DataFrame:
                 continue
             raise RuntimeError(f"[extract_api] Error al llamar API: {e}") from e
 
-
-def run():
-    if not API_URL:
-        print("[extract_api] API_URL vacío → tarea saltada.")
-        # Para no romper el flujo, crea tabla vacía
-        eng = get_engine()
-        pd.DataFrame().to_sql("stg_api", eng, if_exists="replace", index=False)
-        return
-
-    # Paginación
+def _fetch_page(offset: int) -> pd.DataFrame:
+    # tipamos explícitamente para permitir str o int
+    params: Params = {"$limit": LIMIT, "$offset": offset}
+    if API_SELECT:
+        params["$select"] = API_SELECT
+    if API_WHERE:
+        params["$where"] = API_WHERE
+    return pd.DataFrame(_get_json(params))
+
+def _count_rows() -> Optional[int]:
+    """
+    Total de filas vía `$select=count(*)` (mismo $where).
+    Devuelve None si la API no soporta el conteo o responde algo inesperado.
+    """
+    params: Params = {"$select": "count(*)"}
+    if API_WHERE:
+        params["$where"] = API_WHERE
+    try:
+        data = _get_json(params)
+        return int(next(iter(data[0].values())))
+    except Exception as e:
+        print(f"[extract_api] Conteo no disponible ({e}) → paginación secuencial.")
+        return None
+
+def _fetch_sequential(offset: int = 0) -> List[pd.DataFrame]:
     frames = []
-    offset = 0
     while True:
         df = _fetch_page(offset)
         if df.empty:
@@ -79,17 +129,75 @@ def run():
         if len(df) < LIMIT:
             break
         offset += LIMIT
+    return frames
+
+def fetch_all(concurrency: int = API_CONCURRENCY) -> pd.DataFrame:
+    """
+    Descarga todas las páginas.
+    - Con total conocido y concurrency > 1: pide los offsets en paralelo
+      (ThreadPoolExecutor, máx. `concurrency` en vuelo) y arma el resultado en orden.
+    - Si no: paginación secuencial hasta una página incompleta.
+    Cada página conserva su propia política de retries 429/5xx.
+    """
+    total = _count_rows() if concurrency > 1 else None
+    if total is None:
+        frames = _fetch_sequential()
+    else:
+        offsets = list(range(0, total, LIMIT))
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            frames = [df for df in pool.map(_fetch_page, offsets) if not df.empty]
+        # si la fuente creció entre el conteo y la descarga, sigue secuencialmente
+        if frames and len(frames[-1]) == LIMIT:
+            frames += _fetch_sequential(offsets[-1] + LIMIT)
 
     if frames:
-        df_all = pd.concat(frames, ignore_index=True, sort=False)
-    else:
-        df_all = pd.DataFrame()
+        return pd.concat(frames, ignore_index=True, sort=False)
+    return pd.DataFrame()
+
+
+def _snapshot(df: pd.DataFrame) -> None:
+    """Snapshot columnar de lo recibido, con clave = hash del contenido."""
+    key = hashlib.sha256(
+        "\x1f".join(map(str, df.columns)).encode("utf-8")
+        + pd.util.hash_pandas_object(df.astype(str), index=False).to_numpy().tobytes()
+    ).hexdigest()
+    if snapshot.find("stg_api", key) is not None:
+        return
+    w = snapshot.writer("stg_api", key)
+    if w is not None:
+        w.add(df)
+        w.commit(fingerprint={"url": API_URL, "where": API_WHERE, "select": API_SELECT})
+
+
+def run():
+    if not API_URL:
+        print("[extract_api] API_URL vacío → tarea saltada.")
+        # Para no romper el flujo, crea tabla vacía
+        eng = get_engine()
+        pd.DataFrame().to_sql("stg_api", eng, if_exists="replace", index=False)
+        return
+
+    eng = get_engine()
+    # SNAPSHOT_REPLAY=1: recarga stg_api desde el último snapshot sin llamar a la API
+    snap = snapshot.find("stg_api") if snapshot.SNAPSHOT_REPLAY else None
+    if snap is not None:
+        rows = snapshot.feed(snap, "stg_api", eng, 0)
+        print(f"[extract_api] stg_api → filas={rows} desde snapshot {snap.path.name[:12]} (sin llamar a la API)")
+        return
+
+    # Paginación (concurrente si se conoce el total)
+    df_all = fetch_all()
 
     if df_all.empty:
         print("[extract_api] Sin filas recibidas.")
     else:
-        df_all.columns = _clean_cols(df_all.columns)
-
-    eng = get_engine()
-    df_all.to_sql("stg_api", eng, if_exists="replace", index=False, method="multi", chunksize=5000)
-    print(f"[extract_api] stg_api → filas={len(df_all)} cols={len(df_all.columns)}")
+        df_all.columns = clean_cols(df_all.columns)
+        antes = schema.mem_mb(df_all)
+        df_all = schema.apply("stg_api", df_all)
+        print(f"[extract_api] memoria stg_api: texto={antes:.1f}MB → tipado={schema.mem_mb(df_all):.1f}MB")
+        _snapshot(df_all)
+        schema.create(eng, "stg_api", df_all.columns)
+
+    bulk_load(df_all, "stg_api", eng, if_exists="append" if len(df_all.columns) else "replace")
+    print(f"[extract_api] stg_api → filas={len(df_all)} cols={len(df_all.columns)} "
+          f"cache hit={_CACHE_STATS['hit']} miss={_CACHE_STATS['miss']}")
@@ -0,0 +1,186 @@
+# src/extract_csv.py
+# Carga de un CSV a staging, común a extract_old (stg_old) y extract_new (stg_new):
+#   manifiesto (skip / append / full) → snapshot columnar si el archivo ya se parseó →
+#   si no, lectura por chunks a la tabla sombra (suite GE opcional por chunk) →
+#   schema.publish → snapshot.commit → manifiesto.
+# Cada extractor solo define su tabla, su archivo y (si tiene) su suite.
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+import pandas as pd
+from .util_db import get_engine
+from .util_mem import peak_rss_mb
+from .bulk_load import bulk_load
+from . import decoding, expectations, manifest, schema, snapshot
+from .normalize import clean_cols
+
+
+def read(csv_path: Path, stats: Optional[Dict] = None, tag: str = "extract_csv") -> pd.DataFrame:
+    """
+    Lee el CSV completo en una sola pasada (codificación detectada por prefijo y
+    reparada por línea, ver src/decoding.py). `stats` recibe encoding / repaired_lines.
+    """
+    if not csv_path.exists():
+        raise FileNotFoundError(f"[{tag}] No existe el archivo: {csv_path}")
+    with open(csv_path, "rb") as fh:
+        txt = decoding.RepairReader(fh)
+        df = pd.read_csv(txt, encoding="utf-8", low_memory=False, on_bad_lines="skip")
+    if stats is not None:
+        stats.update(txt.stats())
+    return df
+
+
+def read_chunks(csv_path: Path, chunksize: int, encoding: Optional[str] = None, start: int = 0,
+                names: Optional[List[str]] = None, stats: Optional[Dict] = None,
+                tag: str = "extract_csv") -> Iterator[pd.DataFrame]:
+    """
+    Lee el CSV en bloques de `chunksize` filas (todo como texto, para que el
+    esquema de staging no dependa de la inferencia de tipos de cada bloque).
+    Con `start`/`names` lee solo la cola del archivo desde el byte `start`
+    (sin encabezado) usando los nombres de columna dados.
+    El archivo se decodifica una sola vez: `encoding` (None = detectar por prefijo)
+    es la codificación principal y las líneas que no la cumplen se reparan por línea;
+    al terminar, `stats` recibe encoding / repaired_lines.
+    """
+    if not csv_path.exists():
+        raise FileNotFoundError(f"[{tag}] No existe el archivo: {csv_path}")
+    with open(csv_path, "rb") as fh:
+        fh.seek(start)
+        txt = decoding.RepairReader(fh, encoding)
+        reader = pd.read_csv(txt, encoding="utf-8", dtype=str, on_bad_lines="skip",
+                             chunksize=chunksize if chunksize > 0 else 50000,
+                             header=None if names else "infer", names=names)
+        with reader:
+            for chunk in reader:
+                yield chunk
+    if stats is not None:
+        stats.update(txt.stats())
+
+
+def _load_stream(eng, table: str, csv_path: Path, encoding: Optional[str], chunksize: int,
+                 start: int = 0, names: Optional[List[str]] = None, suite=None, snap=None,
+                 tag: str = "extract_csv") -> Tuple[int, List[str], Tuple[float, float], Dict]:
+    """
+    Carga por chunks en la tabla sombra de `table`; devuelve (filas, encabezados originales del CSV,
+    memoria MB de los chunks como texto / con el esquema de staging aplicado,
+    codificación principal y líneas reparadas).
+    Con `suite` cada chunk se valida antes de escribirlo (falla en el primero malo);
+    con `snap` (snapshot.Writer) cada chunk se agrega además al snapshot columnar.
+    """
+    rows, raw_cols, antes, despues, dec = 0, list(names or []), 0.0, 0.0, {}
+    # todo va a la tabla sombra y se publica de una vez (schema.publish): un fallo a
+    # mitad del archivo no deja staging truncada ni con filas repetidas
+    dest = schema.shadow(table)
+    for i, chunk in enumerate(read_chunks(csv_path, chunksize, encoding, start, names, dec, tag)):
+        if i == 0 and not names:
+            raw_cols = [str(c) for c in chunk.columns]
+        chunk.columns = clean_cols(chunk.columns)
+        antes += schema.mem_mb(chunk)
+        chunk = schema.apply(table, chunk)
+        despues += schema.mem_mb(chunk)
+        if suite is not None:
+            suite.validate(chunk)
+        if snap is not None:
+            snap.add(chunk)
+        if i == 0:
+            schema.create(eng, table, chunk.columns, name=dest)
+        rows += bulk_load(chunk, dest, eng, if_exists="append")
+    return rows, raw_cols, (antes, despues), dec
+
+
+def _load_full(eng, table: str, csv_path: Path, suite=None, snap=None,
+               tag: str = "extract_csv") -> Tuple[int, List[str], Tuple[float, float], Dict]:
+    """Como `_load_stream`, pero con el archivo completo en memoria (CHUNK_SIZE=0)."""
+    dec = {}
+    df = read(csv_path, dec, tag)
+    raw_cols = [str(c) for c in df.columns]
+    # normaliza encabezados
+    df.columns = clean_cols(df.columns)
+    antes = schema.mem_mb(df)
+    df = schema.apply(table, df)
+    mem = (antes, schema.mem_mb(df))
+    if suite is not None:
+        suite.validate(df)
+    if snap is not None:
+        snap.add(df)
+    schema.create(eng, table, df.columns, name=schema.shadow(table))
+    bulk_load(df, schema.shadow(table), eng, if_exists="append")
+    return len(df), raw_cols, mem, dec
+
+
+def run(table: str, csv_path: Path, chunksize: int, suite_name: Optional[str] = None,
+        tag: str = "extract_csv") -> Dict:
+    """
+    Carga `csv_path` en `table` según el manifiesto (ver README, "Manifiesto de fuentes").
+    `suite_name` (ge/expectations/<suite>.json) se evalúa chunk a chunk antes de publicar.
+    Devuelve el resumen para XCom: tabla, filas, acción y, si corresponde, memoria y
+    conteos de la suite.
+    """
+    eng = get_engine()
+    action, fp, prev = manifest.plan(table, csv_path, eng)
+    if action != "full" and prev.get("schema") != schema.version(table):
+        # staging se cargó con otro esquema: se recarga completa con los tipos actuales
+        action = "full"
+    if action == "skip":
+        print(f"[{tag}] sin cambios en {csv_path.name} → {table} intacta (filas={prev['rows']})")
+        return {"table": table, "rows": prev["rows"], "action": action}
+
+    # mismo archivo ya parseado en una corrida anterior (o SNAPSHOT_REPLAY=1):
+    # staging se alimenta del snapshot columnar, sin volver a parsear el CSV
+    snap = snapshot.find(table, fp["sha256"]) if action == "full" else None
+    if snap is not None:
+        rows = snapshot.feed(snap, table, eng, chunksize)
+        print(f"[{tag}] {table} filas={rows} desde snapshot {snap.path.name[:12]} peak_rss={peak_rss_mb():.1f}MB")
+        manifest.put(table, {**snap.meta["fingerprint"], "table": table, "rows": rows,
+                             "encoding": snap.meta["encoding"], "columns": snap.meta["raw_columns"],
+                             "schema": schema.version(table)})
+        return {"table": table, "rows": rows, "action": "snapshot",
+                **({"expectations": snap.meta["expectations"]} if snap.meta.get("expectations") else {})}
+
+    # snapshot que se escribe mientras se parsea (solo en cargas completas)
+    w = snapshot.writer(table, fp["sha256"]) if action == "full" else None
+    try:
+        suite = (expectations.load_suite(suite_name, prev["rows"] if action == "append" else 0)
+                 if suite_name else None)
+        if action == "append":
+            # solo se agregaron filas al final: carga la cola con los encabezados del manifiesto
+            encoding = prev["encoding"]
+            added, raw_cols, mem, dec = _load_stream(eng, table, csv_path, encoding, chunksize,
+                                                     prev["size"], prev["columns"], suite, tag=tag)
+            rows = prev["rows"] + added
+            print(f"[{tag}] {table} +{added} filas nuevas (total={rows}) peak_rss={peak_rss_mb():.1f}MB")
+        elif chunksize <= 0:
+            rows, raw_cols, mem, dec = _load_full(eng, table, csv_path, suite, w, tag)
+            encoding = dec["encoding"]
+            print(f"[{tag}] {table} filas={rows} peak_rss={peak_rss_mb():.1f}MB")
+        else:
+            # Streaming: memoria acotada por CHUNK_SIZE, no por el tamaño del archivo
+            # una sola pasada: sin releer el archivo como latin-1 ante un byte inválido
+            rows, raw_cols, mem, dec = _load_stream(eng, table, csv_path, None, chunksize,
+                                                    suite=suite, snap=w, tag=tag)
+            encoding = dec["encoding"]
+            print(f"[{tag}] {table} filas={rows} chunk={chunksize} peak_rss={peak_rss_mb():.1f}MB")
+
+        res = {"table": table, "rows": rows, "action": action,
+               "mem_mb": {"texto": round(mem[0], 1), "tipado": round(mem[1], 1)}}
+        if suite is not None:
+            suite.finish()
+            res["expectations"] = suite.summary()
+            suite.log(tag)
+        # el archivo (o la cola) pasó la suite: recién ahora reemplaza / se agrega a staging
+        schema.publish(eng, table, replace=action != "append")
+    except Exception:
+        # ni snapshot a medias ni sombra huérfana: staging queda como estaba
+        if w is not None:
+            w.abort()
+        schema.drop_shadow(eng, table)
+        raise
+    if dec.get("repaired_lines"):
+        print(f"[{tag}] {dec['repaired_lines']} líneas reparadas (no {dec['encoding']})")
+    print(f"[{tag}] memoria {table}: texto={mem[0]:.1f}MB → tipado={mem[1]:.1f}MB")
+    if w is not None:
+        w.commit(fingerprint=fp, encoding=encoding, raw_columns=raw_cols,
+                 expectations=res.get("expectations"))
+
+    manifest.put(table, {**fp, "table": table, "rows": rows, "encoding": encoding,
+                         "columns": raw_cols, "schema": schema.version(table)})
+    return res
@@ -1,7 +1,8 @@
 from pathlib import Path
 import os
+from typing import Dict, Optional
 import pandas as pd
-from .util_db import get_engine
+from . import extract_csv
 
 # Detecta ruta dentro / fuera de Docker
 HOST_BASE   = Path(__file__).resolve().parents[1] / "data" / "input"
@@ -14,26 +15,17 @@ DEFAULT_FILE = os.getenv(
 )
 DEFAULT_INPUT = BASE / DEFAULT_FILE
 
-def extract(csv_path: Path = DEFAULT_INPUT) -> pd.DataFrame:
-    if not csv_path.exists():
-        raise FileNotFoundError(f"[extract_old] No existe el archivo: {csv_path}")
-    try:
-        df = pd.read_csv(csv_path, encoding="utf-8", low_memory=False, on_bad_lines="skip")
-    except UnicodeDecodeError:
-        df = pd.read_csv(csv_path, encoding="latin-1", low_memory=False, on_bad_lines="skip")
-    return df
+# Filas por chunk en modo streaming (0 = leer el archivo completo en memoria)
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "50000"))
 
-def run():
-    df = extract()
-    # normaliza encabezados
-    df.columns = (
-        df.columns.astype(str).str.strip().str.lower()
-        .str.normalize("NFKD").str.encode("ascii","ignore").str.decode("utf-8")
-        .str.replace(r"[^\w]+","_", regex=True)
-    )
-    eng = get_engine()
-    df.to_sql("stg_old", eng, if_exists="replace", index=False, method="multi", chunksize=5000)
-    print(f"[extract_old] stg_old filas={len(df)} cols={len(df.columns)}")
+def extract(csv_path: Path = DEFAULT_INPUT, stats: Optional[Dict] = None) -> pd.DataFrame:
+    """Lee el CSV completo en memoria (ver extract_csv.read)."""
+    return extract_csv.read(csv_path, stats, "extract_old")
+
+def run() -> Dict:
+    # manifiesto / snapshot / sombra / publish en src/extract_csv.py
+    # Lo que retorna el callable se guarda en XCom (Airflow 2.x)
+    return extract_csv.run("stg_old", DEFAULT_INPUT, CHUNK_SIZE, tag="extract_old")
 
 if __name__ == "__main__":
     d = extract()
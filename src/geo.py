@@ -0,0 +1,104 @@
+# src/geo.py
+# -- coding: utf-8 --
+"""
+Claves sustitutas enteras de dim_geo (geo_id) asignadas con un diccionario en memoria.
+
+dim_geo(geo_id, departamento, municipio) guarda un entero compacto por par
+(departamento, municipio); dimensiones y hechos llevan geo_id (INTEGER, 4 bytes) en vez
+de joinear y validar FKs sobre dos TEXT. Los ids los asigna el transform apenas publica
+clean_staging / clean_calidad (`sync`), así que cuando corren load y las dimensiones
+todos los pares ya tienen id y basta un join contra dim_geo (~1.100 filas).
+
+- El diccionario {(departamento, municipio): geo_id} se carga al empezar cada `sync`
+  y se vuelve a leer (bajo el lock) solo cuando aparece un par desconocido.
+- Los ids nuevos se asignan bajo un advisory lock de la transacción (prestadores y
+  calidad corren en paralelo): max(geo_id) + 1, ... en orden de (departamento, municipio).
+- Un id nunca se reasigna: si un municipio deja de aparecer su id queda reservado.
+"""
+from typing import Dict, Iterable, Tuple
+
+from sqlalchemy import text
+
+Par = Tuple[str, str]
+
+_CACHE: Dict[Par, int] = {}
+# clave del pg_advisory_xact_lock que serializa la asignación de ids
+_LOCK_KEY = 74_201
+
+
+def ensure_table(conn) -> None:
+    """Crea dim_geo (o le agrega geo_id, numerando las filas existentes)."""
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS dim_geo (
+          geo_id       INTEGER,
+          departamento TEXT NOT NULL,
+          municipio    TEXT NOT NULL,
+          CONSTRAINT pk_dim_geo PRIMARY KEY (departamento, municipio)
+        );
+    """))
+    # el ALTER toma lock exclusivo aunque la columna exista: solo si falta
+    if "geo_id" not in conn.execute(text("SELECT * FROM dim_geo LIMIT 0;")).keys():
+        conn.execute(text("ALTER TABLE dim_geo ADD COLUMN geo_id INTEGER;"))
+    # filas de antes de geo_id
+    sin_id = conn.execute(text(
+        "SELECT departamento, municipio FROM dim_geo WHERE geo_id IS NULL ORDER BY 1, 2;"
+    )).all()
+    if sin_id:
+        _insert(conn, [tuple(r) for r in sin_id])
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_dim_geo_id ON dim_geo(geo_id);"))
+
+
+def _load(conn) -> None:
+    _CACHE.clear()
+    for dep, mun, gid in conn.execute(text(
+        "SELECT departamento, municipio, geo_id FROM dim_geo WHERE geo_id IS NOT NULL;"
+    )):
+        _CACHE[(dep, mun)] = gid
+
+
+def _insert(conn, pares) -> None:
+    """Asigna ids consecutivos a `pares` (nuevos o con geo_id NULL) e inserta/actualiza dim_geo."""
+    base = conn.execute(text("SELECT COALESCE(MAX(geo_id), 0) FROM dim_geo;")).scalar()
+    filas = [{"d": d, "m": m, "id": base + i} for i, (d, m) in enumerate(sorted(pares), start=1)]
+    conn.execute(text("""
+        INSERT INTO dim_geo (geo_id, departamento, municipio)
+        VALUES (:id, :d, :m)
+        ON CONFLICT (departamento, municipio) DO UPDATE SET geo_id = excluded.geo_id
+        WHERE dim_geo.geo_id IS NULL;
+    """), filas)
+    _CACHE.update({(f["d"], f["m"]): f["id"] for f in filas})
+
+
+def _lock(conn) -> None:
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:k);"), {"k": _LOCK_KEY})
+
+
+def lookup(conn, pares: Iterable[Par]) -> Dict[Par, int]:
+    """geo_id de cada par; los que no existen se crean en dim_geo (dentro de la transacción de `conn`)."""
+    pares = {(d, m) for d, m in pares if d and m}
+    faltan = pares - _CACHE.keys()
+    if faltan:
+        _lock(conn)
+        # otro proceso pudo haberlos creado
+        _load(conn)
+        faltan = pares - _CACHE.keys()
+        if faltan:
+            _insert(conn, faltan)
+    return {p: _CACHE[p] for p in pares}
+
+
+def sync(conn, source_sql: str) -> int:
+    """Asegura geo_id para los pares (departamento, municipio) de `source_sql`. Devuelve cuántos nuevos."""
+    _lock(conn)
+    ensure_table(conn)
+    # se relee en cada corrida: un id asignado en una transacción que hizo rollback
+    # no debe quedar en el diccionario
+    _load(conn)
+    antes = len(_CACHE)
+    pares = conn.execute(text(f"SELECT DISTINCT s.departamento, s.municipio FROM ({source_sql}) s;")).all()
+    lookup(conn, [tuple(p) for p in pares])
+    nuevos = len(_CACHE) - antes
+    if nuevos:
+        print(f"[geo] dim_geo: {nuevos} geo_id nuevos (total {len(_CACHE)})")
+    return nuevos
@@ -0,0 +1,66 @@
+# src/http_cache.py
+# Caché en disco de respuestas HTTP con validadores (ETag / Last-Modified)
+# para peticiones condicionales: si la página no cambió, el servidor responde
+# 304 y el cuerpo se lee del disco.
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional
+
+HOST_DIR   = Path(__file__).resolve().parents[1] / "data" / "cache" / "api"
+DOCKER_DIR = Path("/opt/airflow/data/cache/api")
+CACHE_DIR  = Path(os.getenv("API_CACHE_DIR") or (DOCKER_DIR if DOCKER_DIR.parent.parent.exists() else HOST_DIR))
+
+
+def cache_key(url: str, params: Dict) -> str:
+    raw = url + "?" + json.dumps({k: str(v) for k, v in params.items()}, sort_keys=True)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def load(key: str) -> Optional[Dict]:
+    """Devuelve {'etag', 'last_modified', 'path'} si hay entrada en caché."""
+    meta_p = CACHE_DIR / f"{key}.meta.json"
+    body_p = CACHE_DIR / f"{key}.json"
+    if not (meta_p.exists() and body_p.exists()):
+        return None
+    try:
+        meta = json.loads(meta_p.read_text(encoding="utf-8"))
+    except ValueError:
+        return None
+    meta["path"] = body_p
+    return meta
+
+
+def conditional_headers(entry: Optional[Dict]) -> Dict[str, str]:
+    if not entry:
+        return {}
+    h = {}
+    if entry.get("etag"):
+        h["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+        h["If-Modified-Since"] = entry["last_modified"]
+    return h
+
+
+def read_body(entry: Dict):
+    with open(entry["path"], "rb") as fh:
+        return json.loads(fh.read())
+
+
+def _atomic_write(path: Path, data: bytes) -> None:
+    tmp = path.with_suffix(path.suffix + f".{os.getpid()}.{id(data)}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def store(key: str, url: str, headers, body: bytes) -> None:
+    """Guarda el cuerpo solo si la respuesta trae algún validador."""
+    etag = headers.get("ETag")
+    last_mod = headers.get("Last-Modified")
+    if not (etag or last_mod):
+        return
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    _atomic_write(CACHE_DIR / f"{key}.json", body)
+    meta = {"url": url, "etag": etag, "last_modified": last_mod}
+    _atomic_write(CACHE_DIR / f"{key}.meta.json", json.dumps(meta).encode("utf-8"))
@@ -0,0 +1,300 @@
+# src/instrument.py
+# Instrumentación de SQL: tiempo, filas afectadas y (opcional) EXPLAIN (ANALYZE, BUFFERS)
+# de cada sentencia, agrupadas por paso con nombre.
+#
+#   with instrument.run("transform_calidad") as r:
+#       with instrument.step("calidad.build"):
+#           conn.execute(...)
+#   r.summary()   # → dict para XCom; además se guarda en INSTRUMENT_DIR/<run>-<ts>.json
+#
+# Se engancha a los eventos before/after_cursor_execute de SQLAlchemy, así que mide
+# todo lo que pasa por conn.execute (también desde hilos del pool) sin tocar las llamadas.
+#
+# Comparar dos corridas:  python -m src.instrument compare A.json B.json [--threshold 1.25]
+#                         python -m src.instrument compare transform_calidad   (últimas dos)
+import argparse
+import json
+import os
+import re
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+HOST_DIR   = Path(__file__).resolve().parents[1] / "data" / "state" / "runs"
+DOCKER_DIR = Path("/opt/airflow/data/state/runs")
+INSTRUMENT_DIR = Path(os.getenv("INSTRUMENT_DIR") or (DOCKER_DIR if DOCKER_DIR.parents[1].exists() else HOST_DIR))
+
+# INSTRUMENT=0 desactiva todo; INSTRUMENT_EXPLAIN=1 corre antes de cada DML / CTAS un
+# EXPLAIN (ANALYZE, BUFFERS) aparte, dentro de un savepoint que se revierte, y guarda el
+# plan real. La sentencia del llamador se ejecuta después sin cambios (filas de RETURNING
+# y rowcount intactos), a costa de ejecutar cada DML dos veces: solo para diagnosticar.
+INSTRUMENT = os.getenv("INSTRUMENT", "1") == "1"
+INSTRUMENT_EXPLAIN = os.getenv("INSTRUMENT_EXPLAIN", "0") == "1"
+
+_LOCK = threading.Lock()
+_LOCAL = threading.local()
+_ACTIVO = None
+
+_VERBO = re.compile(
+    r"^\s*(CREATE(?:\s+OR\s+REPLACE)?(?:\s+UNLOGGED|\s+TEMP)?\s+(?:TABLE|INDEX|VIEW)(?:\s+IF\s+NOT\s+EXISTS)?"
+    r"|DROP\s+\w+(?:\s+IF\s+EXISTS)?|ALTER\s+\w+(?:\s+IF\s+EXISTS)?|ANALYZE|TRUNCATE(?:\s+TABLE)?"
+    r"|SET(?:\s+LOCAL)?|SELECT|INSERT\s+INTO|UPDATE|DELETE\s+FROM)\s+([\w\.\"]+)",
+    re.I,
+)
+_EXPLICABLE = re.compile(
+    r"^\s*(INSERT|UPDATE|DELETE)\b"
+    r"|^\s*CREATE\s+(UNLOGGED\s+|TEMP\s+)?TABLE\s+[\w\.\"]+(\s+ON\s+COMMIT\s+\w+)?\s+AS\b",
+    re.I,
+)
+_VERBO_WITH = re.compile(r"(INSERT|UPDATE|DELETE|SELECT)\b", re.I)
+
+
+def _principal(sql: str) -> str:
+    """Sentencia de nivel superior: para `WITH ... AS (...) <verbo> ...` devuelve desde <verbo>."""
+    s = re.sub(r"'(?:[^']|'')*'", "''", sql)
+    if not re.match(r"^\s*WITH\b", s, re.I):
+        return s
+    depth = 0
+    for i, ch in enumerate(s):
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        elif depth == 0 and (i == 0 or not (s[i - 1].isalnum() or s[i - 1] == "_")) and _VERBO_WITH.match(s, i):
+            return s[i:]
+    return s
+
+
+def _label(sql: str) -> str:
+    """'INSERT INTO clean_staging', 'CREATE INDEX idx_x', ... (para un WITH, la sentencia principal)."""
+    m = _VERBO.match(_principal(sql))
+    if m:
+        return " ".join(m.group(1).upper().split()) + " " + m.group(2)
+    return " ".join(sql.split())[:60]
+
+
+def _explicable(sql: str) -> bool:
+    return bool(_EXPLICABLE.match(_principal(sql)))
+
+
+def _explain(cursor, statement: str, parameters) -> Optional[Dict]:
+    """
+    EXPLAIN (ANALYZE, BUFFERS) de `statement` en un savepoint que se revierte: no deja
+    efectos ni resultados pendientes en el cursor. None si el EXPLAIN falla (la sentencia
+    real fallará igual y lo reporta el llamador).
+    """
+    cursor.execute("SAVEPOINT _instr_explain")
+    try:
+        cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + statement, parameters)
+        plan = cursor.fetchone()[0]
+        plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]
+    except Exception:
+        plan = None
+    cursor.execute("ROLLBACK TO SAVEPOINT _instr_explain")
+    cursor.execute("RELEASE SAVEPOINT _instr_explain")
+    return plan
+
+
+class Run:
+    def __init__(self, name: str):
+        self.name = name
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self.t0 = time.perf_counter()
+        self.total_ms = 0.0
+        self.statements: List[Dict] = []
+        self.path: Optional[Path] = None
+
+    def add(self, rec: Dict) -> None:
+        with _LOCK:
+            self.statements.append(rec)
+
+    def steps(self) -> List[Dict]:
+        """Totales por paso, en orden de primera aparición."""
+        out: Dict[str, Dict] = {}
+        for s in self.statements:
+            st = out.setdefault(s["step"], {"step": s["step"], "ms": 0.0, "rows": 0, "statements": 0})
+            st["ms"] += s["ms"]
+            st["rows"] += max(s["rows"], 0)
+            st["statements"] += 1
+        for st in out.values():
+            st["ms"] = round(st["ms"], 1)
+        return list(out.values())
+
+    def summary(self) -> Dict:
+        return {
+            "run": self.name,
+            "started": self.started,
+            "total_ms": round(self.total_ms, 1),
+            "steps": self.steps(),
+            "file": str(self.path) if self.path else None,
+        }
+
+    def save(self) -> Path:
+        INSTRUMENT_DIR.mkdir(parents=True, exist_ok=True)
+        ts = datetime.now().strftime("%Y%m%dT%H%M%S_%f")
+        self.path = INSTRUMENT_DIR / f"{self.name}-{ts}.json"
+        doc = {**self.summary(), "statements": self.statements}
+        doc["file"] = str(self.path)
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(doc, ensure_ascii=False, indent=1, default=str), encoding="utf-8")
+        os.replace(tmp, self.path)
+        return self.path
+
+
+def _antes(conn, cursor, statement, parameters, context, executemany):
+    context._instr_plan = None
+    # Savepoint solo dentro de una transacción (no en conexiones en autocommit)
+    if (INSTRUMENT_EXPLAIN and not executemany and conn.dialect.name == "postgresql"
+            and not getattr(cursor.connection, "autocommit", True) and _explicable(statement)):
+        context._instr_plan = _explain(cursor, statement, parameters)
+    context._instr_t0 = time.perf_counter()
+    return statement, parameters
+
+
+def _despues(conn, cursor, statement, parameters, context, executemany):
+    run = _ACTIVO
+    if run is None:
+        return
+    ms = (time.perf_counter() - getattr(context, "_instr_t0", time.perf_counter())) * 1000
+    rec = {
+        "step": getattr(_LOCAL, "step", None) or run.name,
+        "sql": _label(statement),
+        "ms": round(ms, 2),
+        "rows": cursor.rowcount,
+    }
+    if getattr(context, "_instr_plan", None) is not None:
+        rec["plan"] = context._instr_plan
+    run.add(rec)
+
+
+@contextmanager
+def run(name: str):
+    """
+    Registra todas las sentencias SQL (de cualquier Engine) ejecutadas en el bloque.
+    Anidado dentro de otro run, no abre uno nuevo: todo queda en el de afuera.
+    """
+    global _ACTIVO
+    if not INSTRUMENT or _ACTIVO is not None:
+        yield _ACTIVO or Run(name)
+        return
+
+    r = Run(name)
+    _ACTIVO = r
+    event.listen(Engine, "before_cursor_execute", _antes, retval=True)
+    event.listen(Engine, "after_cursor_execute", _despues)
+    try:
+        yield r
+    finally:
+        event.remove(Engine, "before_cursor_execute", _antes)
+        event.remove(Engine, "after_cursor_execute", _despues)
+        _ACTIVO = None
+        r.total_ms = (time.perf_counter() - r.t0) * 1000
+        r.save()
+        for st in r.steps():
+            print("[instrument] " + json.dumps({"run": name, **st}, ensure_ascii=False))
+        print(f"[instrument] {name}: {r.total_ms:.0f} ms → {r.path}")
+
+
+@contextmanager
+def step(name: str):
+    """Nombra las sentencias del bloque (por hilo)."""
+    prev = getattr(_LOCAL, "step", None)
+    _LOCAL.step = name
+    try:
+        yield
+    finally:
+        _LOCAL.step = prev
+
+
+def set_step(name: Optional[str]) -> None:
+    """Como `step`, sin bloque: nombra las sentencias siguientes del hilo (None = nombre del run)."""
+    _LOCAL.step = name
+
+
+# ---------------------------
+# comparación de corridas
+# ---------------------------
+
+def _resolve(ref: str) -> Path:
+    p = Path(ref)
+    if p.exists():
+        return p
+    raise FileNotFoundError(ref)
+
+
+def _latest(name: str, n: int = 2) -> List[Path]:
+    runs = sorted(INSTRUMENT_DIR.glob(f"{name}-*.json"))
+    if len(runs) < n:
+        raise FileNotFoundError(f"se necesitan {n} corridas de '{name}' en {INSTRUMENT_DIR}")
+    return runs[-n:]
+
+
+def compare(a: Dict, b: Dict, threshold: float = 1.25, min_ms: float = 50.0) -> List[Dict]:
+    """
+    Compara pasos de dos corridas. Regresión = B tarda más de `threshold` veces lo de A
+    y al menos `min_ms` más (para no marcar ruido en pasos de milisegundos).
+    """
+    pa = {s["step"]: s for s in a["steps"]}
+    out = []
+    for s in b["steps"]:
+        o = pa.get(s["step"])
+        ms_a = o["ms"] if o else None
+        ratio = (s["ms"] / ms_a) if ms_a else None
+        out.append({
+            "step": s["step"],
+            "ms_a": ms_a,
+            "ms_b": s["ms"],
+            "ratio": round(ratio, 2) if ratio is not None else None,
+            "rows_a": o["rows"] if o else None,
+            "rows_b": s["rows"],
+            "regresion": bool(ratio is not None and ratio > threshold and s["ms"] - ms_a >= min_ms),
+        })
+    for step_a in pa.keys() - {s["step"] for s in b["steps"]}:
+        o = pa[step_a]
+        out.append({"step": step_a, "ms_a": o["ms"], "ms_b": None, "ratio": None,
+                    "rows_a": o["rows"], "rows_b": None, "regresion": False})
+    return out
+
+
+def _fmt(v, w):
+    return f"{'-' if v is None else v:>{w}}"
+
+
+def main(argv=None) -> int:
+    ap = argparse.ArgumentParser(prog="python -m src.instrument")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("compare", help="compara dos corridas (archivos o nombre de run → últimas dos)")
+    c.add_argument("refs", nargs="+")
+    c.add_argument("--threshold", type=float, default=1.25)
+    c.add_argument("--min-ms", type=float, default=50.0)
+    args = ap.parse_args(argv)
+
+    if len(args.refs) == 1 and not Path(args.refs[0]).exists():
+        pa, pb = _latest(args.refs[0])
+    else:
+        pa, pb = _resolve(args.refs[0]), _resolve(args.refs[1])
+    a = json.loads(pa.read_text(encoding="utf-8"))
+    b = json.loads(pb.read_text(encoding="utf-8"))
+
+    print(f"A: {pa.name} ({a['total_ms']} ms)")
+    print(f"B: {pb.name} ({b['total_ms']} ms)\n")
+    print(f"{'paso':<40} {'ms A':>10} {'ms B':>10} {'B/A':>6} {'filas A':>10} {'filas B':>10}")
+    filas = compare(a, b, args.threshold, args.min_ms)
+    for f in filas:
+        marca = "  ⚠ REGRESIÓN" if f["regresion"] else ""
+        print(f"{f['step']:<40} {_fmt(f['ms_a'], 10)} {_fmt(f['ms_b'], 10)} {_fmt(f['ratio'], 6)} "
+              f"{_fmt(f['rows_a'], 10)} {_fmt(f['rows_b'], 10)}{marca}")
+    n = sum(f["regresion"] for f in filas)
+    print(f"\nregresiones: {n}")
+    return 1 if n else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
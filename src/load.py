@@ -1,21 +1,27 @@
 # src/load.py
+import hashlib
+
 from sqlalchemy.sql.expression import text  # ✅ Fix Pylance/SQLAlchemy 2.x
+from sqlalchemy import inspect as sqla_inspect
 from .util_db import get_engine
+from . import geo, instrument, partitions
 
 
-def create_schema() -> None:
+def create_schema() -> dict:
     """
     Crea tablas finales del DW si no existen:
       - dim_prestador(provider_id PK)
       - fact_servicio(UNIQUE provider_id,servicio,fecha)
       - fact_calidad(UNIQUE departamento,municipio,parametro,fecha)
+      - dim_geo(geo_id) (src/geo.py); dim_prestador y fact_calidad se indexan por geo_id
     y sus índices / FKs.
-    Compatible con PostgreSQL y SQLite.
+    Compatible con PostgreSQL y SQLite. En PostgreSQL, con CALIDAD_PARTITIONS=year|month
+    fact_calidad se crea particionada por rango de fecha (la PK incluye fecha).
     """
     eng = get_engine()
     dialect = eng.dialect.name  # 'postgresql', 'sqlite', etc.
 
-    with eng.begin() as conn:
+    with instrument.run("load_create_schema") as r, eng.begin() as conn:
         if dialect == "postgresql":
             # --------- PostgreSQL ---------
             conn.execute(text("""
@@ -28,7 +34,9 @@ def create_schema() -> None:
                 municipio     TEXT,
                 direccion     TEXT,
                 telefono      TEXT,
-                email         TEXT
+                email         TEXT,
+                geo_id        INTEGER,
+                row_hash      TEXT
             );
             """))
 
@@ -39,23 +47,29 @@ def create_schema() -> None:
                 servicio      TEXT,
                 estado        TEXT,
                 fecha         DATE NOT NULL,
+                row_hash      TEXT,
                 CONSTRAINT uq_fact_servicio UNIQUE (provider_id, servicio, fecha),
                 CONSTRAINT fk_fact_servicio_provider
                     FOREIGN KEY (provider_id) REFERENCES dim_prestador(provider_id)
             );
             """))
 
-            conn.execute(text("""
+            # Particionada: PK/UNIQUE deben incluir la clave de partición (fecha)
+            pk = "PRIMARY KEY (id, fecha)" if partitions.enabled() else "PRIMARY KEY (id)"
+            conn.execute(text(f"""
             CREATE TABLE IF NOT EXISTS fact_calidad (
-                id            BIGSERIAL PRIMARY KEY,
+                id            BIGSERIAL,
                 departamento  TEXT NOT NULL,
                 municipio     TEXT NOT NULL,
                 parametro     TEXT NOT NULL,
                 valor         DOUBLE PRECISION,
                 fecha         DATE NOT NULL,
                 unidad        TEXT,
+                geo_id        INTEGER,
+                row_hash      TEXT,
+                {pk},
                 CONSTRAINT uq_fact_calidad UNIQUE (departamento, municipio, parametro, fecha)
-            );
+            ){partitions.ddl("fecha")};
             """))
 
         else:
@@ -71,7 +85,9 @@ def create_schema() -> None:
                 municipio     TEXT,
                 direccion     TEXT,
                 telefono      TEXT,
-                email         TEXT
+                email         TEXT,
+                geo_id        INTEGER,
+                row_hash      TEXT
             );
             """))
 
@@ -82,6 +98,7 @@ def create_schema() -> None:
                 servicio      TEXT,
                 estado        TEXT,
                 fecha         DATE NOT NULL,
+                row_hash      TEXT,
                 UNIQUE (provider_id, servicio, fecha),
                 FOREIGN KEY (provider_id) REFERENCES dim_prestador(provider_id)
             );
@@ -96,38 +113,56 @@ def create_schema() -> None:
                 valor         REAL,
                 fecha         DATE NOT NULL,
                 unidad        TEXT,
+                geo_id        INTEGER,
+                row_hash      TEXT,
                 UNIQUE (departamento, municipio, parametro, fecha)
             );
             """))
 
-        # Índices (mismos para ambos dialectos)
+        # Tablas creadas antes de la huella de fila / de geo_id
+        for t in ("dim_prestador", "fact_servicio", "fact_calidad"):
+            _ensure_column(conn, t, "row_hash", "TEXT", dialect)
+        geo.ensure_table(conn)
+        for t in ("dim_prestador", "fact_calidad"):
+            if _ensure_column(conn, t, "geo_id", "INTEGER", dialect):
+                _backfill_geo_id(conn, t)
+
+        # Índices (mismos para ambos dialectos). Geo por geo_id (INTEGER) en vez del
+        # par TEXT (departamento, municipio): índice más chico y join entero con dim_geo
+        conn.execute(text("DROP INDEX IF EXISTS idx_dim_prestador_depto_mpio;"))
+        conn.execute(text("DROP INDEX IF EXISTS idx_fact_calidad_geo_fecha;"))
         conn.execute(text(
-            "CREATE INDEX IF NOT EXISTS idx_dim_prestador_depto_mpio ON dim_prestador(departamento, municipio);"
+            "CREATE INDEX IF NOT EXISTS idx_dim_prestador_geo ON dim_prestador(geo_id);"
         ))
         conn.execute(text(
             "CREATE INDEX IF NOT EXISTS idx_fact_servicio_provider_fecha ON fact_servicio(provider_id, fecha);"
         ))
         conn.execute(text(
-            "CREATE INDEX IF NOT EXISTS idx_fact_calidad_geo_fecha ON fact_calidad(departamento, municipio, fecha);"
+            "CREATE INDEX IF NOT EXISTS idx_fact_calidad_geoid_fecha ON fact_calidad(geo_id, fecha);"
         ))
 
     print("[load] Schema OK")
+    return r.summary()
 
 
-def load_to_model() -> None:
+def load_to_model() -> dict:
     """
-    UPSERT desde *_stage hacia finales:
-      - dim_prestador_stage -> dim_prestador (ON CONFLICT UPDATE)
-      - fact_servicio_stage -> fact_servicio (ON CONFLICT DO NOTHING)
-      - fact_calidad_stage  -> fact_calidad  (ON CONFLICT DO NOTHING)
-    Funciona en PostgreSQL.
-    En SQLite requiere versión 3.24+ (UPsert nativo); si tu build es muy vieja,
-    cambia los DO NOTHING por INSERT OR IGNORE.
+    UPSERT desde *_stage hacia finales, solo de las filas que cambiaron:
+      - dim_prestador_stage -> dim_prestador (clave provider_id)
+      - fact_servicio_stage -> fact_servicio (clave provider_id, servicio, fecha)
+      - fact_calidad_stage  -> fact_calidad  (clave departamento, municipio, parametro, fecha)
+    dim_prestador y fact_calidad llevan geo_id (src/geo.py) además del par de texto.
+    Cada fila lleva row_hash (md5 de sus columnas): las que ya están con la misma huella
+    no se reescriben (sin versión nueva de la tupla, sin WAL, sin bloat de índices).
+    Los hechos mantienen ON CONFLICT DO NOTHING (la primera carga de cada clave se queda).
+    Funciona en PostgreSQL y en SQLite 3.35+ (UPSERT con WHERE, json_array).
+    Devuelve el resumen de instrumentación (tiempos/filas por paso) para XCom, más
+    `tables`: {tabla: {staged, inserted, updated, unchanged}}.
     """
     eng = get_engine()
     dialect = eng.dialect.name
 
-    with eng.begin() as conn:
+    with instrument.run("load_to_model") as r, eng.begin() as conn:
         # Asegura que las stage existan (idempotente)
         conn.execute(text("""
         CREATE TABLE IF NOT EXISTS dim_prestador_stage (
@@ -139,7 +174,8 @@ def load_to_model() -> None:
             municipio     TEXT,
             direccion     TEXT,
             telefono      TEXT,
-            email         TEXT
+            email         TEXT,
+            row_hash      TEXT
         );"""))
 
         conn.execute(text("""
@@ -147,7 +183,8 @@ def load_to_model() -> None:
             provider_id   TEXT,
             servicio      TEXT,
             estado        TEXT,
-            fecha         DATE
+            fecha         DATE,
+            row_hash      TEXT
         );"""))
 
         conn.execute(text("""
@@ -157,68 +194,169 @@ def load_to_model() -> None:
             parametro     TEXT,
             valor         DOUBLE PRECISION,
             fecha         DATE,
-            unidad        TEXT
+            unidad        TEXT,
+            row_hash      TEXT
         );"""))
 
+        for t in ("dim_prestador", "fact_servicio", "fact_calidad",
+                  "dim_prestador_stage", "fact_servicio_stage", "fact_calidad_stage"):
+            _ensure_column(conn, t, "row_hash", "TEXT", dialect)
+        for t in ("dim_prestador", "fact_calidad"):
+            if _ensure_column(conn, t, "geo_id", "INTEGER", dialect):
+                _backfill_geo_id(conn, t)
+        if dialect == "sqlite":
+            _sqlite_md5(conn)
+
+        # geo_id: los pares que el transform no vio se agregan a dim_geo
+        instrument.set_step("dim_geo")
+        geo.sync(conn, "SELECT departamento, municipio FROM dim_prestador_stage")
+        geo.sync(conn, "SELECT departamento, municipio FROM fact_calidad_stage")
+
+        counts = {}
+
         # 1) Dimensión: UPSERT por provider_id
-        if dialect == "postgresql":
-            conn.execute(text("""
-            INSERT INTO dim_prestador AS d (provider_id, nombre, tipo, clasificacion, departamento, municipio, direccion, telefono, email)
-            SELECT provider_id, nombre, tipo, clasificacion, departamento, municipio, direccion, telefono, email
-            FROM dim_prestador_stage
-            WHERE provider_id IS NOT NULL AND provider_id <> ''
-            ON CONFLICT (provider_id) DO UPDATE SET
-                nombre        = EXCLUDED.nombre,
-                tipo          = EXCLUDED.tipo,
-                clasificacion = EXCLUDED.clasificacion,
-                departamento  = EXCLUDED.departamento,
-                municipio     = EXCLUDED.municipio,
-                direccion     = EXCLUDED.direccion,
-                telefono      = EXCLUDED.telefono,
-                email         = EXCLUDED.email;
-            """))
-        else:
-            # SQLite: ON CONFLICT ... DO UPDATE también existe (3.24+). Usamos DO UPDATE para equiparar.
-            conn.execute(text("""
-            INSERT INTO dim_prestador (provider_id, nombre, tipo, clasificacion, departamento, municipio, direccion, telefono, email)
-            SELECT provider_id, nombre, tipo, clasificacion, departamento, municipio, direccion, telefono, email
-            FROM dim_prestador_stage
-            WHERE provider_id IS NOT NULL AND provider_id <> ''
-            ON CONFLICT(provider_id) DO UPDATE SET
-                nombre        = excluded.nombre,
-                tipo          = excluded.tipo,
-                clasificacion = excluded.clasificacion,
-                departamento  = excluded.departamento,
-                municipio     = excluded.municipio,
-                direccion     = excluded.direccion,
-                telefono      = excluded.telefono,
-                email         = excluded.email;
-            """))
+        instrument.set_step("dim_prestador")
+        counts["dim_prestador"] = _upsert(
+            conn, dialect, "dim_prestador", ["provider_id"],
+            {**{c: c for c in ("provider_id", "nombre", "tipo", "clasificacion", "departamento",
+                               "municipio", "direccion", "telefono", "email")},
+             "geo_id": _geo_id("dim_prestador_stage")},
+            "provider_id IS NOT NULL AND provider_id <> ''",
+        )
 
-        # 2) Hecho servicio: evita duplicados por (provider_id, servicio, fecha)
-        # (ambos dialectos soportan DO NOTHING con UNIQUE)
-        conn.execute(text("""
-        INSERT INTO fact_servicio (provider_id, servicio, estado, fecha)
-        SELECT DISTINCT
-            provider_id,
-            COALESCE(servicio, 'acueducto') AS servicio,
-            estado,
-            COALESCE(fecha, CURRENT_DATE)   AS fecha
-        FROM fact_servicio_stage
-        WHERE provider_id IS NOT NULL AND provider_id <> ''
-        ON CONFLICT (provider_id, servicio, fecha) DO NOTHING;
-        """))
-
-        # 3) Hecho calidad: evita duplicados por (depto, mpio, parametro, fecha)
-        conn.execute(text("""
-        INSERT INTO fact_calidad (departamento, municipio, parametro, valor, fecha, unidad)
-        SELECT DISTINCT
-            departamento, municipio, parametro, valor,
-            COALESCE(fecha, CURRENT_DATE) AS fecha,
-            unidad
-        FROM fact_calidad_stage
-        WHERE departamento IS NOT NULL AND municipio IS NOT NULL AND parametro IS NOT NULL
-        ON CONFLICT (departamento, municipio, parametro, fecha) DO NOTHING;
-        """))
-
-    print("[load] Data upserted → dim_prestador, fact_servicio, fact_calidad")
+        # 2) Hecho servicio: clave (provider_id, servicio, fecha)
+        instrument.set_step("fact_servicio")
+        counts["fact_servicio"] = _upsert(
+            conn, dialect, "fact_servicio", ["provider_id", "servicio", "fecha"],
+            {"provider_id": "provider_id",
+             "servicio":    "COALESCE(servicio, 'acueducto')",
+             "estado":      "estado",
+             "fecha":       "COALESCE(fecha, CURRENT_DATE)"},
+            "provider_id IS NOT NULL AND provider_id <> ''",
+            update=False,
+        )
+
+        # 3) Hecho calidad: clave (depto, mpio, parametro, fecha)
+        instrument.set_step("fact_calidad")
+        if dialect == "postgresql" and partitions.is_partitioned(conn, "fact_calidad"):
+            partitions.ensure(conn, "fact_calidad", "SELECT COALESCE(fecha, CURRENT_DATE) FROM fact_calidad_stage")
+        counts["fact_calidad"] = _upsert(
+            conn, dialect, "fact_calidad", ["departamento", "municipio", "parametro", "fecha"],
+            {"departamento": "departamento",
+             "municipio":    "municipio",
+             "parametro":    "parametro",
+             "valor":        "valor",
+             "fecha":        "COALESCE(fecha, CURRENT_DATE)",
+             "unidad":       "unidad",
+             "geo_id":       _geo_id("fact_calidad_stage")},
+            "departamento IS NOT NULL AND municipio IS NOT NULL AND parametro IS NOT NULL",
+            update=False,
+        )
+
+        instrument.set_step(None)
+
+    for t, c in counts.items():
+        print(f"[load] {t}: {c['inserted']} insertadas, {c['updated']} actualizadas, {c['unchanged']} sin cambios")
+    return {**r.summary(), "tables": counts}
+
+
+# ---------------------------
+# upsert por huella de fila
+# ---------------------------
+
+def _ensure_column(conn, table: str, column: str, sql_type: str, dialect: str) -> bool:
+    """
+    Agrega `column` a tablas creadas antes de que existiera (row_hash, geo_id).
+    Devuelve True si la agregó. El ALTER toma lock exclusivo aunque la columna ya
+    exista, así que solo se corre si falta.
+    """
+    if not sqla_inspect(conn).has_table(table):
+        return False
+    if column in conn.execute(text(f"SELECT * FROM {table} LIMIT 0;")).keys():
+        return False
+    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {sql_type};"))
+    return True
+
+
+def _backfill_geo_id(conn, table: str) -> None:
+    """geo_id de las filas existentes cuando la columna recién se agregó (una sola vez)."""
+    geo.sync(conn, f"SELECT departamento, municipio FROM {table}")
+    conn.execute(text(f"UPDATE {table} SET geo_id = {_geo_id(table)} WHERE geo_id IS NULL;"))
+
+
+def _geo_id(stage: str) -> str:
+    """geo_id del par (departamento, municipio) de la fila de `stage` (búsqueda por PK en dim_geo)."""
+    return (f"(SELECT g.geo_id FROM dim_geo g WHERE g.departamento = {stage}.departamento "
+            f"AND g.municipio = {stage}.municipio)")
+
+
+def _sqlite_md5(conn) -> None:
+    """SQLite no trae md5(): se registra en la conexión."""
+    conn.connection.driver_connection.create_function(
+        "md5", 1, lambda v: None if v is None else hashlib.md5(v.encode("utf-8")).hexdigest(),
+        deterministic=True,
+    )
+
+
+def _hash_sql(dialect: str, exprs) -> str:
+    """Huella de la fila ya normalizada (distingue NULL de '')."""
+    if dialect == "postgresql":
+        return f"md5(ROW({', '.join(exprs)})::text)"
+    return f"md5(json_array({', '.join(exprs)}))"
+
+
+def _upsert(conn, dialect: str, table: str, key, cols: dict, where: str, update: bool = True) -> dict:
+    """
+    INSERT ... ON CONFLICT (key) DO UPDATE solo para las filas cuya huella cambió.
+    `cols` mapea columna destino → expresión sobre {table}_stage. Si el stage ya trae
+    row_hash se usa tal cual; si no, se calcula aquí.
+    Las filas que ya están con la misma huella se descartan con un anti-join contra el
+    índice único antes de deduplicar, así el DISTINCT y el upsert solo ven lo nuevo o
+    cambiado. Con update=False (hechos) se mantiene ON CONFLICT DO NOTHING: la primera
+    versión de cada clave se queda, y el anti-join descarta toda clave ya cargada.
+    Devuelve {staged, inserted, updated, unchanged}.
+    """
+    stage = f"{table}_stage"
+    names = list(cols)
+    sel = [f"{e} AS {c}" for c, e in cols.items()]
+    src = f"""
+        SELECT {', '.join(sel)},
+               COALESCE(row_hash, {_hash_sql(dialect, list(cols.values()))}) AS row_hash
+        FROM {stage}
+        WHERE {where}"""
+    same_key = " AND ".join(f"f.{k} = s.{k}" for k in key)
+    # en PostgreSQL un mismo INSERT no puede tocar dos veces la misma clave
+    distinct = f"DISTINCT ON ({', '.join(key)})" if dialect == "postgresql" else ""
+    sets = ",\n            ".join(f"{c} = excluded.{c}" for c in names + ["row_hash"] if c not in key)
+    if update:
+        existe = f"{same_key} AND f.row_hash = s.row_hash"
+        conflicto = f"""DO UPDATE SET
+            {sets}
+    WHERE t.row_hash IS DISTINCT FROM excluded.row_hash"""
+    else:
+        existe, conflicto = same_key, "DO NOTHING"
+    sql = f"""
+    WITH s AS ({src}
+    )
+    INSERT INTO {table} AS t ({', '.join(names)}, row_hash)
+    SELECT {distinct} {', '.join(f's.{c}' for c in names)}, s.row_hash
+    FROM s
+    WHERE NOT EXISTS (SELECT 1 FROM {table} f WHERE {existe})
+    ORDER BY {', '.join(key)}, s.row_hash
+    ON CONFLICT ({', '.join(key)}) {conflicto}"""
+
+    staged = conn.execute(text(f"SELECT COUNT(*) FROM {stage} WHERE {where};")).scalar()
+    if dialect == "postgresql":
+        # xmax = 0 → la fila es nueva; si no, la actualizó el DO UPDATE
+        flags = [row[0] for row in conn.execute(text(sql + "\n    RETURNING (xmax = 0);"))]
+        inserted = sum(flags)
+        updated = len(flags) - inserted
+    else:
+        antes = conn.execute(text(f"SELECT COUNT(*) FROM {table};")).scalar()
+        conn.execute(text(sql + ";"))
+        # rowcount no sirve para un WITH ... INSERT en sqlite3; changes() incluye los DO UPDATE
+        touched = conn.execute(text("SELECT changes();")).scalar()
+        inserted = conn.execute(text(f"SELECT COUNT(*) FROM {table};")).scalar() - antes
+        updated = max(touched - inserted, 0)
+    return {"staged": staged, "inserted": inserted, "updated": updated,
+            "unchanged": staged - inserted - updated}
@@ -0,0 +1,102 @@
+# src/manifest.py
+# Manifiesto de huellas de las fuentes (tamaño, mtime, sha256) por tabla de staging.
+# Permite que los extractores:
+#   - no hagan nada si el archivo no cambió        → "skip"
+#   - carguen solo la cola si solo se agregaron filas → "append"
+#   - recarguen completo en cualquier otro caso      → "full"
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import inspect as sqla_inspect, text
+from sqlalchemy.engine import Engine
+
+HOST_DIR   = Path(__file__).resolve().parents[1] / "data" / "state" / "manifest"
+DOCKER_DIR = Path("/opt/airflow/data/state/manifest")
+MANIFEST_DIR = Path(os.getenv("MANIFEST_DIR") or (DOCKER_DIR if DOCKER_DIR.parents[1].exists() else HOST_DIR))
+
+# FORCE_EXTRACT=1 ignora el manifiesto y recarga todo
+FORCE_EXTRACT = os.getenv("FORCE_EXTRACT", "0") == "1"
+
+_BLOCK = 1 << 20
+
+
+def fingerprint(path: Path, prefix_len: Optional[int] = None) -> Dict:
+    """
+    Huella del archivo en una sola lectura: sha256 completo y, si se pide,
+    sha256 de los primeros `prefix_len` bytes (para detectar archivos que solo crecieron).
+    """
+    st = path.stat()
+    h = hashlib.sha256()
+    prefix_hash = None
+    read = 0
+    last = b""
+    with open(path, "rb") as fh:
+        while True:
+            block = fh.read(_BLOCK)
+            if not block:
+                break
+            if prefix_len is not None and prefix_hash is None and read + len(block) >= prefix_len:
+                cut = prefix_len - read
+                hp = h.copy()
+                hp.update(block[:cut])
+                prefix_hash = hp.hexdigest()
+            h.update(block)
+            read += len(block)
+            last = block[-1:]
+    return {
+        "path": str(path),
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        "sha256": h.hexdigest(),
+        "prefix_sha256": prefix_hash,
+        "ends_newline": last == b"\n",
+    }
+
+
+def _entry_path(table: str) -> Path:
+    return MANIFEST_DIR / f"{table}.json"
+
+
+def get(table: str) -> Optional[Dict]:
+    p = _entry_path(table)
+    if not p.exists():
+        return None
+    try:
+        return json.loads(p.read_text(encoding="utf-8"))
+    except ValueError:
+        return None
+
+
+def put(table: str, entry: Dict) -> None:
+    MANIFEST_DIR.mkdir(parents=True, exist_ok=True)
+    p = _entry_path(table)
+    tmp = p.with_suffix(".json.tmp")
+    tmp.write_text(json.dumps(entry, indent=2), encoding="utf-8")
+    os.replace(tmp, p)
+
+
+def plan(table: str, path: Path, eng: Engine) -> Tuple[str, Dict, Optional[Dict]]:
+    """
+    Decide cómo cargar `path` en `table`. Devuelve (accion, huella_actual, entrada_previa)
+    con accion ∈ {"skip", "append", "full"}.
+    """
+    prev = None if FORCE_EXTRACT else get(table)
+    if prev is None or prev.get("path") != str(path) or not sqla_inspect(eng).has_table(table):
+        return "full", fingerprint(path), None
+
+    fp = fingerprint(path, prefix_len=prev["size"])
+    if fp["size"] == prev["size"] and fp["sha256"] == prev["sha256"]:
+        return "skip", fp, prev
+    if (fp["size"] > prev["size"] and prev.get("ends_newline")
+            and fp["prefix_sha256"] == prev["sha256"]):
+        # la cola se publica en una transacción y el manifiesto se escribe después: si el
+        # proceso murió entre ambos, staging ya tiene filas que el manifiesto no cuenta
+        with eng.connect() as conn:
+            n = conn.execute(text(f'SELECT COUNT(*) FROM "{table}";')).scalar()
+        if n == prev.get("rows"):
+            return "append", fp, prev
+        print(f"[manifest] {table}: {n} filas en staging vs {prev.get('rows')} en el manifiesto → carga completa")
+    return "full", fp, prev
@@ -0,0 +1,49 @@
+# src/normalize.py
+# Normalización de texto compartida por extractores y transform.
+#
+# Las columnas que se normalizan (encabezados, departamento, municipio, servicio,
+# parametro...) tienen pocos cientos de valores distintos, así que se normaliza cada
+# valor distinto una sola vez (memoizado) y el resultado se mapea de vuelta sobre
+# la columna con los códigos de pd.factorize.
+import re
+from functools import lru_cache
+from unicodedata import normalize as _unorm
+
+import numpy as np
+import pandas as pd
+
+# Mismo mapeo que el translate(...) de transform.py
+_TILDES_FROM = "ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ"
+_TILDES_TO   = "AEIOUAEIOUaeiouaeiouNn"
+_TILDES = str.maketrans(_TILDES_FROM, _TILDES_TO)
+
+_NO_WORD = re.compile(r"[^\w]+")
+
+
+@lru_cache(maxsize=65536)
+def norm_text(value: str) -> str:
+    """Equivalente Python de UPPER(BTRIM(translate(value, tildes)))."""
+    return value.translate(_TILDES).strip(" ").upper()
+
+
+@lru_cache(maxsize=4096)
+def clean_col(name: str) -> str:
+    """Encabezado → snake_case ASCII ('Departamento Prestación' → 'departamento_prestacion')."""
+    s = _unorm("NFKD", name.strip().lower()).encode("ascii", "ignore").decode("utf-8")
+    return _NO_WORD.sub("_", s)
+
+
+def map_distinct(values, fn) -> np.ndarray:
+    """
+    Aplica `fn` una vez por valor distinto de `values` y devuelve el arreglo mapeado
+    (los nulos quedan como None).
+    """
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+    mapped = np.array([fn(str(u)) for u in uniques] + [None], dtype=object)
+    return mapped[codes]  # código -1 (nulo) → último elemento (None)
+
+
+def clean_cols(cols) -> pd.Index:
+    """Normaliza encabezados de un DataFrame."""
+    return pd.Index(map_distinct(list(cols), clean_col))
+
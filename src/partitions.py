@@ -0,0 +1,154 @@
+# src/partitions.py
+# -- coding: utf-8 --
+"""
+Particionado declarativo por rango de fecha (PostgreSQL) de clean_calidad / fact_calidad.
+
+- CALIDAD_PARTITIONS=year|month activa el particionado (vacío = tablas sin particionar).
+- Las particiones se crean solas antes de cada carga (`ensure`), una por año/mes presente.
+- La recarga completa de clean_calidad no hace DELETE: se arma cada rango en una tabla
+  aparte (`preparar`) y en una transacción corta se hace DETACH de la partición vieja
+  y ATTACH de la nueva (`intercambiar`). Solo se tocan los rangos cuyo contenido cambió
+  (huella = COUNT + suma de md5 por fila).
+"""
+import os
+from datetime import timedelta
+from sqlalchemy import text
+
+CALIDAD_PARTITIONS = os.getenv("CALIDAD_PARTITIONS", "").strip().lower()
+
+_PASO = {"year": "1 year", "month": "1 month"}
+
+
+def enabled() -> bool:
+    return CALIDAD_PARTITIONS in _PASO
+
+
+def ddl(key: str) -> str:
+    """Cláusula PARTITION BY para el CREATE TABLE del padre ("" si está desactivado)."""
+    return f" PARTITION BY RANGE ({key})" if enabled() else ""
+
+
+def is_partitioned(conn, table: str) -> bool:
+    return bool(conn.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:t);"), {"t": table}
+    ).scalar())
+
+
+def _nombre(parent: str, ini) -> str:
+    return f"{parent}_p{ini:%Y}" if CALIDAD_PARTITIONS == "year" else f"{parent}_p{ini:%Y%m}"
+
+
+def _fin(ini):
+    """Fin (exclusivo) del rango que empieza en `ini`."""
+    if CALIDAD_PARTITIONS == "year":
+        return ini.replace(year=ini.year + 1)
+    return (ini.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def _rangos(conn, source_sql: str):
+    """[(ini, fin)] de los años/meses presentes en la primera columna de `source_sql`."""
+    paso = _PASO[CALIDAD_PARTITIONS]
+    return conn.execute(text(f"""
+        SELECT ini, (ini + interval '{paso}')::date AS fin
+        FROM (
+          SELECT DISTINCT date_trunc('{CALIDAD_PARTITIONS}', d)::date AS ini
+          FROM ({source_sql}) s(d)
+          WHERE d IS NOT NULL
+        ) t
+        ORDER BY ini;
+    """)).all()
+
+
+def _particiones(conn, parent: str) -> set:
+    return set(conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(:p);
+    """), {"p": parent}).scalars())
+
+
+def ensure(conn, parent: str, source_sql: str) -> int:
+    """Crea las particiones que falten para las fechas de `source_sql`. Devuelve cuántas creó."""
+    existentes = _particiones(conn, parent)
+    n = 0
+    for ini, fin in _rangos(conn, source_sql):
+        p = _nombre(parent, ini)
+        if p not in existentes:
+            conn.execute(text(f"CREATE TABLE {p} PARTITION OF {parent} FOR VALUES FROM ('{ini}') TO ('{fin}');"))
+            n += 1
+    if n:
+        print(f"[partitions] {parent}: {n} particiones nuevas")
+    return n
+
+
+def _huellas(conn, t: str, key: str) -> dict:
+    """{ini: (filas, suma de md5)} por rango; independiente del orden físico."""
+    return {r[0]: (r[1], r[2]) for r in conn.execute(text(f"""
+        SELECT date_trunc('{CALIDAD_PARTITIONS}', {key})::date,
+               COUNT(*),
+               SUM(('x' || substr(md5(s::text), 1, 16))::bit(64)::bigint::numeric)
+        FROM {t} s
+        GROUP BY 1;
+    """))}
+
+
+def preparar(conn, parent: str, key: str, src: str, index_fn) -> dict:
+    """
+    Construye `<particion>_new` para cada rango de `src` que difiere de lo publicado
+    (con CHECK del rango para que el ATTACH no re-valide e índices vía `index_fn`).
+    Devuelve el plan para `intercambiar`: rangos a reemplazar y particiones a borrar.
+    plan["rangos"] son los [(ini, fin)] cuyo contenido cambia (reemplazados o borrados);
+    None si `parent` todavía no estaba particionado (cambia toda la tabla).
+    """
+    publicadas = _particiones(conn, parent) if is_partitioned(conn, parent) else set()
+    actuales = _huellas(conn, parent, key) if publicadas else {}
+    nuevas = _huellas(conn, src, key)
+
+    plan = {"cambia": [], "borra": [], "iguales": 0}
+    for ini, fin in _rangos(conn, f"SELECT {key} FROM {src}"):
+        p = _nombre(parent, ini)
+        if p in publicadas and actuales.get(ini) == nuevas.get(ini):
+            plan["iguales"] += 1
+            continue
+        tmp = p + "_new"
+        conn.execute(text(f"DROP TABLE IF EXISTS {tmp};"))
+        conn.execute(text(f"CREATE TABLE {tmp} (LIKE {src} INCLUDING DEFAULTS);"))
+        conn.execute(text(f"""
+            ALTER TABLE {tmp} ADD CONSTRAINT {tmp}_rango
+            CHECK ({key} IS NOT NULL AND {key} >= DATE '{ini}' AND {key} < DATE '{fin}');
+        """))
+        conn.execute(text(f"INSERT INTO {tmp} SELECT * FROM {src} WHERE {key} >= DATE '{ini}' AND {key} < DATE '{fin}';"))
+        index_fn(conn, tmp)
+        conn.execute(text(f"ANALYZE {tmp};"))
+        plan["cambia"].append((p, ini, fin))
+
+    vigentes = {_nombre(parent, ini) for ini in nuevas}
+    plan["borra"] = sorted(publicadas - vigentes)
+    if publicadas:
+        plan["rangos"] = [(ini, fin) for _, ini, fin in plan["cambia"]]
+        plan["rangos"] += [(ini, _fin(ini)) for ini in actuales if ini not in nuevas]
+    else:
+        plan["rangos"] = None
+    return plan
+
+
+def intercambiar(conn, parent: str, plan: dict, indices) -> None:
+    """DETACH + DROP de las particiones reemplazadas/obsoletas y ATTACH de las nuevas."""
+    for p in plan["borra"]:
+        conn.execute(text(f"ALTER TABLE {parent} DETACH PARTITION {p};"))
+        conn.execute(text(f"DROP TABLE {p};"))
+    publicadas = _particiones(conn, parent)
+    for p, ini, fin in plan["cambia"]:
+        tmp = p + "_new"
+        if p in publicadas:
+            conn.execute(text(f"ALTER TABLE {parent} DETACH PARTITION {p};"))
+            conn.execute(text(f"DROP TABLE {p};"))
+        conn.execute(text(f"ALTER TABLE {tmp} RENAME TO {p};"))
+        for suf in indices:
+            conn.execute(text(f"ALTER INDEX IF EXISTS idx_{tmp}_{suf} RENAME TO idx_{p}_{suf};"))
+        conn.execute(text(f"ALTER TABLE {parent} ATTACH PARTITION {p} FOR VALUES FROM ('{ini}') TO ('{fin}');"))
+        conn.execute(text(f"ALTER TABLE {p} DROP CONSTRAINT {tmp}_rango;"))
+    print(
+        f"[partitions] {parent}: reemplazadas={len(plan['cambia'])} "
+        f"sin cambios={plan['iguales']} borradas={len(plan['borra'])}"
+    )
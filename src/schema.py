@@ -0,0 +1,168 @@
+# src/schema.py
+# Registro de esquemas de staging (stg_old, stg_new, stg_api).
+#
+# Cada fuente declara el tipo de sus columnas (nombres ya normalizados con clean_cols):
+#   - "category": pocos valores distintos (departamento, servicio, estado...) → pd.Categorical
+#   - "string":   texto libre (nombre, dirección...) → object
+#   - "float":    numérico (resultado, latitud, longitud) → float64
+#   - "date":     fecha parseada una sola vez en el extract → datetime64
+# Las columnas no declaradas quedan como "string". Los extractores aplican el esquema
+# a cada chunk apenas lo leen (`apply`) y la tabla de staging se crea con el DDL que
+# sale del mismo registro (`create`), en vez de inferirlo del DataFrame.
+import hashlib
+import json
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import inspect as sqla_inspect, text
+from sqlalchemy.engine import Engine
+
+_PRESTADORES = {
+    "departamento_prestacion": "category",
+    "municipio_prestacion":    "category",
+    "servicio":                "category",
+    "estado":                  "category",
+    "nombre":                  "string",
+    "nit":                     "string",
+    "departamento_domicilio":  "category",
+    "municipio_domicilio":     "category",
+    "direccion":               "string",
+    "telefono":                "string",
+    "email":                   "string",
+    "tipo_inscripcion":        "category",
+    "representante_legal":     "string",
+    "tipo_prestador":          "category",
+    "clasificacion":           "category",
+}
+
+SCHEMAS: Dict[str, Dict[str, str]] = {
+    "stg_old": _PRESTADORES,
+    "stg_api": _PRESTADORES,
+    "stg_new": {
+        "departamento":                  "category",
+        "municipio":                     "category",
+        "fecha":                         "date",
+        "propiedad_observada":           "category",
+        "resultado":                     "float",
+        "unidad_del_resultado":          "category",
+        "nombre_del_punto_de_monitoreo": "category",
+        "latitud":                       "float",
+        "longitud":                      "float",
+    },
+}
+
+# Columnas numéricas donde se descarta todo lo que no sea dígito, punto o signo
+# ('<0.5' → 0.5, 'N.D.' → NULL), la misma regla que antes aplicaba el transform en SQL
+_SOLO_NUMEROS = {("stg_new", "resultado")}
+
+_SQL_TYPES = {"category": "TEXT", "string": "TEXT", "float": "DOUBLE PRECISION", "date": "DATE"}
+
+# Formato de fecha de la fuente de calidad (Socrata): '2021 Mar 04 03:00:00 PM'
+_FECHA_SOCRATA = "%Y %b %d %I:%M:%S %p"
+
+
+def dtype(table: str, col: str) -> str:
+    return SCHEMAS.get(table, {}).get(col, "string")
+
+
+def version(table: str) -> str:
+    """Huella corta del esquema declarado (cambia → los extractores recargan completo)."""
+    raw = json.dumps(SCHEMAS.get(table, {}), sort_keys=True) + repr(sorted(c for t, c in _SOLO_NUMEROS if t == table))
+    return hashlib.md5(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def _float(s: pd.Series, solo_numeros: bool) -> pd.Series:
+    if pd.api.types.is_numeric_dtype(s.dtype):
+        return s.astype("float64")
+    t = s.astype(object).where(s.notna(), "").astype(str)
+    t = t.str.replace(r"[^0-9.\-]", "", regex=True) if solo_numeros else t.str.strip()
+    return pd.to_numeric(t.replace("", np.nan), errors="coerce").astype("float64")
+
+
+def _date(s: pd.Series) -> pd.Series:
+    if pd.api.types.is_datetime64_any_dtype(s.dtype):
+        return s.dt.normalize()
+    t = s.astype("string").str.strip()
+    t = t.mask(t == "")
+    d = pd.to_datetime(t, format=_FECHA_SOCRATA, errors="coerce")
+    resto = d.isna() & t.notna()
+    if resto.any():
+        d[resto] = pd.to_datetime(t[resto], format="ISO8601", errors="coerce")
+        resto = d.isna() & t.notna()
+        if resto.any():
+            d[resto] = pd.to_datetime(t[resto], format="mixed", errors="coerce")
+    return d.dt.normalize()
+
+
+def apply(table: str, df: pd.DataFrame) -> pd.DataFrame:
+    """Convierte las columnas de `df` a los tipos declarados para `table`."""
+    out = {}
+    for c in df.columns:
+        kind, s = dtype(table, c), df[c]
+        if kind == "category":
+            out[c] = s if isinstance(s.dtype, pd.CategoricalDtype) else s.astype("category")
+        elif kind == "float":
+            out[c] = _float(s, (table, c) in _SOLO_NUMEROS)
+        elif kind == "date":
+            out[c] = _date(s)
+        else:
+            out[c] = s.astype(object) if isinstance(s.dtype, pd.CategoricalDtype) else s
+    return pd.DataFrame(out, index=df.index, columns=df.columns)
+
+
+def mem_mb(df: pd.DataFrame) -> float:
+    return float(df.memory_usage(deep=True, index=False).sum()) / 2**20
+
+
+def _qi(name: str) -> str:
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def ddl(table: str, columns: Iterable[str], temporary: bool = False, name: Optional[str] = None) -> str:
+    """DDL con los tipos de `table`; `name` crea la tabla con otro nombre (p. ej. la sombra)."""
+    cols = ",\n  ".join(f"{_qi(c)} {_SQL_TYPES[dtype(table, c)]}" for c in columns)
+    return f"CREATE {'TEMP ' if temporary else ''}TABLE {_qi(name or table)} (\n  {cols}\n);"
+
+
+def create(eng: Engine, table: str, columns: Iterable[str], name: Optional[str] = None) -> None:
+    """(Re)crea la tabla de staging (o `name`, con los tipos de `table`) con los tipos del registro."""
+    name = name or table
+    with eng.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {_qi(name)};"))
+        conn.execute(text(ddl(table, columns, name=name)))
+
+
+def shadow(table: str) -> str:
+    """Tabla donde el extract carga antes de publicar en `table`."""
+    return f"{table}_load"
+
+
+def drop_shadow(eng: Engine, table: str) -> None:
+    """Borra la tabla sombra de `table` (carga abortada): staging queda como estaba."""
+    with eng.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {_qi(shadow(table))};"))
+
+
+def publish(eng: Engine, table: str, replace: bool = False) -> int:
+    """
+    Publica la tabla sombra en `table` en una sola transacción y la borra:
+      - replace=False (cola de un append): un solo INSERT ... SELECT
+      - replace=True  (carga completa): DROP de `table` + rename de la sombra
+    Si el extract falla antes (o la suite no pasa), staging queda como estaba.
+    Devuelve las filas publicadas (0 si no hay sombra: el archivo no tenía filas).
+    """
+    src = shadow(table)
+    if not sqla_inspect(eng).has_table(src):
+        return 0
+    with eng.begin() as conn:
+        if replace:
+            n = conn.execute(text(f"SELECT COUNT(*) FROM {_qi(src)};")).scalar()
+            conn.execute(text(f"DROP TABLE IF EXISTS {_qi(table)};"))
+            conn.execute(text(f"ALTER TABLE {_qi(src)} RENAME TO {_qi(table)};"))
+            return n
+        cols = list(conn.execute(text(f"SELECT * FROM {_qi(src)} LIMIT 0;")).keys())
+        lista = ", ".join(_qi(c) for c in cols)
+        n = conn.execute(text(f"INSERT INTO {_qi(table)} ({lista}) SELECT {lista} FROM {_qi(src)};")).rowcount
+        conn.execute(text(f"DROP TABLE {_qi(src)};"))
+    return n
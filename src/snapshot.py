@@ -0,0 +1,202 @@
+# src/snapshot.py
+# Snapshots columnares de las fuentes ya parseadas (NumPy memmap, sin dependencias extra).
+#
+# Cada extractor, al cargar completo, guarda lo que leyó en
+#   data/state/snapshots/<tabla>/<clave>/
+# con la clave = sha256 del archivo (manifiesto) o del contenido recibido (API):
+#   - meta.json      filas, columnas (nombre, tipo, archivo) y metadatos del extract
+#   - c<i>.bin       columnas de texto/categoría: códigos int32 (-1 = nulo)
+#                    + c<i>.cats.json con el diccionario de valores
+#                    columnas numéricas / fechas: valores crudos (float64, int64, ...)
+#
+# Al leer, cada columna se abre con np.memmap (sin parsear ni copiar: solo se tocan las
+# páginas que se usan) y las de texto vuelven como pd.Categorical sobre los códigos.
+# Si la huella del archivo coincide con un snapshot, el extractor alimenta staging desde
+# ahí (`feed`) en vez de parsear el CSV. SNAPSHOT_REPLAY=1 usa el último snapshot de cada
+# tabla sin mirar la fuente (backfills / depuración local sin API).
+import json
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.engine import Engine
+
+from .bulk_load import bulk_load
+from . import schema
+
+HOST_DIR   = Path(__file__).resolve().parents[1] / "data" / "state" / "snapshots"
+DOCKER_DIR = Path("/opt/airflow/data/state/snapshots")
+SNAPSHOT_DIR = Path(os.getenv("SNAPSHOT_DIR") or (DOCKER_DIR if DOCKER_DIR.parents[1].exists() else HOST_DIR))
+
+# SNAPSHOTS=0 no escribe ni usa snapshots
+SNAPSHOTS = os.getenv("SNAPSHOTS", "1") == "1"
+SNAPSHOT_REPLAY = os.getenv("SNAPSHOT_REPLAY", "0") == "1"
+# Snapshots que se conservan por tabla
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "2"))
+
+_CODES = np.dtype("int32")
+
+
+def _es_texto(s: pd.Series) -> bool:
+    return s.dtype == object or isinstance(s.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(s.dtype)
+
+
+class Writer:
+    """Escribe un snapshot chunk a chunk; solo queda visible después de `commit`."""
+
+    def __init__(self, table: str, key: str):
+        self.table, self.key = table, key
+        base = SNAPSHOT_DIR / table
+        # restos de escrituras interrumpidas
+        for d in base.glob("*.tmp-*") if base.exists() else []:
+            shutil.rmtree(d, ignore_errors=True)
+        self.dir = base / f"{key}.tmp-{os.getpid()}"
+        self.dir.mkdir(parents=True)
+        self.rows = 0
+        self.cols: List[Dict] = []
+        self._dicts: List[Optional[Dict[str, int]]] = []
+
+    def add(self, df: pd.DataFrame) -> None:
+        if not self.cols:
+            for i, c in enumerate(df.columns):
+                s = df[c]
+                if _es_texto(s):
+                    self.cols.append({"name": str(c), "kind": "cat", "dtype": _CODES.str, "file": f"c{i}.bin"})
+                    self._dicts.append({})
+                else:
+                    dt = s.dtype
+                    kind = "datetime" if pd.api.types.is_datetime64_any_dtype(dt) else "num"
+                    self.cols.append({"name": str(c), "kind": kind, "dtype": str(dt), "file": f"c{i}.bin"})
+                    self._dicts.append(None)
+        elif [c["name"] for c in self.cols] != [str(c) for c in df.columns]:
+            raise ValueError(f"[snapshot] {self.table}: columnas distintas entre chunks")
+
+        for col, d, c in zip(self.cols, self._dicts, df.columns):
+            s = df[c]
+            if d is not None:
+                codes, uniques = pd.factorize(s.astype(object), use_na_sentinel=True)
+                # códigos locales del chunk → códigos globales del diccionario
+                glob = np.fromiter((d.setdefault(str(u), len(d)) for u in uniques), dtype=_CODES, count=len(uniques))
+                arr = np.where(codes < 0, -1, glob[np.maximum(codes, 0)] if len(glob) else -1).astype(_CODES)
+            elif col["kind"] == "datetime":
+                arr = s.to_numpy(dtype="datetime64[ns]").view("int64")
+            else:
+                arr = s.to_numpy(dtype=col["dtype"])
+            with open(self.dir / col["file"], "ab") as fh:
+                fh.write(np.ascontiguousarray(arr).tobytes())
+        self.rows += len(df)
+
+    def commit(self, **meta) -> Path:
+        for col, d in zip(self.cols, self._dicts):
+            if d is not None:
+                cats = self.dir / col["file"].replace(".bin", ".cats.json")
+                cats.write_text(json.dumps(list(d), ensure_ascii=False), encoding="utf-8")
+        (self.dir / "meta.json").write_text(json.dumps({
+            "table": self.table, "key": self.key, "rows": self.rows, "columns": self.cols,
+            "created": datetime.now().isoformat(timespec="seconds"), **meta,
+        }, ensure_ascii=False, indent=1), encoding="utf-8")
+        final = self.dir.parent / self.key
+        shutil.rmtree(final, ignore_errors=True)
+        os.replace(self.dir, final)
+        _prune(self.table)
+        print(f"[snapshot] {self.table}: {self.rows} filas → {final}")
+        return final
+
+    def abort(self) -> None:
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class Snapshot:
+    """Snapshot leído con memmap: `frame`/`chunks` arman DataFrames sin re-parsear."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        self.rows = self.meta["rows"]
+        self.columns = [c["name"] for c in self.meta["columns"]]
+        self._arrays = {}
+
+    def _array(self, col: Dict) -> np.ndarray:
+        if col["name"] not in self._arrays:
+            dt = np.dtype("int64" if col["kind"] == "datetime" else col["dtype"])
+            f = self.path / col["file"]
+            self._arrays[col["name"]] = (np.memmap(f, dtype=dt, mode="r", shape=(self.rows,))
+                                         if self.rows else np.empty(0, dtype=dt))
+        return self._arrays[col["name"]]
+
+    def column(self, name: str, start: int = 0, stop: Optional[int] = None):
+        col = next(c for c in self.meta["columns"] if c["name"] == name)
+        arr = self._array(col)[start:stop]
+        if col["kind"] == "cat":
+            cats = json.loads((self.path / col["file"].replace(".bin", ".cats.json")).read_text(encoding="utf-8"))
+            return pd.Categorical.from_codes(arr, categories=pd.Index(cats, dtype=object))
+        if col["kind"] == "datetime":
+            return arr.view("datetime64[ns]")
+        return arr
+
+    def frame(self, start: int = 0, stop: Optional[int] = None, text: bool = False) -> pd.DataFrame:
+        """Filas [start, stop). Con `text=True` las categorías vuelven a object (como el CSV)."""
+        data = {}
+        for name in self.columns:
+            v = self.column(name, start, stop)
+            data[name] = pd.Series(v).astype(object) if text and isinstance(v, pd.Categorical) else v
+        return pd.DataFrame(data, columns=self.columns)
+
+    def chunks(self, size: int, text: bool = False) -> Iterator[pd.DataFrame]:
+        size = size if size > 0 else max(self.rows, 1)
+        for start in range(0, max(self.rows, 1), size):
+            yield self.frame(start, min(start + size, self.rows), text)
+
+
+def writer(table: str, key: str) -> Optional[Writer]:
+    return Writer(table, key) if SNAPSHOTS else None
+
+
+def find(table: str, key: Optional[str] = None) -> Optional[Snapshot]:
+    """Snapshot de `table` con esa clave (o el más reciente con SNAPSHOT_REPLAY)."""
+    if not SNAPSHOTS:
+        return None
+    base = SNAPSHOT_DIR / table
+    if SNAPSHOT_REPLAY:
+        hechos = _completos(base)
+        return Snapshot(hechos[0]) if hechos else None
+    if key and (base / key / "meta.json").exists():
+        return Snapshot(base / key)
+    return None
+
+
+def feed(snap: Snapshot, table: str, eng: Engine, chunksize: int) -> int:
+    """
+    Carga el snapshot en la tabla sombra, con los tipos del registro de esquemas, y la
+    publica sobre `table` como una carga completa (schema.publish). Si falla a mitad,
+    borra la sombra y `table` queda como estaba.
+    """
+    dest = schema.shadow(table)
+    try:
+        for i, df in enumerate(snap.chunks(chunksize)):
+            # no-op sobre columnas ya tipadas; convierte snapshots de un esquema anterior
+            df = schema.apply(table, df)
+            if i == 0:
+                schema.create(eng, table, df.columns, name=dest)
+            bulk_load(df, dest, eng, if_exists="append")
+    except Exception:
+        schema.drop_shadow(eng, table)
+        raise
+    return schema.publish(eng, table, replace=True)
+
+
+def _completos(base: Path) -> List[Path]:
+    """Snapshots terminados de una tabla, del más nuevo al más viejo."""
+    if not base.exists():
+        return []
+    hechos = [d for d in base.iterdir() if (d / "meta.json").exists() and ".tmp-" not in d.name]
+    return sorted(hechos, key=lambda d: (d / "meta.json").stat().st_mtime, reverse=True)
+
+
+def _prune(table: str) -> None:
+    for d in _completos(SNAPSHOT_DIR / table)[max(SNAPSHOT_KEEP, 1):]:
+        shutil.rmtree(d, ignore_errors=True)
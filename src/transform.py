@@ -1,7 +1,15 @@
 # src/transform.py
 # -- coding: utf-8 --
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from sqlalchemy import text
 from .util_db import get_engine
+from . import geo, instrument, partitions
+
+# full = DELETE + reconstrucción total | incremental = solo filas nuevas/cambiadas/borradas
+# (solo clean_calidad; clean_staging siempre es full, ver run_prestadores)
+TRANSFORM_MODE = os.getenv("TRANSFORM_MODE", "full").strip().lower()
 
 # Catálogo oficial de departamentos (normalizados: UPPER, sin tildes)
 DEPARTAMENTOS = (
@@ -14,434 +22,1275 @@ DEPARTAMENTOS = (
 
 DEP_SQL = ",".join([f"'{d}'" for d in DEPARTAMENTOS])
 
+_TILDES = "'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'"
 
-def run() -> None:
-    """
-    Transforma los staging a tablas limpias y aplica reglas de calidad:
+# Reglas fila a fila de calidad (equivalen a los UPDATE del build multipaso)
+_VALOR_REGLAS = """CASE
+              WHEN parametro = 'PH' AND (valor < 0 OR valor > 14) THEN NULL
+              WHEN parametro LIKE 'CLORO%' AND (valor < 0 OR valor > 5) THEN NULL
+              WHEN parametro IN ('TURBIDEZ','CONDUCTIVIDAD','DUREZA','ALCALINIDAD') AND valor < 0 THEN NULL
+              ELSE valor
+            END"""
+_LAT_PAREADA = "CASE WHEN (latitud IS NULL) <> (longitud IS NULL) THEN NULL ELSE latitud END"
+_LON_PAREADA = "CASE WHEN (latitud IS NULL) <> (longitud IS NULL) THEN NULL ELSE longitud END"
+# Desempate del dedupe de calidad: entre duplicados de (dep, muni, parametro, fecha,
+# punto) queda siempre la misma fila en todos los builds (ya con reglas aplicadas)
+_DEDUP_CAL_ORDEN = "valor, unidad, nombre_punto, latitud, longitud"
 
-    A) clean_staging (prestadores/servicios) ← stg_old + stg_api
-       - Normalización (UPPER/TRIM/sin tildes)
-       - provider_id = NIT o md5(nombre|dep|muni|servicio)
-       - Catálogos: servicio/estado
-       - Dominio: departamento
-       - Deduplicación por (provider_id,servicio,departamento,municipio)
-       - Imputación: estado (moda por servicio,departamento) / clasificacion (moda por servicio)
-       - Purgado final de claves nulas/vacías y re-dedupe
+# multipass = INSERT + DELETE/UPDATE sucesivos | fused = un solo INSERT ... SELECT
+CALIDAD_BUILD = os.getenv("CALIDAD_BUILD", "multipass").strip().lower()
 
-    B) clean_calidad (calidad de agua) ← stg_new
-       - Parseo de fecha
-       - Limpieza numérica de valor (DOUBLE PRECISION)
-       - Coordenadas válidas para Colombia (lat/lon) + pareo de nulidad
-       - Dominio de departamento y rango de fechas
-       - Reglas por parámetro (pH, CLORO, no-negativos)
-       - Deduplicación por (dep,muni,parametro,fecha[,nombre_punto])
-       - Imputación: unidad (moda por parametro) / valor (mediana por parametro,departamento → fallback mediana global)
-    """
-    eng = get_engine()
-    with eng.begin() as conn:
+# inplace = DELETE + rellenar clean_* | swap = construir en tabla sombra UNLOGGED y
+# publicarla con un rename (los lectores nunca ven una tabla a medio construir)
+PUBLISH_MODE = os.getenv("PUBLISH_MODE", "inplace").strip().lower()
+# Con swap: pasar la tabla publicada a LOGGED (reescribe con WAL; por defecto no,
+# clean_* se reconstruye desde staging si un crash la deja vacía)
+PUBLISH_SET_LOGGED = os.getenv("PUBLISH_SET_LOGGED", "0") == "1"
+# Espera máxima por el lock exclusivo del swap
+SWAP_LOCK_TIMEOUT = os.getenv("SWAP_LOCK_TIMEOUT", "30s")
 
-        # =========================================================================
-        # Limpieza de artefactos (idempotente)
-        # =========================================================================
-        conn.execute(text("DROP VIEW IF EXISTS v_clean_preview;"))
-        conn.execute(text("DROP VIEW IF EXISTS v_clean_calidad_preview;"))
-        conn.execute(text("DROP VIEW IF EXISTS v_clean_calidad_agg;"))
+# Conexiones concurrentes para construir clean_calidad por cubetas de departamento
+# (1 = una sola transacción; >1 implica publicación por swap)
+CALIDAD_WORKERS = int(os.getenv("CALIDAD_WORKERS", "1"))
 
-        # =========================================================================
-        # A) PRESTADORES: clean_staging
-        # =========================================================================
-        conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS clean_staging(
-                provider_id   TEXT NOT NULL,
-                nombre        TEXT NOT NULL,
-                departamento  TEXT NOT NULL,
-                municipio     TEXT NOT NULL,
-                servicio      TEXT NOT NULL,
-                estado        TEXT,
-                clasificacion TEXT
-            );
-        """))
-        conn.execute(text("DELETE FROM clean_staging;"))
+# Verificar todas las fechas de clean_calidad_agg por huella (por defecto solo las
+# fechas que el build informa como tocadas)
+CALIDAD_AGG_FULL = os.getenv("CALIDAD_AGG_FULL", "0") == "1"
 
-        # stg_old → clean_staging
-        conn.execute(text(f"""
-            INSERT INTO clean_staging(provider_id,nombre,departamento,municipio,servicio,estado,clasificacion)
-            SELECT
-                COALESCE(
-                    NULLIF(BTRIM(nit), ''),
-                    md5(
-                        COALESCE(UPPER(BTRIM(translate(nombre, 'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ', 'AEIOUAEIOUaeiouaeiouNn'))),'') || '|' ||
-                        COALESCE(UPPER(BTRIM(translate(departamento_prestacion,'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))),'') || '|' ||
-                        COALESCE(UPPER(BTRIM(translate(municipio_prestacion,  'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))),'') || '|' ||
-                        COALESCE(UPPER(BTRIM(translate(servicio,              'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))),'')
-                    )
-                ) AS provider_id,
-                UPPER(BTRIM(translate(nombre,'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))) AS nombre,
-                UPPER(BTRIM(translate(departamento_prestacion,'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))) AS departamento,
-                UPPER(BTRIM(translate(municipio_prestacion,  'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))) AS municipio,
-                CASE
-                  WHEN UPPER(BTRIM(servicio)) LIKE '%ACUED%' THEN 'ACUEDUCTO'
-                  WHEN UPPER(BTRIM(servicio)) LIKE '%ALCANT%' THEN 'ALCANTARILLADO'
-                  WHEN UPPER(BTRIM(servicio)) LIKE '%ASEO%' THEN 'ASEO'
-                  ELSE UPPER(BTRIM(translate(servicio,'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn')))
-                END AS servicio,
-                CASE
-                  WHEN UPPER(BTRIM(estado)) IN ('OPERATIVA','EN OPERACION','EN OPERACIÓN','ACTIVA') THEN 'OPERATIVA'
-                  WHEN UPPER(BTRIM(estado)) LIKE 'SUSPEN%' THEN 'SUSPENDIDA'
-                  WHEN COALESCE(estado,'') = '' THEN 'OTRO'
-                  ELSE 'OTRO'
-                END AS estado,
-                NULLIF(UPPER(BTRIM(translate(clasificacion,'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))),'') AS clasificacion
-            FROM stg_old
-            WHERE nombre IS NOT NULL
-              AND departamento_prestacion IS NOT NULL
-              AND municipio_prestacion IS NOT NULL
-              AND servicio IS NOT NULL;
-        """))
+# Días sin aparecer en el staging de ninguna unidad tras los que un valor sale de norm_dict
+NORM_DICT_TTL_DAYS = int(os.getenv("NORM_DICT_TTL_DAYS", "7"))
 
-        # stg_api → clean_staging
-        conn.execute(text(f"""
-            INSERT INTO clean_staging(provider_id,nombre,departamento,municipio,servicio,estado,clasificacion)
+
+def _norm(expr: str) -> str:
+    """UPPER + TRIM + sin tildes (SQL)."""
+    return f"UPPER(BTRIM(translate({expr},{_TILDES})))"
+
+
+# Columnas de baja cardinalidad que se normalizan vía diccionario (norm_dict):
+# cada valor distinto se normaliza una sola vez y las filas lo buscan por join.
+_DICT_COLS = {
+    "stg_old": ("departamento_prestacion", "municipio_prestacion", "servicio", "clasificacion"),
+    "stg_api": ("departamento_prestacion", "municipio_prestacion", "servicio", "clasificacion"),
+    "stg_new": ("departamento", "municipio", "propiedad_observada"),
+}
+
+
+# Tablas de staging que lee cada unidad (y que su extract recrea)
+_PRESTADORES_STG = ("stg_old", "stg_api")
+_CALIDAD_STG = ("stg_new",)
+
+
+def _refresh_norm_dict(conn, tables=None) -> None:
+    """
+    Agrega a norm_dict(raw → norm) los valores distintos nuevos de `tables` (default:
+    todo _DICT_COLS). Cada unidad pasa solo sus tablas: la otra puede estar siendo
+    recreada por su extract (DROP + CREATE) en ese momento.
+    Los valores que ya estaban se marcan como vistos hoy (`visto`, una vez por día) y
+    se borran los que ninguna unidad vio en NORM_DICT_TTL_DAYS: ya no están en ningún
+    staging. Borrar nunca rompe un build: cada unidad refresca sus valores justo antes.
+    """
+    tables = tables or tuple(_DICT_COLS)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS norm_dict(
+            raw   TEXT PRIMARY KEY,
+            norm  TEXT,
+            visto DATE NOT NULL DEFAULT CURRENT_DATE
+        );
+    """))
+    # sin ALTER incondicional: su lock exclusivo esperaría al build de la otra unidad
+    if not conn.execute(text("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'norm_dict' AND column_name = 'visto'
+          AND table_schema = ANY(current_schemas(false));
+    """)).scalar():
+        conn.execute(text("ALTER TABLE norm_dict ADD COLUMN visto DATE NOT NULL DEFAULT CURRENT_DATE;"))
+    valores = "\n            UNION\n            ".join(
+        f"SELECT {c}::text FROM {t}" for t in tables for c in _DICT_COLS[t]
+    )
+    conn.execute(text(f"""
+        INSERT INTO norm_dict(raw, norm)
+        SELECT v, {_norm('v')}
+        FROM (
+            {valores}
+        ) t(v)
+        WHERE v IS NOT NULL
+        ON CONFLICT (raw) DO UPDATE SET visto = CURRENT_DATE
+        WHERE norm_dict.visto < CURRENT_DATE;
+    """))
+    n = conn.execute(
+        text("DELETE FROM norm_dict WHERE visto < CURRENT_DATE - CAST(:d AS int);"), {"d": NORM_DICT_TTL_DAYS}
+    ).rowcount
+    if n:
+        print(f"[transform] norm_dict → {n} valores sin uso hace {NORM_DICT_TTL_DAYS} días borrados")
+
+
+def _prestadores_select(src: str, con_nit: bool) -> str:
+    """
+    SELECT normalizado de prestadores desde stg_old / stg_api.
+    Columnas: provider_id, nombre, departamento, municipio, servicio, estado, clasificacion.
+    Departamento/municipio/servicio/clasificacion salen de norm_dict y el nombre se
+    normaliza una sola vez por fila (también lo reutiliza el md5 de provider_id).
+    """
+    md5 = """md5(
+                    COALESCE(p.nombre_n,'') || '|' ||
+                    COALESCE(dd.norm,'') || '|' ||
+                    COALESCE(dm.norm,'') || '|' ||
+                    COALESCE(ds.norm,'')
+                )"""
+    provider_id = f"COALESCE(NULLIF(BTRIM(p.nit_t), ''), {md5})" if con_nit else md5
+    nit = "nit::text AS nit_t," if con_nit else ""
+    return f"""
             SELECT
-                md5(
-                    COALESCE(UPPER(BTRIM(translate(nombre, 'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ', 'AEIOUAEIOUaeiouaeiouNn'))),'') || '|' ||
-                    COALESCE(UPPER(BTRIM(translate(departamento_prestacion,'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))),'') || '|' ||
-                    COALESCE(UPPER(BTRIM(translate(municipio_prestacion,  'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))),'') || '|' ||
-                    COALESCE(UPPER(BTRIM(translate(servicio,              'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))),'')
-                ) AS provider_id,
-                UPPER(BTRIM(translate(nombre,'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))) AS nombre,
-                UPPER(BTRIM(translate(departamento_prestacion,'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))) AS departamento,
-                UPPER(BTRIM(translate(municipio_prestacion,  'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))) AS municipio,
+                {provider_id} AS provider_id,
+                p.nombre_n AS nombre,
+                dd.norm AS departamento,
+                dm.norm AS municipio,
                 CASE
-                  WHEN UPPER(BTRIM(servicio)) LIKE '%ACUED%' THEN 'ACUEDUCTO'
-                  WHEN UPPER(BTRIM(servicio)) LIKE '%ALCANT%' THEN 'ALCANTARILLADO'
-                  WHEN UPPER(BTRIM(servicio)) LIKE '%ASEO%' THEN 'ASEO'
-                  ELSE UPPER(BTRIM(translate(servicio,'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn')))
+                  WHEN UPPER(BTRIM(p.servicio_t)) LIKE '%ACUED%' THEN 'ACUEDUCTO'
+                  WHEN UPPER(BTRIM(p.servicio_t)) LIKE '%ALCANT%' THEN 'ALCANTARILLADO'
+                  WHEN UPPER(BTRIM(p.servicio_t)) LIKE '%ASEO%' THEN 'ASEO'
+                  ELSE ds.norm
                 END AS servicio,
                 CASE
-                  WHEN UPPER(BTRIM(estado)) IN ('OPERATIVA','EN OPERACION','EN OPERACIÓN','ACTIVA') THEN 'OPERATIVA'
-                  WHEN UPPER(BTRIM(estado)) LIKE 'SUSPEN%' THEN 'SUSPENDIDA'
-                  WHEN COALESCE(estado,'') = '' THEN 'OTRO'
+                  WHEN UPPER(BTRIM(p.estado_t)) IN ('OPERATIVA','EN OPERACION','EN OPERACIÓN','ACTIVA') THEN 'OPERATIVA'
+                  WHEN UPPER(BTRIM(p.estado_t)) LIKE 'SUSPEN%' THEN 'SUSPENDIDA'
+                  WHEN COALESCE(p.estado_t,'') = '' THEN 'OTRO'
                   ELSE 'OTRO'
                 END AS estado,
-                NULLIF(UPPER(BTRIM(translate(clasificacion,'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))),'') AS clasificacion
-            FROM stg_api
-            WHERE nombre IS NOT NULL
-              AND departamento_prestacion IS NOT NULL
-              AND municipio_prestacion IS NOT NULL
-              AND servicio IS NOT NULL;
-        """))
+                NULLIF(dc.norm,'') AS clasificacion
+            FROM (
+              SELECT {nit}
+                {_norm('nombre::text')}             AS nombre_n,
+                departamento_prestacion::text       AS departamento_t,
+                municipio_prestacion::text          AS municipio_t,
+                servicio::text                      AS servicio_t,
+                estado::text                        AS estado_t,
+                clasificacion::text                 AS clasificacion_t
+              FROM {src}
+              WHERE nombre IS NOT NULL
+                AND departamento_prestacion IS NOT NULL
+                AND municipio_prestacion IS NOT NULL
+                AND servicio IS NOT NULL
+            ) p
+            LEFT JOIN norm_dict dd ON dd.raw = p.departamento_t
+            LEFT JOIN norm_dict dm ON dm.raw = p.municipio_t
+            LEFT JOIN norm_dict ds ON ds.raw = p.servicio_t
+            LEFT JOIN norm_dict dc ON dc.raw = p.clasificacion_t"""
 
-        # Dominio de departamento
-        conn.execute(text(f"""
-            DELETE FROM clean_staging
-            WHERE departamento NOT IN ({DEP_SQL});
-        """))
 
-        # Deduplicación (1ra pasada)
-        conn.execute(text("""
-            WITH ranked AS (
-              SELECT
-                ctid,
-                ROW_NUMBER() OVER (
-                  PARTITION BY provider_id, servicio, departamento, municipio
-                  ORDER BY provider_id
-                ) AS rn
-              FROM clean_staging
-            )
-            DELETE FROM clean_staging cs
-            USING ranked r
-            WHERE cs.ctid = r.ctid
-              AND r.rn > 1;
-        """))
+def _calidad_select(src: str, con_hash: bool = False, filtro: str = "") -> str:
+    """
+    SELECT normalizado de calidad desde stg_new (fecha, resultado y coordenadas ya
+    vienen tipados del extract, ver src/schema.py; aquí solo se descartan coordenadas
+    fuera de Colombia). Columnas: departamento, municipio, fecha_muestra, parametro,
+    valor, unidad, nombre_punto, latitud, longitud
+    (precedidas de row_hash si `con_hash`, que `src` debe traer). `filtro` se agrega al WHERE.
+    Departamento/municipio/parametro se normalizan vía norm_dict.
+    """
+    h = "row_hash," if con_hash else ""
+    filtro = f"\n              AND {filtro}" if filtro else ""
+    return f"""
+            SELECT {h}
+              dd.norm AS departamento,
+              dm.norm AS municipio,
+              fecha_d AS fecha_muestra,
+              dp.norm AS parametro,
+              valor_d AS valor,
+              NULLIF(BTRIM(unidad_t),'')       AS unidad,
+              NULLIF(BTRIM(nombre_punto_t),'') AS nombre_punto,
+              CASE WHEN latitud_d  BETWEEN -5  AND 15  THEN latitud_d  END AS latitud,
+              CASE WHEN longitud_d BETWEEN -82 AND -66 THEN longitud_d END AS longitud
+            FROM (
+              SELECT {h}
+                departamento::text                  AS departamento_t,
+                municipio::text                     AS municipio_t,
+                fecha::date                         AS fecha_d,
+                propiedad_observada::text           AS parametro_t,
+                resultado::double precision         AS valor_d,
+                unidad_del_resultado::text          AS unidad_t,
+                nombre_del_punto_de_monitoreo::text AS nombre_punto_t,
+                latitud::double precision           AS latitud_d,
+                longitud::double precision          AS longitud_d
+              FROM {src}
+            ) src
+            LEFT JOIN norm_dict dd ON dd.raw = src.departamento_t
+            LEFT JOIN norm_dict dm ON dm.raw = src.municipio_t
+            LEFT JOIN norm_dict dp ON dp.raw = src.parametro_t
+            WHERE
+              NULLIF(BTRIM(departamento_t),'') IS NOT NULL
+              AND NULLIF(BTRIM(municipio_t),'')  IS NOT NULL
+              AND fecha_d IS NOT NULL
+              AND NULLIF(BTRIM(parametro_t),'') IS NOT NULL{filtro}"""
+
+
+def _calidad_dedup_ctes(filtro: str = "") -> str:
+    """
+    CTEs x → r → d: normalización, reglas fila a fila, dominio/rango de fechas y
+    dedupe con ROW_NUMBER(). `d` queda con las filas únicas aún sin imputar.
+    """
+    return f"""x AS ({_calidad_select('stg_new', filtro=filtro)}
+        ),
+        r AS (
+          SELECT
+            departamento, municipio, fecha_muestra, parametro,
+            {_VALOR_REGLAS} AS valor,
+            unidad, nombre_punto,
+            {_LAT_PAREADA} AS latitud,
+            {_LON_PAREADA} AS longitud
+          FROM x
+          WHERE departamento IN ({DEP_SQL})
+            AND fecha_muestra BETWEEN DATE '2000-01-01' AND CURRENT_DATE
+        ),
+        d AS (
+          SELECT * FROM (
+            SELECT r.*,
+                   ROW_NUMBER() OVER (
+                     PARTITION BY departamento, municipio, parametro, fecha_muestra, COALESCE(nombre_punto,'')
+                     ORDER BY {_DEDUP_CAL_ORDEN}
+                   ) AS rn
+            FROM r
+          ) q
+          WHERE rn = 1
+        )"""
 
-        # Imputación estado (moda por servicio,departamento) → fallback 'OTRO'
+
+# =============================================================================
+# DDL compartido
+# =============================================================================
+
+def _create_clean_staging(conn, t: str = "clean_staging", unlogged: bool = False) -> None:
+    conn.execute(text(f"""
+        CREATE {"UNLOGGED " if unlogged else ""}TABLE IF NOT EXISTS {t}(
+            provider_id   TEXT NOT NULL,
+            nombre        TEXT NOT NULL,
+            departamento  TEXT NOT NULL,
+            municipio     TEXT NOT NULL,
+            servicio      TEXT NOT NULL,
+            estado        TEXT,
+            clasificacion TEXT
+        );
+    """))
+
+
+def _create_clean_calidad(conn, t: str = "clean_calidad", unlogged: bool = False,
+                          partitioned: bool = False) -> None:
+    particion = partitions.ddl("fecha_muestra") if partitioned else ""
+    conn.execute(text(f"""
+        CREATE {"UNLOGGED " if unlogged else ""}TABLE IF NOT EXISTS {t} (
+            departamento    TEXT NOT NULL,
+            municipio       TEXT NOT NULL,
+            fecha_muestra   DATE NOT NULL,
+            parametro       TEXT NOT NULL,
+            valor           DOUBLE PRECISION,
+            unidad          TEXT,
+            nombre_punto    TEXT,
+            latitud         DOUBLE PRECISION,
+            longitud        DOUBLE PRECISION
+        ){particion};
+    """))
+
+
+def _dedupe_clean_staging(conn, t: str = "clean_staging") -> None:
+    conn.execute(text(f"""
+        WITH ranked AS (
+          SELECT
+            ctid,
+            ROW_NUMBER() OVER (
+              PARTITION BY provider_id, servicio, departamento, municipio
+              ORDER BY provider_id
+            ) AS rn
+          FROM {t}
+        )
+        DELETE FROM {t} cs
+        USING ranked r
+        WHERE cs.ctid = r.ctid
+          AND r.rn > 1;
+    """))
+
+
+def _views_prestadores(conn) -> None:
+    conn.execute(text("""
+        CREATE OR REPLACE VIEW v_clean_preview AS
+        SELECT provider_id, nombre, departamento, municipio, clasificacion, servicio, estado
+        FROM clean_staging;
+    """))
+
+
+def _index_prestadores(conn, t: str = "clean_staging") -> None:
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{t}_pk   ON {t}(provider_id);"))
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{t}_key  ON {t}(provider_id, servicio, departamento, municipio);"))
+
+
+def _finish_prestadores(conn) -> None:
+    """Vista + índices de clean_staging."""
+    _views_prestadores(conn)
+    _index_prestadores(conn)
+
+
+def _index_calidad(conn, t: str = "clean_calidad") -> None:
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{t}_geo_fecha ON {t}(departamento, municipio, fecha_muestra);"))
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{t}_parametro ON {t}(parametro);"))
+    conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{t}_fecha ON {t}(fecha_muestra);"))
+
+
+def _views_calidad(conn) -> None:
+    conn.execute(text("""
+        CREATE OR REPLACE VIEW v_clean_calidad_preview AS
+        SELECT departamento, municipio, fecha_muestra, parametro, valor, unidad
+        FROM clean_calidad;
+    """))
+
+    # Compatibilidad: el agregado diario ahora es una tabla (ver _refresh_calidad_agg)
+    _create_calidad_agg(conn)
+    conn.execute(text("""
+        CREATE OR REPLACE VIEW v_clean_calidad_agg AS
+        SELECT departamento, municipio, fecha_muestra, parametro, valor_mediana, unidad_moda
+        FROM clean_calidad_agg;
+    """))
+
+
+def _finish_calidad(conn) -> None:
+    """Vistas + índices de clean_calidad."""
+    _index_calidad(conn)
+    _views_calidad(conn)
+
+
+# =============================================================================
+# Agregado diario de calidad: clean_calidad_agg
+# =============================================================================
+#
+# Una fila por (departamento, municipio, fecha_muestra, parametro) con la mediana del
+# valor y la unidad más frecuente, calculadas en una sola pasada agrupada
+# (percentile_disc + mode(); ante empate mode() devuelve la primera unidad en orden,
+# igual que el antiguo ORDER BY COUNT(*) DESC, unidad).
+# Solo se recalculan las fechas que el build tocó: el incremental devuelve las fechas de
+# los grupos que reconstruyó y la publicación por particiones los rangos que reemplazó
+# o borró. Los builds full sin particiones reescriben la tabla entera y no saben qué
+# cambió: se recalculan todas las fechas (sin huellas).
+# CALIDAD_AGG_FULL=1 calcula la huella (filas + suma de md5 por fila) de todas las fechas
+# de clean_calidad y recalcula las que difieren de clean_calidad_agg_state (sirve tras
+# tocar clean_calidad a mano); fuera de ese modo la huella queda en NULL. `refreshed_at`
+# marca cuándo se recalculó cada fecha.
+# clean_calidad_agg_log registra en cada refresh los municipios que tenían filas en las
+# fechas recalculadas antes o después del refresh (build_dim_calidad.sql los lee en modo
+# incremental; así también ve los municipios cuyas muestras de esas fechas se borraron).
+
+def _create_calidad_agg(conn) -> None:
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS clean_calidad_agg (
+            departamento    TEXT NOT NULL,
+            municipio       TEXT NOT NULL,
+            fecha_muestra   DATE NOT NULL,
+            parametro       TEXT NOT NULL,
+            valor_mediana   DOUBLE PRECISION,
+            unidad_moda     TEXT,
+            n_muestras      INTEGER NOT NULL,
+            PRIMARY KEY (fecha_muestra, departamento, municipio, parametro)
+        );
+    """))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_clean_calidad_agg_geo ON clean_calidad_agg(departamento, municipio, fecha_muestra);"
+    ))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS clean_calidad_agg_state (
+            fecha_muestra DATE PRIMARY KEY,
+            filas         BIGINT NOT NULL,
+            huella        NUMERIC,
+            refreshed_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """))
+    conn.execute(text(
+        "ALTER TABLE clean_calidad_agg_state ADD COLUMN IF NOT EXISTS refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now();"
+    ))
+    conn.execute(text("ALTER TABLE clean_calidad_agg_state ALTER COLUMN huella DROP NOT NULL;"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS clean_calidad_agg_log (
+            departamento  TEXT NOT NULL,
+            municipio     TEXT NOT NULL,
+            refreshed_at  TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """))
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_clean_calidad_agg_log_ts ON clean_calidad_agg_log(refreshed_at);"
+    ))
+
+
+def _refresh_calidad_agg(conn, rangos=None, full: bool = False) -> int:
+    """
+    Recalcula clean_calidad_agg para las fechas que cambiaron. Devuelve cuántas fechas.
+    `rangos` son los [(ini, fin)] de fecha_muestra que tocó el build (None = toda la tabla).
+    """
+    _create_calidad_agg(conn)
+    conn.execute(text("CREATE TEMP TABLE _agg_fechas(fecha_muestra DATE PRIMARY KEY) ON COMMIT DROP;"))
+
+    if full:
+        origen = "huellas"
         conn.execute(text("""
-            WITH moda AS (
-              SELECT servicio, departamento, estado,
-                     ROW_NUMBER() OVER (PARTITION BY servicio, departamento ORDER BY COUNT(*) DESC, estado) AS rn
-              FROM clean_staging
-              WHERE estado IS NOT NULL AND estado <> ''
-              GROUP BY servicio, departamento, estado
-            )
-            UPDATE clean_staging cs
-            SET estado = m.estado
-            FROM moda m
-            WHERE cs.estado IS NULL
-              AND cs.servicio = m.servicio
-              AND cs.departamento = m.departamento
-              AND m.rn = 1;
+            CREATE TEMP TABLE _agg_huellas ON COMMIT DROP AS
+            SELECT fecha_muestra,
+                   COUNT(*) AS filas,
+                   SUM(('x' || substr(md5(c::text), 1, 16))::bit(64)::bigint::numeric) AS huella
+            FROM clean_calidad c
+            GROUP BY fecha_muestra;
         """))
-        conn.execute(text("UPDATE clean_staging SET estado = 'OTRO' WHERE estado IS NULL OR estado = '';"))
-
-        # Imputación clasificacion (moda por servicio)
         conn.execute(text("""
-            WITH moda_c AS (
-              SELECT servicio, clasificacion,
-                     ROW_NUMBER() OVER (PARTITION BY servicio ORDER BY COUNT(*) DESC, clasificacion) AS rn
-              FROM clean_staging
-              WHERE clasificacion IS NOT NULL AND clasificacion <> ''
-              GROUP BY servicio, clasificacion
-            )
-            UPDATE clean_staging cs
-            SET clasificacion = m.clasificacion
-            FROM moda_c m
-            WHERE (cs.clasificacion IS NULL OR cs.clasificacion = '')
-              AND cs.servicio = m.servicio
-              AND m.rn = 1;
+            INSERT INTO _agg_fechas
+            SELECT fecha_muestra
+            FROM _agg_huellas h
+            FULL JOIN clean_calidad_agg_state s USING (fecha_muestra)
+            WHERE h.filas IS DISTINCT FROM s.filas OR h.huella IS DISTINCT FROM s.huella;
         """))
-
-        # Purgar filas con claves nulas/vacías (bloque clave)
+    elif rangos is None:
+        origen = "todas"
         conn.execute(text("""
-            DELETE FROM clean_staging
-            WHERE provider_id IS NULL OR provider_id = ''
-               OR nombre      IS NULL OR nombre      = ''
-               OR departamento IS NULL OR departamento = ''
-               OR municipio    IS NULL OR municipio    = ''
-               OR servicio     IS NULL OR servicio     = '';
+            INSERT INTO _agg_fechas
+            SELECT fecha_muestra FROM clean_calidad WHERE fecha_muestra IS NOT NULL
+            UNION
+            SELECT fecha_muestra FROM clean_calidad_agg_state;
         """))
-
-        # Re-deduplicar por seguridad (2da pasada)
+    else:
+        origen = "build"
+        # Días de los rangos tocados que existen antes (estado) o después (clean_calidad)
         conn.execute(text("""
-            WITH ranked AS (
-              SELECT
-                ctid,
-                ROW_NUMBER() OVER (
-                  PARTITION BY provider_id, servicio, departamento, municipio
-                  ORDER BY provider_id
-                ) AS rn
-              FROM clean_staging
-            )
-            DELETE FROM clean_staging cs
-            USING ranked r
-            WHERE cs.ctid = r.ctid
-              AND r.rn > 1;
+            INSERT INTO _agg_fechas
+            SELECT DISTINCT d::date
+            FROM unnest(CAST(:ini AS date[]), CAST(:fin AS date[])) r(ini, fin),
+                 generate_series(r.ini, r.fin - 1, interval '1 day') d;
+        """), {"ini": [r[0] for r in rangos], "fin": [r[1] for r in rangos]})
+        conn.execute(text("""
+            DELETE FROM _agg_fechas f
+            WHERE NOT EXISTS (SELECT 1 FROM clean_calidad c WHERE c.fecha_muestra = f.fecha_muestra)
+              AND NOT EXISTS (SELECT 1 FROM clean_calidad_agg_state s WHERE s.fecha_muestra = f.fecha_muestra);
         """))
+    conn.execute(text("ANALYZE _agg_fechas;"))
+
+    # municipios con filas en esas fechas antes del refresh (pueden no volver a aparecer)
+    conn.execute(text("""
+        CREATE TEMP TABLE _agg_munis ON COMMIT DROP AS
+        SELECT DISTINCT departamento, municipio
+        FROM clean_calidad_agg
+        WHERE fecha_muestra IN (SELECT fecha_muestra FROM _agg_fechas);
+    """))
+    conn.execute(text("""
+        DELETE FROM clean_calidad_agg a
+        USING _agg_fechas f
+        WHERE a.fecha_muestra = f.fecha_muestra;
+    """))
+    conn.execute(text("""
+        INSERT INTO clean_calidad_agg(
+            departamento, municipio, fecha_muestra, parametro, valor_mediana, unidad_moda, n_muestras
+        )
+        SELECT departamento, municipio, fecha_muestra, parametro,
+               percentile_disc(0.5) WITHIN GROUP (ORDER BY valor),
+               mode() WITHIN GROUP (ORDER BY NULLIF(unidad, '')),
+               COUNT(*)
+        FROM clean_calidad c
+        WHERE c.fecha_muestra IN (SELECT fecha_muestra FROM _agg_fechas)
+        GROUP BY 1, 2, 3, 4;
+    """))
+    conn.execute(text("""
+        INSERT INTO clean_calidad_agg_log(departamento, municipio)
+        SELECT departamento, municipio FROM _agg_munis
+        UNION
+        SELECT departamento, municipio
+        FROM clean_calidad_agg
+        WHERE fecha_muestra IN (SELECT fecha_muestra FROM _agg_fechas);
+    """))
 
-        # Vista + índices
+    conn.execute(text("""
+        DELETE FROM clean_calidad_agg_state s
+        USING _agg_fechas f
+        WHERE s.fecha_muestra = f.fecha_muestra;
+    """))
+    if full:
         conn.execute(text("""
-            CREATE OR REPLACE VIEW v_clean_preview AS
-            SELECT provider_id, nombre, departamento, municipio, clasificacion, servicio, estado
-            FROM clean_staging;
+            INSERT INTO clean_calidad_agg_state(fecha_muestra, filas, huella)
+            SELECT h.fecha_muestra, h.filas, h.huella
+            FROM _agg_huellas h JOIN _agg_fechas f USING (fecha_muestra);
         """))
-        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_clean_staging_pk   ON clean_staging(provider_id);"))
-        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_clean_staging_key  ON clean_staging(provider_id, servicio, departamento, municipio);"))
-
-        # =========================================================================
-        # B) CALIDAD DE AGUA: clean_calidad
-        # =========================================================================
+    else:
         conn.execute(text("""
-            CREATE TABLE IF NOT EXISTS clean_calidad (
-                departamento    TEXT NOT NULL,
-                municipio       TEXT NOT NULL,
-                fecha_muestra   DATE NOT NULL,
-                parametro       TEXT NOT NULL,
-                valor           DOUBLE PRECISION,
-                unidad          TEXT,
-                nombre_punto    TEXT,
-                latitud         DOUBLE PRECISION,
-                longitud        DOUBLE PRECISION
-            );
+            INSERT INTO clean_calidad_agg_state(fecha_muestra, filas)
+            SELECT fecha_muestra, SUM(n_muestras)
+            FROM clean_calidad_agg
+            WHERE fecha_muestra IN (SELECT fecha_muestra FROM _agg_fechas)
+            GROUP BY fecha_muestra;
         """))
-        conn.execute(text("DELETE FROM clean_calidad;"))
 
-        # Inserción desde stg_new con normalización y casting seguro
-        conn.execute(text(f"""
-            WITH src AS (
-              SELECT
-                departamento::text                  AS departamento_t,
-                municipio::text                     AS municipio_t,
-                fecha::text                         AS fecha_t,
-                propiedad_observada::text           AS parametro_t,
-                COALESCE(resultado::text,'')        AS resultado_t,
-                unidad_del_resultado::text          AS unidad_t,
-                nombre_del_punto_de_monitoreo::text AS nombre_punto_t,
-                latitud::text                       AS latitud_t,
-                longitud::text                      AS longitud_t
-              FROM stg_new
-            )
-            INSERT INTO clean_calidad(
-                departamento, municipio, fecha_muestra, parametro, valor, unidad,
-                nombre_punto, latitud, longitud
-            )
-            SELECT
-              UPPER(BTRIM(translate(departamento_t,'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))) AS departamento,
-              UPPER(BTRIM(translate(municipio_t,   'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))) AS municipio,
-              COALESCE(
-                CASE
-                  WHEN fecha_t ~ '^[0-9]{{4}}\\s+[A-Za-z]{{3}}\\s+[0-9]{{2}}\\s+[0-9]{{2}}:[0-9]{{2}}:[0-9]{{2}}\\s+(AM|PM)$'
-                    THEN to_timestamp(fecha_t, 'YYYY Mon DD HH12:MI:SS AM')::date
-                  ELSE NULL
-                END,
-                NULLIF(BTRIM(fecha_t),'')::date
-              ) AS fecha_muestra,
-              UPPER(BTRIM(translate(parametro_t,'ÁÉÍÓÚÄËÏÖÜáéíóúäëïöüÑñ','AEIOUAEIOUaeiouaeiouNn'))) AS parametro,
-              NULLIF(regexp_replace(resultado_t, '[^0-9\\.\\-]', '', 'g'),'')::double precision AS valor,
-              NULLIF(BTRIM(unidad_t),'')       AS unidad,
-              NULLIF(BTRIM(nombre_punto_t),'') AS nombre_punto,
-              CASE
-                WHEN NULLIF(BTRIM(latitud_t),'') IS NULL THEN NULL
-                ELSE
-                  CASE
-                    WHEN (NULLIF(BTRIM(latitud_t),'')::double precision) BETWEEN -5 AND 15
-                      THEN NULLIF(BTRIM(latitud_t),'')::double precision
-                    ELSE NULL
-                  END
-              END AS latitud,
-              CASE
-                WHEN NULLIF(BTRIM(longitud_t),'') IS NULL THEN NULL
-                ELSE
-                  CASE
-                    WHEN (NULLIF(BTRIM(longitud_t),'')::double precision) BETWEEN -82 AND -66
-                      THEN NULLIF(BTRIM(longitud_t),'')::double precision
-                    ELSE NULL
-                  END
-              END AS longitud
-            FROM src
-            WHERE
-              NULLIF(BTRIM(departamento_t),'') IS NOT NULL
-              AND NULLIF(BTRIM(municipio_t),'')  IS NOT NULL
-              AND (
-                (fecha_t ~ '^[0-9]{{4}}\\s+[A-Za-z]{{3}}\\s+[0-9]{{2}}\\s+[0-9]{{2}}:[0-9]{{2}}:[0-9]{{2}}\\s+(AM|PM)$')
-                OR (NULLIF(BTRIM(fecha_t),'') IS NOT NULL)
-              )
-              AND NULLIF(BTRIM(parametro_t),'') IS NOT NULL;
-        """))
+    n = conn.execute(text("SELECT COUNT(*) FROM _agg_fechas;")).scalar()
+    print(f"[transform] clean_calidad_agg → fechas recalculadas={n} ({origen})")
+    return n
 
-        # Dominio de depto + rango de fecha
-        conn.execute(text(f"DELETE FROM clean_calidad WHERE departamento NOT IN ({DEP_SQL});"))
-        conn.execute(text("DELETE FROM clean_calidad WHERE fecha_muestra < DATE '2000-01-01' OR fecha_muestra > CURRENT_DATE;"))
 
-        # Pareo de nulidad lat/lon
-        conn.execute(text("""
-            UPDATE clean_calidad
-            SET latitud = NULL, longitud = NULL
-            WHERE (latitud IS NULL) <> (longitud IS NULL);
-        """))
+# =============================================================================
+# Modo full: DELETE + reconstrucción completa
+# =============================================================================
 
-        # Reglas por parámetro: rangos razonables → fuera de rango = NULL (para imputar)
-        conn.execute(text("""
-            -- pH 0..14
-            UPDATE clean_calidad
-            SET valor = NULL
-            WHERE parametro = 'PH' AND (valor < 0 OR valor > 14);
-
-            -- Cloro libre/residual ~ 0..5
-            UPDATE clean_calidad
-            SET valor = NULL
-            WHERE parametro LIKE 'CLORO%' AND (valor < 0 OR valor > 5);
-
-            -- No negativos para parámetros frecuentes
-            UPDATE clean_calidad
-            SET valor = NULL
-            WHERE parametro IN ('TURBIDEZ','CONDUCTIVIDAD','DUREZA','ALCALINIDAD')
-              AND valor < 0;
-        """))
+def _build_prestadores_full(conn, t: str = "clean_staging") -> None:
+    conn.execute(text(f"DELETE FROM {t};"))
+
+    # stg_old → clean_staging
+    conn.execute(text(f"""
+        INSERT INTO {t}(provider_id,nombre,departamento,municipio,servicio,estado,clasificacion)
+        {_prestadores_select('stg_old', con_nit=True)};
+    """))
+
+    # stg_api → clean_staging
+    conn.execute(text(f"""
+        INSERT INTO {t}(provider_id,nombre,departamento,municipio,servicio,estado,clasificacion)
+        {_prestadores_select('stg_api', con_nit=False)};
+    """))
+
+    # Dominio de departamento
+    conn.execute(text(f"""
+        DELETE FROM {t}
+        WHERE departamento NOT IN ({DEP_SQL});
+    """))
+
+    # Deduplicación (1ra pasada)
+    _dedupe_clean_staging(conn, t)
+
+    # Imputación estado (moda por servicio,departamento) → fallback 'OTRO'
+    conn.execute(text(f"""
+        WITH moda AS (
+          SELECT servicio, departamento, estado,
+                 ROW_NUMBER() OVER (PARTITION BY servicio, departamento ORDER BY COUNT(*) DESC, estado) AS rn
+          FROM {t}
+          WHERE estado IS NOT NULL AND estado <> ''
+          GROUP BY servicio, departamento, estado
+        )
+        UPDATE {t} cs
+        SET estado = m.estado
+        FROM moda m
+        WHERE cs.estado IS NULL
+          AND cs.servicio = m.servicio
+          AND cs.departamento = m.departamento
+          AND m.rn = 1;
+    """))
+    conn.execute(text(f"UPDATE {t} SET estado = 'OTRO' WHERE estado IS NULL OR estado = '';"))
+
+    # Imputación clasificacion (moda por servicio)
+    conn.execute(text(f"""
+        WITH moda_c AS (
+          SELECT servicio, clasificacion,
+                 ROW_NUMBER() OVER (PARTITION BY servicio ORDER BY COUNT(*) DESC, clasificacion) AS rn
+          FROM {t}
+          WHERE clasificacion IS NOT NULL AND clasificacion <> ''
+          GROUP BY servicio, clasificacion
+        )
+        UPDATE {t} cs
+        SET clasificacion = m.clasificacion
+        FROM moda_c m
+        WHERE (cs.clasificacion IS NULL OR cs.clasificacion = '')
+          AND cs.servicio = m.servicio
+          AND m.rn = 1;
+    """))
+
+    # Purgar filas con claves nulas/vacías (bloque clave)
+    conn.execute(text(f"""
+        DELETE FROM {t}
+        WHERE provider_id IS NULL OR provider_id = ''
+           OR nombre      IS NULL OR nombre      = ''
+           OR departamento IS NULL OR departamento = ''
+           OR municipio    IS NULL OR municipio    = ''
+           OR servicio     IS NULL OR servicio     = '';
+    """))
 
-        # Deduplicación por (dep, muni, parametro, fecha, nombre_punto)
+    # Re-deduplicar por seguridad (2da pasada)
+    _dedupe_clean_staging(conn, t)
+
+
+def _build_calidad_full(conn, t: str = "clean_calidad") -> None:
+    conn.execute(text(f"DELETE FROM {t};"))
+
+    # Inserción desde stg_new con normalización y casting seguro
+    conn.execute(text(f"""
+        INSERT INTO {t}(
+            departamento, municipio, fecha_muestra, parametro, valor, unidad,
+            nombre_punto, latitud, longitud
+        )
+        {_calidad_select('stg_new')};
+    """))
+
+    # Dominio de depto + rango de fecha
+    conn.execute(text(f"DELETE FROM {t} WHERE departamento NOT IN ({DEP_SQL});"))
+    conn.execute(text(f"DELETE FROM {t} WHERE fecha_muestra < DATE '2000-01-01' OR fecha_muestra > CURRENT_DATE;"))
+
+    # Pareo de nulidad lat/lon
+    conn.execute(text(f"""
+        UPDATE {t}
+        SET latitud = NULL, longitud = NULL
+        WHERE (latitud IS NULL) <> (longitud IS NULL);
+    """))
+
+    # Reglas por parámetro: rangos razonables → fuera de rango = NULL (para imputar)
+    conn.execute(text(f"""
+        -- pH 0..14
+        UPDATE {t}
+        SET valor = NULL
+        WHERE parametro = 'PH' AND (valor < 0 OR valor > 14);
+
+        -- Cloro libre/residual ~ 0..5
+        UPDATE {t}
+        SET valor = NULL
+        WHERE parametro LIKE 'CLORO%' AND (valor < 0 OR valor > 5);
+
+        -- No negativos para parámetros frecuentes
+        UPDATE {t}
+        SET valor = NULL
+        WHERE parametro IN ('TURBIDEZ','CONDUCTIVIDAD','DUREZA','ALCALINIDAD')
+          AND valor < 0;
+    """))
+
+    # Deduplicación por (dep, muni, parametro, fecha, nombre_punto)
+    conn.execute(text(f"""
+        WITH ranked AS (
+          SELECT
+            ctid,
+            ROW_NUMBER() OVER (
+              PARTITION BY departamento, municipio, parametro, fecha_muestra, COALESCE(nombre_punto,'')
+              ORDER BY {_DEDUP_CAL_ORDEN}
+            ) AS rn
+          FROM {t}
+        )
+        DELETE FROM {t} c
+        USING ranked r
+        WHERE c.ctid = r.ctid
+          AND r.rn > 1;
+    """))
+
+    # Imputación: UNIDAD = moda por parametro
+    # (CTEs MATERIALIZED como en el build fusionado: recién insertada la tabla no tiene
+    # estadísticas, el planner estima 1 fila con NULL y con el CTE inline recalcula el
+    # agregado en cada vuelta del nested loop)
+    conn.execute(text(f"""
+        WITH moda_u AS MATERIALIZED (
+          SELECT parametro, unidad,
+                 ROW_NUMBER() OVER (PARTITION BY parametro ORDER BY COUNT(*) DESC, unidad) AS rn
+          FROM {t}
+          WHERE unidad IS NOT NULL AND unidad <> ''
+          GROUP BY parametro, unidad
+        )
+        UPDATE {t} c
+        SET unidad = m.unidad
+        FROM moda_u m
+        WHERE (c.unidad IS NULL OR c.unidad = '')
+          AND c.parametro = m.parametro
+          AND m.rn = 1;
+    """))
+
+    # Imputación: VALOR = mediana por (parametro, departamento) → fallback mediana global por parametro
+    conn.execute(text(f"""
+        WITH med AS MATERIALIZED (
+          SELECT parametro, departamento,
+                 percentile_disc(0.5) WITHIN GROUP (ORDER BY valor) AS mediana
+          FROM {t}
+          WHERE valor IS NOT NULL
+          GROUP BY parametro, departamento
+        )
+        UPDATE {t} c
+        SET valor = m.mediana
+        FROM med m
+        WHERE c.valor IS NULL
+          AND c.parametro = m.parametro
+          AND c.departamento = m.departamento;
+    """))
+    conn.execute(text(f"""
+        WITH med_global AS MATERIALIZED (
+          SELECT parametro,
+                 percentile_disc(0.5) WITHIN GROUP (ORDER BY valor) AS mediana_g
+          FROM {t}
+          WHERE valor IS NOT NULL
+          GROUP BY parametro
+        )
+        UPDATE {t} c
+        SET valor = mg.mediana_g
+        FROM med_global mg
+        WHERE c.valor IS NULL
+          AND c.parametro = mg.parametro;
+    """))
+
+
+def _build_calidad_fused(conn, t: str = "clean_calidad") -> None:
+    """
+    Igual resultado que _build_calidad_full pero en un solo INSERT ... SELECT:
+    reglas fila a fila en el SELECT, dedupe con ROW_NUMBER() y las imputaciones
+    (moda de unidad, mediana por parametro/departamento y global) como agregados
+    sobre las filas ya deduplicadas. Sin UPDATE/DELETE → sin tuplas muertas.
+    Los agregados van MATERIALIZED: si el planner los pone del lado interno de un
+    nested loop, sin eso recalcula el percentil por cada fila de `d`.
+    """
+    conn.execute(text(f"DELETE FROM {t};"))
+    conn.execute(text(f"""
+        WITH {_calidad_dedup_ctes()},
+        moda_u AS MATERIALIZED (
+          SELECT parametro, unidad,
+                 ROW_NUMBER() OVER (PARTITION BY parametro ORDER BY COUNT(*) DESC, unidad) AS rn
+          FROM d
+          WHERE unidad IS NOT NULL AND unidad <> ''
+          GROUP BY parametro, unidad
+        ),
+        med AS MATERIALIZED (
+          SELECT parametro, departamento,
+                 percentile_disc(0.5) WITHIN GROUP (ORDER BY valor) AS mediana
+          FROM d
+          WHERE valor IS NOT NULL
+          GROUP BY parametro, departamento
+        ),
+        med_global AS MATERIALIZED (
+          SELECT parametro,
+                 percentile_disc(0.5) WITHIN GROUP (ORDER BY valor) AS mediana_g
+          FROM d
+          WHERE valor IS NOT NULL
+          GROUP BY parametro
+        )
+        INSERT INTO {t}(
+            departamento, municipio, fecha_muestra, parametro, valor, unidad,
+            nombre_punto, latitud, longitud
+        )
+        SELECT d.departamento, d.municipio, d.fecha_muestra, d.parametro,
+               COALESCE(d.valor, m.mediana, mg.mediana_g),
+               COALESCE(NULLIF(d.unidad,''), u.unidad),
+               d.nombre_punto, d.latitud, d.longitud
+        FROM d
+        LEFT JOIN moda_u u     ON u.parametro = d.parametro AND u.rn = 1
+        LEFT JOIN med m        ON m.parametro = d.parametro AND m.departamento = d.departamento
+        LEFT JOIN med_global mg ON mg.parametro = d.parametro;
+    """))
+
+
+# =============================================================================
+# Modo incremental: solo filas de staging nuevas/cambiadas/borradas
+# =============================================================================
+#
+# Solo calidad. Cada fila de stg_new se identifica por row_hash = md5(fila completa);
+# norm_calidad guarda la versión normalizada (antes de dedupe e imputación) de cada
+# row_hash. En cada corrida:
+#   1) se borran de norm_calidad los hashes que ya no están en staging,
+#   2) se normalizan e insertan solo los hashes nuevos,
+#   3) los grupos tocados (parametro,departamento) se reconstruyen en clean_calidad
+#      con dedupe + imputación calculadas solo sobre ellos.
+# Las estadísticas de nivel superior (unidad moda y mediana global por parametro) se
+# guardan en clean_calidad_stats; si cambian, todos los grupos de ese parametro se
+# consideran tocados y el resultado equivale al del modo full (el dedupe desempata
+# igual que los demás builds, con _DEDUP_CAL_ORDEN).
+#
+# Prestadores no tiene modo incremental: en el DAG merge_pipeline.sql trunca y
+# reconstruye clean_staging después de transform_prestadores, así que el estado
+# incremental (qué filas de clean_staging salieron de qué row_hash) no sobreviviría.
+
+def _build_calidad_incremental(conn):
+    """
+    Reconstruye solo los grupos (parametro, departamento) tocados. Devuelve los rangos
+    [(ini, fin)] de fecha_muestra que cambiaron (None en el bootstrap: toda la tabla).
+    """
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS norm_calidad(
+            row_hash        TEXT PRIMARY KEY,
+            departamento    TEXT,
+            municipio       TEXT,
+            fecha_muestra   DATE,
+            parametro       TEXT,
+            valor           DOUBLE PRECISION,
+            unidad          TEXT,
+            nombre_punto    TEXT,
+            latitud         DOUBLE PRECISION,
+            longitud        DOUBLE PRECISION,
+            valido          BOOLEAN NOT NULL
+        );
+    """))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS idx_norm_calidad_grp ON norm_calidad(parametro, departamento);"))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS clean_calidad_stats(
+            parametro   TEXT PRIMARY KEY,
+            unidad_moda TEXT,
+            mediana_g   DOUBLE PRECISION
+        );
+    """))
+    bootstrap = conn.execute(text("SELECT NOT EXISTS (SELECT 1 FROM norm_calidad);")).scalar()
+
+    conn.execute(text("""
+        CREATE TEMP TABLE _stg_hash_cal ON COMMIT DROP AS
+        SELECT DISTINCT md5(s::text) AS row_hash FROM stg_new s;
+    """))
+    conn.execute(text("CREATE TEMP TABLE _touched_cal(parametro TEXT, departamento TEXT) ON COMMIT DROP;"))
+
+    # 1) filas borradas/cambiadas
+    conn.execute(text("""
+        WITH d AS (
+          DELETE FROM norm_calidad n
+          WHERE NOT EXISTS (SELECT 1 FROM _stg_hash_cal h WHERE h.row_hash = n.row_hash)
+          RETURNING parametro, departamento
+        )
+        INSERT INTO _touched_cal SELECT DISTINCT parametro, departamento FROM d;
+    """))
+
+    # 2) filas nuevas: normalización + reglas fila a fila (dominio, fechas, pareo, rangos)
+    nuevas = """(SELECT md5(s::text) AS row_hash, s.* FROM stg_new s) s
+                WHERE NOT EXISTS (SELECT 1 FROM norm_calidad n WHERE n.row_hash = s.row_hash)"""
+    conn.execute(text(f"""
+        WITH x AS ({_calidad_select(nuevas, con_hash=True)}
+        ),
+        ins AS (
+          INSERT INTO norm_calidad(
+              row_hash, departamento, municipio, fecha_muestra, parametro, valor, unidad,
+              nombre_punto, latitud, longitud, valido
+          )
+          SELECT
+            row_hash, departamento, municipio, fecha_muestra, parametro,
+            {_VALOR_REGLAS},
+            unidad, nombre_punto,
+            {_LAT_PAREADA},
+            {_LON_PAREADA},
+            (departamento IN ({DEP_SQL})
+             AND fecha_muestra BETWEEN DATE '2000-01-01' AND CURRENT_DATE)
+          FROM x
+          ON CONFLICT (row_hash) DO NOTHING
+          RETURNING parametro, departamento
+        )
+        INSERT INTO _touched_cal SELECT DISTINCT parametro, departamento FROM ins;
+    """))
+
+    # 3) dedupe de los parámetros tocados + estadísticas por parámetro
+    conn.execute(text(f"""
+        CREATE TEMP TABLE _dedup_cal ON COMMIT DROP AS
+        SELECT DISTINCT ON (departamento, municipio, parametro, fecha_muestra, COALESCE(nombre_punto,'')) n.*
+        FROM norm_calidad n
+        WHERE n.valido AND n.parametro IN (SELECT parametro FROM _touched_cal)
+        ORDER BY departamento, municipio, parametro, fecha_muestra, COALESCE(nombre_punto,''), {_DEDUP_CAL_ORDEN};
+    """))
+    conn.execute(text("""
+        WITH moda_u AS (
+          SELECT DISTINCT ON (parametro) parametro, unidad
+          FROM (SELECT parametro, unidad, COUNT(*) c
+                FROM _dedup_cal
+                WHERE unidad IS NOT NULL AND unidad <> ''
+                GROUP BY 1,2) t
+          ORDER BY parametro, c DESC, unidad
+        ),
+        med_global AS (
+          SELECT parametro, percentile_disc(0.5) WITHIN GROUP (ORDER BY valor) AS mediana_g
+          FROM _dedup_cal
+          WHERE valor IS NOT NULL
+          GROUP BY parametro
+        ),
+        nuevas AS (
+          SELECT p.parametro, u.unidad AS unidad_moda, g.mediana_g
+          FROM (SELECT DISTINCT parametro FROM _touched_cal) p
+          LEFT JOIN moda_u u USING (parametro)
+          LEFT JOIN med_global g USING (parametro)
+        ),
+        cambiadas AS (
+          INSERT INTO clean_calidad_stats AS st (parametro, unidad_moda, mediana_g)
+          SELECT parametro, unidad_moda, mediana_g FROM nuevas
+          ON CONFLICT (parametro) DO UPDATE SET
+            unidad_moda = EXCLUDED.unidad_moda,
+            mediana_g   = EXCLUDED.mediana_g
+          WHERE st.unidad_moda IS DISTINCT FROM EXCLUDED.unidad_moda
+             OR st.mediana_g   IS DISTINCT FROM EXCLUDED.mediana_g
+          RETURNING st.parametro
+        )
+        INSERT INTO _touched_cal
+        SELECT DISTINCT d.parametro, d.departamento
+        FROM _dedup_cal d JOIN cambiadas c USING (parametro);
+    """))
+
+    # 4) reconstruir solo los grupos (parametro, departamento) tocados
+    if partitions.is_partitioned(conn, "clean_calidad"):
+        partitions.ensure(conn, "clean_calidad", "SELECT fecha_muestra FROM _dedup_cal")
+    # fechas de las filas borradas y reinsertadas (clean_calidad_agg solo recalcula esas)
+    conn.execute(text("CREATE TEMP TABLE _fechas_cal(fecha_muestra DATE) ON COMMIT DROP;"))
+    if bootstrap:
+        conn.execute(text("DELETE FROM clean_calidad;"))
+    else:
         conn.execute(text("""
-            WITH ranked AS (
-              SELECT
-                ctid,
-                ROW_NUMBER() OVER (
-                  PARTITION BY departamento, municipio, parametro, fecha_muestra, COALESCE(nombre_punto,'')
-                  ORDER BY departamento
-                ) AS rn
-              FROM clean_calidad
+            WITH d AS (
+              DELETE FROM clean_calidad c
+              USING (SELECT DISTINCT parametro, departamento FROM _touched_cal) t
+              WHERE c.parametro = t.parametro AND c.departamento = t.departamento
+              RETURNING c.fecha_muestra
             )
-            DELETE FROM clean_calidad c
-            USING ranked r
-            WHERE c.ctid = r.ctid
-              AND r.rn > 1;
+            INSERT INTO _fechas_cal SELECT DISTINCT fecha_muestra FROM d;
         """))
+    conn.execute(text("""
+        WITH grupos AS (SELECT DISTINCT parametro, departamento FROM _touched_cal),
+        d AS (
+          SELECT x.* FROM _dedup_cal x JOIN grupos g USING (parametro, departamento)
+        ),
+        med AS (
+          SELECT parametro, departamento,
+                 percentile_disc(0.5) WITHIN GROUP (ORDER BY valor) AS mediana
+          FROM d
+          WHERE valor IS NOT NULL
+          GROUP BY parametro, departamento
+        ),
+        ins AS (
+          INSERT INTO clean_calidad(
+              departamento, municipio, fecha_muestra, parametro, valor, unidad,
+              nombre_punto, latitud, longitud
+          )
+          SELECT d.departamento, d.municipio, d.fecha_muestra, d.parametro,
+                 COALESCE(d.valor, m.mediana, st.mediana_g),
+                 COALESCE(NULLIF(d.unidad,''), st.unidad_moda),
+                 d.nombre_punto, d.latitud, d.longitud
+          FROM d
+          LEFT JOIN med m USING (parametro, departamento)
+          LEFT JOIN clean_calidad_stats st USING (parametro)
+          RETURNING fecha_muestra
+        )
+        INSERT INTO _fechas_cal SELECT DISTINCT fecha_muestra FROM ins;
+    """))
+    n = conn.execute(text("SELECT COUNT(*) FROM (SELECT DISTINCT parametro, departamento FROM _touched_cal) t;")).scalar()
+    print(f"[transform] incremental clean_calidad → grupos (parametro,departamento) recalculados={n}")
+    if bootstrap:
+        return None
+    fechas = conn.execute(text("SELECT DISTINCT fecha_muestra FROM _fechas_cal WHERE fecha_muestra IS NOT NULL;")).scalars()
+    return [(f, f + timedelta(days=1)) for f in fechas]
 
-        # Imputación: UNIDAD = moda por parametro
-        conn.execute(text("""
-            WITH moda_u AS (
-              SELECT parametro, unidad,
-                     ROW_NUMBER() OVER (PARTITION BY parametro ORDER BY COUNT(*) DESC, unidad) AS rn
-              FROM clean_calidad
-              WHERE unidad IS NOT NULL AND unidad <> ''
-              GROUP BY parametro, unidad
+
+# =============================================================================
+# Publicación por swap: sombra UNLOGGED → índices → ANALYZE → rename
+# =============================================================================
+
+_SHADOW = "_new"
+
+_IDX_PRESTADORES = ("pk", "key")
+_IDX_CALIDAD = ("geo_fecha", "parametro", "fecha")
+
+
+def _swap_in(conn, t: str, indices) -> None:
+    """Reemplaza `t` por `t_new` (drop + rename de tabla e índices) dentro de la transacción actual."""
+    shadow = t + _SHADOW
+    if PUBLISH_SET_LOGGED:
+        conn.execute(text(f"ALTER TABLE {shadow} SET LOGGED;"))
+    conn.execute(text(f"DROP TABLE IF EXISTS {t};"))
+    conn.execute(text(f"ALTER TABLE {shadow} RENAME TO {t};"))
+    for suf in indices:
+        conn.execute(text(f"ALTER INDEX IF EXISTS idx_{shadow}_{suf} RENAME TO idx_{t}_{suf};"))
+
+
+def _drop_views_prestadores(conn) -> None:
+    conn.execute(text("DROP VIEW IF EXISTS v_clean_preview;"))
+
+
+def _drop_views_calidad(conn) -> None:
+    conn.execute(text("DROP VIEW IF EXISTS v_clean_calidad_preview;"))
+    conn.execute(text("DROP VIEW IF EXISTS v_clean_calidad_agg;"))
+
+
+def _publish_prestadores(eng) -> None:
+    """Swap (transacción corta): vista fuera, rename, vista de nuevo."""
+    with eng.begin() as conn:
+        conn.execute(text(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}';"))
+        _drop_views_prestadores(conn)
+        _swap_in(conn, "clean_staging", _IDX_PRESTADORES)
+        _views_prestadores(conn)
+
+
+def _publish_calidad(eng) -> None:
+    with eng.begin() as conn:
+        conn.execute(text(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}';"))
+        _drop_views_calidad(conn)
+        _swap_in(conn, "clean_calidad", _IDX_CALIDAD)
+        _views_calidad(conn)
+
+
+def _swap_prestadores(eng) -> None:
+    # Construcción en sombra (transacción larga, sin locks sobre clean_staging)
+    st = "clean_staging" + _SHADOW
+    with instrument.step("prestadores.build"), eng.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {st};"))
+        _create_clean_staging(conn, st, unlogged=True)
+        _build_prestadores_full(conn, st)
+        _index_prestadores(conn, st)
+        conn.execute(text(f"ANALYZE {st};"))
+    with instrument.step("prestadores.publish"):
+        _publish_prestadores(eng)
+
+
+def _index_shadow_calidad(conn, cc: str) -> None:
+    # Con particiones los índices se crean por partición al publicar
+    if not partitions.enabled():
+        _index_calidad(conn, cc)
+        conn.execute(text(f"ANALYZE {cc};"))
+
+
+def _shadow_calidad(eng, build_calidad) -> None:
+    cc = "clean_calidad" + _SHADOW
+    with instrument.step("calidad.build"), eng.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {cc};"))
+        _create_clean_calidad(conn, cc, unlogged=True)
+        build_calidad(conn, cc)
+        _index_shadow_calidad(conn, cc)
+
+
+def _publish_calidad_partitions(eng):
+    """
+    Publica clean_calidad_new en el padre particionado por fecha_muestra: solo los
+    rangos que cambiaron se arman aparte y se intercambian con DETACH/ATTACH.
+    La primera vez reemplaza la tabla sin particionar por el padre particionado.
+    Devuelve los rangos [(ini, fin)] intercambiados (None la primera vez).
+    """
+    cc = "clean_calidad" + _SHADOW
+    with instrument.step("calidad.partitions.prepare"), eng.begin() as conn:
+        plan = partitions.preparar(conn, "clean_calidad", "fecha_muestra", cc, _index_calidad)
+
+    with eng.begin() as conn:
+        conn.execute(text(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}';"))
+        if not partitions.is_partitioned(conn, "clean_calidad"):
+            _drop_views_calidad(conn)
+            conn.execute(text("DROP TABLE IF EXISTS clean_calidad;"))
+            _create_clean_calidad(conn, partitioned=True)
+            _index_calidad(conn)
+        partitions.intercambiar(conn, "clean_calidad", plan, _IDX_CALIDAD)
+        _views_calidad(conn)
+        conn.execute(text(f"DROP TABLE IF EXISTS {cc};"))
+
+    # autovacuum no analiza el padre particionado
+    with eng.begin() as conn:
+        conn.execute(text("ANALYZE clean_calidad;"))
+    return plan["rangos"]
+
+
+# =============================================================================
+# Calidad particionada por departamento (CALIDAD_WORKERS > 1)
+# =============================================================================
+#
+# El dedupe y la mediana de imputación se agrupan por departamento (entre otras
+# columnas), así que cada departamento se procesa sin mirar a los demás. Las filas
+# se reparten en CALIDAD_WORKERS cubetas por hash del departamento normalizado y
+# cada cubeta corre en su propia conexión del pool (un backend por cubeta):
+#   1) normalización + reglas + dedupe → clean_calidad_new_part (en paralelo)
+#   2) estadísticas por parametro (moda de unidad, mediana global) (una conexión)
+#   3) imputación e INSERT en clean_calidad_new (en paralelo)
+# Cada cubeta comitea por separado, por eso siempre se publica con swap.
+
+def _bucket(expr: str, n: int, k: int) -> str:
+    return f"mod(abs(hashtext({expr})::bigint), {n}) = {k}"
+
+
+def _calidad_bucket_dedup(eng, part: str, n: int, k: int) -> None:
+    with instrument.step(f"calidad.dedup[{k}]"), eng.begin() as conn:
+        conn.execute(text(f"""
+            WITH {_calidad_dedup_ctes(_bucket('dd.norm', n, k))}
+            INSERT INTO {part}(
+                departamento, municipio, fecha_muestra, parametro, valor, unidad,
+                nombre_punto, latitud, longitud
             )
-            UPDATE clean_calidad c
-            SET unidad = m.unidad
-            FROM moda_u m
-            WHERE (c.unidad IS NULL OR c.unidad = '')
-              AND c.parametro = m.parametro
-              AND m.rn = 1;
+            SELECT departamento, municipio, fecha_muestra, parametro, valor, unidad,
+                   nombre_punto, latitud, longitud
+            FROM d;
         """))
 
-        # Imputación: VALOR = mediana por (parametro, departamento) → fallback mediana global por parametro
-        conn.execute(text("""
-            WITH med AS (
+
+def _calidad_bucket_impute(eng, part: str, stats: str, t: str, n: int, k: int) -> None:
+    with instrument.step(f"calidad.impute[{k}]"), eng.begin() as conn:
+        conn.execute(text(f"""
+            WITH d AS (
+              SELECT * FROM {part} WHERE {_bucket('departamento', n, k)}
+            ),
+            med AS (
               SELECT parametro, departamento,
                      percentile_disc(0.5) WITHIN GROUP (ORDER BY valor) AS mediana
-              FROM clean_calidad
+              FROM d
               WHERE valor IS NOT NULL
               GROUP BY parametro, departamento
             )
-            UPDATE clean_calidad c
-            SET valor = m.mediana
-            FROM med m
-            WHERE c.valor IS NULL
-              AND c.parametro = m.parametro
-              AND c.departamento = m.departamento;
+            INSERT INTO {t}(
+                departamento, municipio, fecha_muestra, parametro, valor, unidad,
+                nombre_punto, latitud, longitud
+            )
+            SELECT d.departamento, d.municipio, d.fecha_muestra, d.parametro,
+                   COALESCE(d.valor, m.mediana, st.mediana_g),
+                   COALESCE(NULLIF(d.unidad,''), st.unidad_moda),
+                   d.nombre_punto, d.latitud, d.longitud
+            FROM d
+            LEFT JOIN med m    USING (parametro, departamento)
+            LEFT JOIN {stats} st USING (parametro);
         """))
-        conn.execute(text("""
-            WITH med_global AS (
-              SELECT parametro,
-                     percentile_disc(0.5) WITHIN GROUP (ORDER BY valor) AS mediana_g
-              FROM clean_calidad
+
+
+def _build_calidad_partitioned(eng, n: int) -> None:
+    """Mismo resultado que _build_calidad_fused, repartido en `n` conexiones concurrentes."""
+    cc = "clean_calidad" + _SHADOW
+    part, stats = cc + "_part", cc + "_stats"
+
+    with eng.begin() as conn:
+        for tb in (cc, part, stats):
+            conn.execute(text(f"DROP TABLE IF EXISTS {tb};"))
+        _create_clean_calidad(conn, cc, unlogged=True)
+        _create_clean_calidad(conn, part, unlogged=True)
+
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        list(pool.map(lambda k: _calidad_bucket_dedup(eng, part, n, k), range(n)))
+
+    with instrument.step("calidad.stats"), eng.begin() as conn:
+        conn.execute(text(f"""
+            CREATE UNLOGGED TABLE {stats} AS
+            WITH moda_u AS (
+              SELECT DISTINCT ON (parametro) parametro, unidad
+              FROM (SELECT parametro, unidad, COUNT(*) c
+                    FROM {part}
+                    WHERE unidad IS NOT NULL AND unidad <> ''
+                    GROUP BY 1,2) t
+              ORDER BY parametro, c DESC, unidad
+            ),
+            med_global AS (
+              SELECT parametro, percentile_disc(0.5) WITHIN GROUP (ORDER BY valor) AS mediana_g
+              FROM {part}
               WHERE valor IS NOT NULL
               GROUP BY parametro
             )
-            UPDATE clean_calidad c
-            SET valor = mg.mediana_g
-            FROM med_global mg
-            WHERE c.valor IS NULL
-              AND c.parametro = mg.parametro;
+            SELECT p.parametro, u.unidad AS unidad_moda, g.mediana_g
+            FROM (SELECT DISTINCT parametro FROM {part}) p
+            LEFT JOIN moda_u u USING (parametro)
+            LEFT JOIN med_global g USING (parametro);
         """))
 
-        # Vista e índices (preview)
-        conn.execute(text("""
-            CREATE OR REPLACE VIEW v_clean_calidad_preview AS
-            SELECT departamento, municipio, fecha_muestra, parametro, valor, unidad
-            FROM clean_calidad;
-        """))
-        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_clean_calidad_geo_fecha ON clean_calidad(departamento, municipio, fecha_muestra);"))
-        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_clean_calidad_parametro ON clean_calidad(parametro);"))
+    with ThreadPoolExecutor(max_workers=n) as pool:
+        list(pool.map(lambda k: _calidad_bucket_impute(eng, part, stats, cc, n, k), range(n)))
 
-        # (OPCIONAL) Vista agregada si luego decides fact a nivel municipio/día/parámetro:
-        conn.execute(text("""
-            CREATE OR REPLACE VIEW v_clean_calidad_agg AS
-            SELECT
-              departamento,
-              municipio,
-              fecha_muestra,
-              parametro,
-              percentile_disc(0.5) WITHIN GROUP (ORDER BY valor) AS valor_mediana,
-              (ARRAY(
-                 SELECT u FROM (
-                   SELECT unidad AS u, COUNT(*) c
-                   FROM clean_calidad c2
-                   WHERE c2.departamento = c.departamento
-                     AND c2.municipio    = c.municipio
-                     AND c2.fecha_muestra= c.fecha_muestra
-                     AND c2.parametro    = c.parametro
-                     AND c2.unidad IS NOT NULL AND c2.unidad <> ''
-                   GROUP BY unidad
-                   ORDER BY COUNT(*) DESC, unidad
-                   LIMIT 1
-                 ) x
-              ))[1] AS unidad_moda
-            FROM clean_calidad c
-            GROUP BY 1,2,3,4;
-        """))
+    with eng.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {part};"))
+        conn.execute(text(f"DROP TABLE IF EXISTS {stats};"))
+        _index_shadow_calidad(conn, cc)
+
+
+# =============================================================================
+# Unidades ejecutables (el DAG corre prestadores y calidad en paralelo)
+# =============================================================================
+
+def _refresh_dict(eng, tables) -> None:
+    # Transacción propia y corta: así dos unidades concurrentes no quedan
+    # esperándose en el índice único de norm_dict hasta el commit de la otra.
+    with instrument.step("norm_dict"), eng.begin() as conn:
+        _refresh_norm_dict(conn, tables)
+
+
+def _count(eng, t: str) -> int:
+    with eng.connect() as conn:
+        return conn.execute(text(f"SELECT COUNT(*) FROM {t};")).scalar() or 0
+
+
+def run_prestadores() -> dict:
+    """
+    A) clean_staging (prestadores/servicios) ← stg_old + stg_api
+       - Normalización (UPPER/TRIM/sin tildes)
+       - provider_id = NIT o md5(nombre|dep|muni|servicio)
+       - Catálogos: servicio/estado
+       - Dominio: departamento
+       - Deduplicación por (provider_id,servicio,departamento,municipio)
+       - Imputación: estado (moda por servicio,departamento) / clasificacion (moda por servicio)
+       - Purgado final de claves nulas/vacías y re-dedupe
+       - geo_id en dim_geo para los (departamento, municipio) nuevos (src/geo.py)
+
+    Siempre en modo full (TRANSFORM_MODE=incremental solo aplica a calidad): en el DAG
+    merge_pipeline.sql reconstruye clean_staging a continuación.
+
+    Devuelve el resumen de instrumentación (tiempos/filas por paso) para XCom.
+    """
+    eng = get_engine()
+    with instrument.run("transform_prestadores") as r:
+        _refresh_dict(eng, _PRESTADORES_STG)
+
+        if PUBLISH_MODE == "swap":
+            _swap_prestadores(eng)
+        else:
+            with eng.begin() as conn:
+                with instrument.step("prestadores.build"):
+                    _drop_views_prestadores(conn)
+                    _create_clean_staging(conn)
+                    _build_prestadores_full(conn)
+                with instrument.step("prestadores.finish"):
+                    _finish_prestadores(conn)
+
+        # geo_id para los municipios nuevos (dimensiones y load joinean por entero)
+        with instrument.step("geo"), eng.begin() as conn:
+            geo.sync(conn, "SELECT departamento, municipio FROM clean_staging")
 
-        # =========================================================================
-        # Log final
-        # =========================================================================
-        n1 = conn.execute(text("SELECT COUNT(*) FROM clean_staging;")).scalar() or 0
-        n2 = conn.execute(text("SELECT COUNT(*) FROM clean_calidad;")).scalar() or 0
-        print(f"[transform] OK → clean_staging={{n1}} rows | clean_calidad={{n2}} rows")
\ No newline at end of file
+        with instrument.step("count"):
+            n = _count(eng, "clean_staging")
+    print(f"[transform] OK → clean_staging={n} rows")
+    return {"clean_staging": n, **r.summary()}
+
+
+def run_calidad() -> dict:
+    """
+    B) clean_calidad (calidad de agua) ← stg_new
+       - Parseo de fecha
+       - Limpieza numérica de valor (DOUBLE PRECISION)
+       - Coordenadas válidas para Colombia (lat/lon) + pareo de nulidad
+       - Dominio de departamento y rango de fechas
+       - Reglas por parámetro (pH, CLORO, no-negativos)
+       - Deduplicación por (dep,muni,parametro,fecha[,nombre_punto])
+       - Imputación: unidad (moda por parametro) / valor (mediana por parametro,departamento → fallback mediana global)
+       - Agregado diario clean_calidad_agg (mediana + unidad moda), solo fechas que tocó el build
+       - geo_id en dim_geo para los (departamento, municipio) nuevos (src/geo.py)
+
+    Con CALIDAD_WORKERS > 1 (modo full) se construye por cubetas de departamento en
+    varias conexiones a la vez y se publica con swap. Con CALIDAD_PARTITIONS (modo
+    full) se publica por particiones de fecha_muestra en vez de reemplazar la tabla.
+
+    Devuelve el resumen de instrumentación (tiempos/filas por paso) para XCom.
+    """
+    incremental = TRANSFORM_MODE == "incremental"
+    eng = get_engine()
+    with instrument.run("transform_calidad") as r:
+        _refresh_dict(eng, _CALIDAD_STG)
+
+        # rangos de fecha_muestra que cambiaron (None = toda la tabla)
+        rangos = None
+        sombra = CALIDAD_WORKERS > 1 or PUBLISH_MODE == "swap" or partitions.enabled()
+        if sombra and not incremental:
+            if CALIDAD_WORKERS > 1:
+                _build_calidad_partitioned(eng, CALIDAD_WORKERS)
+            else:
+                _shadow_calidad(eng, _build_calidad_fused if CALIDAD_BUILD == "fused" else _build_calidad_full)
+            with instrument.step("calidad.publish"):
+                if partitions.enabled():
+                    rangos = _publish_calidad_partitions(eng)
+                else:
+                    _publish_calidad(eng)
+        else:
+            with eng.begin() as conn:
+                with instrument.step("calidad.build"):
+                    _drop_views_calidad(conn)
+                    _create_clean_calidad(conn, partitioned=partitions.enabled())
+                    if incremental:
+                        rangos = _build_calidad_incremental(conn)
+                    elif CALIDAD_BUILD == "fused":
+                        _build_calidad_fused(conn)
+                    else:
+                        _build_calidad_full(conn)
+                with instrument.step("calidad.finish"):
+                    _finish_calidad(conn)
+
+        with instrument.step("calidad.agg"), eng.begin() as conn:
+            fechas = _refresh_calidad_agg(conn, rangos, CALIDAD_AGG_FULL)
+
+        # geo_id para los municipios nuevos (el agregado ya tiene un par por día)
+        with instrument.step("geo"), eng.begin() as conn:
+            geo.sync(conn, "SELECT departamento, municipio FROM clean_calidad_agg")
+
+        with instrument.step("count"):
+            n = _count(eng, "clean_calidad")
+    print(f"[transform] OK → clean_calidad={n} rows")
+    return {"clean_calidad": n, "clean_calidad_agg_fechas": fechas, **r.summary()}
+
+
+def run() -> dict:
+    """
+    Transforma los staging a tablas limpias y aplica reglas de calidad
+    (ver run_prestadores / run_calidad). Cada bloque corre en su propia transacción;
+    el DAG los agenda como tareas separadas y en paralelo.
+
+    TRANSFORM_MODE=incremental (solo calidad) procesa solo las filas de stg_new nuevas,
+    cambiadas o borradas (por row_hash) y recalcula únicamente los grupos de imputación
+    tocados; prestadores siempre se reconstruye completo.
+    PUBLISH_MODE=swap (solo modo full) construye en tablas sombra y las publica con rename.
+    """
+    with instrument.run("transform") as r:
+        n1 = run_prestadores()["clean_staging"]
+        n2 = run_calidad()["clean_calidad"]
+    print(f"[transform] OK → clean_staging={n1} rows | clean_calidad={n2} rows")
+    return {"clean_staging": n1, "clean_calidad": n2, **r.summary()}
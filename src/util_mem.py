@@ -0,0 +1,17 @@
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peak_rss_mb() -> float:
+    """Pico de memoria residente (RSS) del proceso en MB (0.0 si no disponible)."""
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KB; macOS reporta bytes
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
@@ -0,0 +1,32 @@
+# tests/test_expectations.py
+# Los umbrales de la validación del extract salen del JSON de la suite, sin ajustes
+# en el código.
+import pandas as pd
+import pytest
+
+from src import expectations
+
+
+def _chunk(nulos: int, filas: int = 1000) -> pd.DataFrame:
+    return pd.DataFrame({
+        "departamento": [None] * nulos + ["ANTIOQUIA"] * (filas - nulos),
+        "municipio": ["MEDELLIN"] * filas,
+    })
+
+
+def test_quality_raw_tolera_lo_que_dice_el_json():
+    suite = expectations.load_suite("quality_raw")
+    suite.validate(_chunk(nulos=10))
+    suite.finish()
+    assert suite.summary()["success"]
+
+    suite = expectations.load_suite("quality_raw")
+    suite.validate(_chunk(nulos=11))
+    with pytest.raises(expectations.ExpectationError):
+        suite.finish()
+
+
+def test_quality_sigue_estricta():
+    suite = expectations.load_suite("quality")
+    with pytest.raises(expectations.ExpectationError):
+        suite.validate(_chunk(nulos=1))
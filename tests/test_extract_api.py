@@ -0,0 +1,34 @@
+# tests/test_extract_api.py
+# La paginación concurrente de extract_api devuelve las mismas filas, en el mismo
+# orden, que la secuencial (contra bench/fake_api.py, sin red).
+import pandas as pd
+import pytest
+
+from bench import fake_api
+from src import extract_api
+
+
+@pytest.fixture
+def api(monkeypatch):
+    server, url = fake_api.start(rows=2345, latency=0.0)
+    monkeypatch.setattr(extract_api, "API_URL", url)
+    monkeypatch.setattr(extract_api, "LIMIT", 500)
+    monkeypatch.setattr(extract_api, "API_CACHE", False)
+    monkeypatch.setattr(extract_api, "BACKOFF_SEC", 0)
+    yield server
+    server.shutdown()
+
+
+@pytest.mark.parametrize("concurrency", [2, 4, 8])
+def test_concurrente_igual_a_secuencial(api, concurrency):
+    sec = extract_api.fetch_all(concurrency=1)
+    con = extract_api.fetch_all(concurrency=concurrency)
+    assert len(sec) == 2345
+    pd.testing.assert_frame_equal(sec, con)
+
+
+def test_total_multiplo_de_limit(api, monkeypatch):
+    # la última página llena no debe disparar páginas extra ni perder filas
+    monkeypatch.setattr(extract_api, "LIMIT", 469)  # 2345 = 5 * 469
+    con = extract_api.fetch_all(concurrency=4)
+    assert con["nombre"].tolist() == [f"PRESTADOR {i}" for i in range(2345)]
@@ -0,0 +1,60 @@
+# tests/test_load.py
+# Conteos insertadas / actualizadas / sin cambios de load._upsert, en SQLite y en
+# PostgreSQL (también con INSTRUMENT_EXPLAIN=1: el plan no debe alterar el RETURNING).
+import pytest
+from sqlalchemy import create_engine, text
+
+from src import instrument, load
+
+_COLS = {"k": "k", "v": "v"}
+
+
+def _stage(conn, filas) -> None:
+    conn.execute(text("DELETE FROM t_stage;"))
+    conn.execute(text("INSERT INTO t_stage (k, v) VALUES (:k, :v);"), [{"k": k, "v": v} for k, v in filas])
+
+
+def _escenario(conn, dialect: str) -> None:
+    temp = "TEMP " if dialect == "postgresql" else ""
+    conn.execute(text(f"CREATE {temp}TABLE t (k TEXT PRIMARY KEY, v TEXT, row_hash TEXT);"))
+    conn.execute(text(f"CREATE {temp}TABLE t_stage (k TEXT, v TEXT, row_hash TEXT);"))
+    if dialect == "sqlite":
+        load._sqlite_md5(conn)
+
+    _stage(conn, [("a", "1"), ("b", "2")])
+    assert load._upsert(conn, dialect, "t", ["k"], _COLS, "1 = 1") == \
+        {"staged": 2, "inserted": 2, "updated": 0, "unchanged": 0}
+
+    # a igual, b cambia, c nueva
+    _stage(conn, [("a", "1"), ("b", "3"), ("c", "4")])
+    assert load._upsert(conn, dialect, "t", ["k"], _COLS, "1 = 1") == \
+        {"staged": 3, "inserted": 1, "updated": 1, "unchanged": 1}
+    assert dict(conn.execute(text("SELECT k, v FROM t;")).all()) == {"a": "1", "b": "3", "c": "4"}
+
+    # hechos (update=False): la primera versión de cada clave se queda
+    _stage(conn, [("a", "9"), ("d", "5")])
+    assert load._upsert(conn, dialect, "t", ["k"], _COLS, "1 = 1", update=False) == \
+        {"staged": 2, "inserted": 1, "updated": 0, "unchanged": 1}
+    assert conn.execute(text("SELECT v FROM t WHERE k = 'a';")).scalar() == "1"
+
+
+def test_upsert_sqlite(tmp_path):
+    eng = create_engine(f"sqlite:///{tmp_path / 'load.db'}")
+    with eng.begin() as conn:
+        _escenario(conn, "sqlite")
+
+
+@pytest.mark.parametrize("explain", [False, True])
+def test_upsert_postgres(pg_engine, monkeypatch, tmp_path, explain):
+    monkeypatch.setattr(instrument, "INSTRUMENT", True)
+    monkeypatch.setattr(instrument, "INSTRUMENT_EXPLAIN", explain)
+    monkeypatch.setattr(instrument, "INSTRUMENT_DIR", tmp_path)
+    with instrument.run("test_load") as r:
+        with pg_engine.connect() as conn:
+            trans = conn.begin()
+            try:
+                _escenario(conn, "postgresql")
+            finally:
+                trans.rollback()
+    planes = [s for s in r.statements if "plan" in s]
+    assert bool(planes) == explain